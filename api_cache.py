@@ -0,0 +1,124 @@
+"""
+Persistent cache for Anna's Archive API responses.
+
+Search results are keyed by the normalized query parameters and download
+links by md5, so repeating a search (or rerunning sendadd after a failed
+send) does not spend RapidAPI quota again. Entries expire after a TTL and
+the table is capped in size, evicting the least recently used rows.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def normalize_query(params):
+    """
+    Build a stable cache key from search parameters: keys sorted, values
+    trimmed, case-folded and whitespace-collapsed, comma lists sorted.
+    """
+    normalized = {}
+    for key, value in params.items():
+        value = " ".join(str(value).split()).lower()
+        if "," in value:
+            value = ",".join(sorted(part.strip() for part in value.split(",")))
+        normalized[key] = value
+    return json.dumps(normalized, sort_keys=True)
+
+
+class ApiCache:
+    """
+    SQLite-backed key/value cache with TTLs and LRU eviction. Safe to share
+    between threads. When `enabled` is False every lookup misses and nothing
+    is written (used for --no-cache).
+    """
+
+    def __init__(self, path, max_entries=5000, enabled=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_used REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+            self.conn.commit()
+        return self.conn
+
+    def get(self, namespace, key):
+        """Return the cached value, or None if missing, expired or disabled."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            with self.lock:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] < now:
+                    conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+                    conn.commit()
+                    return None
+                conn.execute(
+                    "UPDATE cache SET last_used = ? WHERE namespace = ? AND key = ?",
+                    (now, namespace, key),
+                )
+                conn.commit()
+                return json.loads(row[0])
+        except (sqlite3.Error, ValueError):
+            # A broken cache must never break a download
+            return None
+
+    def set(self, namespace, key, value, ttl):
+        """Store a JSON-serializable value for `ttl` seconds."""
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            with self.lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, last_used)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (namespace, key, json.dumps(value), now + ttl, now),
+                )
+                self._evict(conn, now)
+                conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn, now):
+        """Drop expired rows, then the least recently used ones above max_entries."""
+        conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM cache WHERE rowid IN"
+                " (SELECT rowid FROM cache ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self):
+        with self.lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM cache")
+            conn.commit()
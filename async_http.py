@@ -0,0 +1,270 @@
+"""
+Asyncio HTTP engine for the book downloader.
+
+The asyncio counterpart of http_client: one aiohttp connection pool per
+event loop, a cap on concurrent connections per host (an asyncio.Semaphore
+per host on top of the connector limits), the same token buckets for the
+rate-limited API hosts, and the same retry policy (RETRY_STATUSES and
+connection errors, full-jitter backoff, Retry-After).
+
+Code running in its own event loop (a service) awaits the *_async functions
+directly. The sync functions of the program run their coroutine with
+run_sync(), on one background event loop shared by every thread, so that
+dozens of concurrent fetches share one pool instead of a thread each.
+"""
+import asyncio
+import json
+import random
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+from http_client import RETRY_STATUSES, TokenBucket, parse_retry_after
+
+
+def retry_errors():
+    """Exceptions worth retrying (aiohttp is only imported once a request is made)."""
+    import aiohttp
+    return (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+
+class AsyncResponse:
+    """
+    A fully read response. Has the parts of requests.Response the callers
+    use (status_code, headers, content, text, json()).
+    """
+
+    def __init__(self, status_code, headers, content, url, charset=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.charset = charset
+
+    @property
+    def text(self):
+        return self.content.decode(self.charset or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class _LoopState:
+    """The session and per-host semaphores of one event loop (aiohttp objects are loop-bound)."""
+
+    def __init__(self):
+        self.session = None
+        self.semaphores = {}
+
+
+class AsyncHttpClient:
+    """
+    Pooled asyncio HTTP client with per-host limits and retries. Use
+    get_async_client() for the shared instance. It can be used from several
+    event loops; each gets its own connection pool.
+    """
+
+    def __init__(self, pool_size=100, per_host_limit=8, host_limits=None, timeout=60, connect_timeout=10,
+                 max_retries=4, backoff_base=0.5, backoff_max=30.0, rate=5.0, burst=5, rate_limited_hosts=()):
+        self.pool_size = pool_size
+        self.per_host_limit = per_host_limit
+        self.host_limits = dict(host_limits or {})
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate = rate
+        self.burst = burst
+        self.rate_limited_hosts = set(rate_limited_hosts)
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.loops = weakref.WeakKeyDictionary()
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self.loops.get(loop)
+        if state is None:
+            state = self.loops[loop] = _LoopState()
+        return state
+
+    def session(self):
+        """The aiohttp session of the running loop, created on first use."""
+        state = self._state()
+        if state.session is None or state.session.closed:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.per_host_limit)
+            timeout = aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_read=self.timeout)
+            state.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return state.session
+
+    def host_semaphore(self, url):
+        """Semaphore limiting concurrent requests to the url's host."""
+        host = urlparse(url).hostname
+        semaphores = self._state().semaphores
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(self.host_limits.get(host, self.per_host_limit))
+        return semaphores[host]
+
+    def bucket_for(self, url):
+        """Return the token bucket for a rate-limited host, or None."""
+        host = urlparse(url).hostname
+        if host not in self.rate_limited_hosts:
+            return None
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _send(self, url, headers, params, bucket, attempts):
+        """
+        GET url, retrying connection errors and RETRY_STATUSES for the attempt
+        numbers left in `attempts` (an iterator shared with the caller's own
+        retries). Returns (response, attempt), the last response once retries
+        run out. The caller holds the host's semaphore.
+        """
+        for attempt in attempts:
+            if bucket:
+                while wait := bucket.reserve():
+                    await asyncio.sleep(wait)
+            try:
+                response = await self.session().get(url, headers=headers, params=params)
+            except retry_errors():
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+
+            if bucket:
+                bucket.update_from_headers(response.headers)
+            if response.status not in RETRY_STATUSES or attempt == self.max_retries:
+                return response, attempt
+
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            delay = max(retry_after or 0, self.backoff(attempt))
+            if bucket and response.status == 429:
+                bucket.pause(delay)
+            response.release()
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def stream(self, url, headers=None, params=None):
+        """
+        GET url and yield the aiohttp response with its body unread, holding
+        the host's semaphore until the block exits. Connection errors and
+        RETRY_STATUSES are retried before anything is yielded; the last
+        response is yielded once retries run out so callers can still report
+        the status code.
+        """
+        async with self.host_semaphore(url):
+            response, _ = await self._send(url, headers, params, self.bucket_for(url),
+                                           iter(range(self.max_retries + 1)))
+            try:
+                yield response
+            finally:
+                response.release()
+
+    async def get(self, url, headers=None, params=None):
+        """
+        GET url and return the whole body as an AsyncResponse (for API calls).
+        A body that breaks off is retried too, out of the same max_retries.
+        """
+        attempts = iter(range(self.max_retries + 1))
+        bucket = self.bucket_for(url)
+        async with self.host_semaphore(url):
+            while True:
+                response, attempt = await self._send(url, headers, params, bucket, attempts)
+                try:
+                    content = await response.read()
+                    return AsyncResponse(response.status, response.headers, content, str(response.url),
+                                         response.charset)
+                except retry_errors():
+                    # The body broke off after the headers arrived
+                    if attempt == self.max_retries:
+                        raise
+                finally:
+                    response.release()
+                await asyncio.sleep(self.backoff(attempt))
+
+    async def close(self):
+        """Close the running loop's connection pool."""
+        state = self.loops.pop(asyncio.get_running_loop(), None)
+        if state is not None and state.session is not None:
+            await state.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_async_client():
+    """Return the shared client, creating it with default settings if needed."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AsyncHttpClient()
+        return _client
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def background_loop():
+    """The event loop behind run_sync(), started in a daemon thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-http", daemon=True).start()
+        return _loop
+
+
+def run_sync(coroutine):
+    """
+    Run a coroutine on the background loop and block until it finishes.
+    Safe to call from any thread except the background loop itself.
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, background_loop())
+    try:
+        return future.result()
+    except BaseException:
+        # Ctrl+C in the calling thread: stop the coroutine too
+        future.cancel()
+        raise
+
+
+def iterate_sync(async_iterator):
+    """
+    Iterate an async iterator (an async generator) on the background loop,
+    yielding each item to the blocking caller as soon as it is produced.
+    Closing the generator early (break) closes the async iterator too.
+    """
+    done = object()
+
+    async def next_item():
+        try:
+            return await async_iterator.__anext__()
+        except StopAsyncIteration:
+            return done
+
+    try:
+        while True:
+            item = run_sync(next_item())
+            if item is done:
+                return
+            yield item
+    finally:
+        if hasattr(async_iterator, 'aclose'):
+            run_sync(async_iterator.aclose())
+
+
+def shutdown():
+    """Close the background loop's connection pool (for atexit)."""
+    if _loop is not None and _client is not None:
+        run_sync(_client.close())
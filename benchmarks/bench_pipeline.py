@@ -0,0 +1,350 @@
+"""
+Benchmark for the EPUB processing pipeline on synthetic books.
+
+Generates EPUB 2 / EPUB 3 books offline, varying chapter count, words per
+chapter, markup nesting depth and image payload, then times each phase of
+inject_page_numbers (read, marker injection, nav generation, repack) plus
+the page-marker scan used by sendpages and search result selection. Every case
+runs in a fresh subprocess so its peak RSS is its own. Books of 300+ chapters
+are injected once on one process and once on a process pool, and the
+speedup is reported.
+
+Usage:
+    python benchmarks/bench_pipeline.py                        # default matrix
+    python benchmarks/bench_pipeline.py --quick                # small matrix
+    python benchmarks/bench_pipeline.py --output base.json
+    python benchmarks/bench_pipeline.py --quick --parallel-workers 8
+    python benchmarks/bench_pipeline.py --compare base.json    # flag regressions
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = ("the quick brown fox jumps over a lazy dog while reading an old "
+         "book about distant ships and quiet harbours").split()
+
+DEFAULT_MATRIX = {
+    "version": [2, 3],
+    "chapters": [10, 100, 400],
+    "words_per_chapter": [2000, 8000],
+    "nesting": [0, 4],
+    "image_kb": [0, 256],
+}
+# Books with at least this many chapters are also injected on a process pool
+# (--parallel-workers), next to the single-process run of the same case
+PARALLEL_MIN_CHAPTERS = 300
+# Added when the matrix has no such book (e.g. --quick)
+PARALLEL_CASE = {"version": 3, "chapters": 400, "words_per_chapter": 2000, "nesting": 0, "image_kb": 0,
+                 "engine": "stream"}
+
+# Markers the page scan looks for, as page_scan_marker_limit in config.py
+PAGE_SCAN_MARKER_LIMIT = 200
+
+QUICK_MATRIX = {
+    "version": [2, 3],
+    "chapters": [10, 50],
+    "words_per_chapter": [2000],
+    "nesting": [0, 3],
+    "image_kb": [0, 64],
+}
+
+
+def chapter_xhtml(index, words, nesting, with_image, rng):
+    """One chapter: paragraphs of random words wrapped in `nesting` divs."""
+    paragraphs = []
+    remaining = words
+    while remaining > 0:
+        count = min(remaining, rng.randint(20, 120))
+        remaining -= count
+        text = " ".join(rng.choice(WORDS) for _ in range(count))
+        paragraphs.append("<div>" * nesting + f"<p>{text}</p>" + "</div>" * nesting)
+    image = f'<img src="images/img{index}.jpg" alt=""/>' if with_image else ""
+    return ("<?xml version='1.0' encoding='utf-8'?>\n"
+            '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Chapter</title></head>'
+            f"<body><h1>Chapter {index + 1}</h1>{image}{''.join(paragraphs)}</body></html>")
+
+
+def generate_epub(path, version=3, chapters=10, words_per_chapter=2000, nesting=0, image_kb=0, seed=1):
+    """Write a synthetic, valid EPUB 2 or 3 book to path. Returns the total word count."""
+    rng = random.Random(seed)
+    manifest = []
+    spine = []
+    nav_points = []
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        z.writestr("META-INF/container.xml",
+                   '<?xml version="1.0"?><container version="1.0" '
+                   'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+                   '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                   '</rootfiles></container>')
+
+        for i in range(chapters):
+            name = f"chapter{i}.xhtml"
+            z.writestr(f"OEBPS/{name}", chapter_xhtml(i, words_per_chapter, nesting, image_kb > 0, rng))
+            manifest.append(f'<item id="c{i}" href="{name}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="c{i}"/>')
+            nav_points.append((i, name))
+            if image_kb:
+                # Random bytes do not compress, like real JPEGs
+                z.writestr(f"OEBPS/images/img{i}.jpg", rng.randbytes(image_kb * 1024))
+                manifest.append(f'<item id="img{i}" href="images/img{i}.jpg" media-type="image/jpeg"/>')
+
+        if version >= 3:
+            links = "".join(f'<li><a href="{name}">Chapter {i + 1}</a></li>' for i, name in nav_points)
+            z.writestr("OEBPS/nav.xhtml",
+                       '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml" '
+                       'xmlns:epub="http://www.idpf.org/2007/ops"><head><title>Nav</title></head><body>'
+                       f'<nav epub:type="toc" id="toc"><ol>{links}</ol></nav></body></html>')
+            manifest.append('<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>')
+        else:
+            points = "".join(f'<navPoint id="np{i}" playOrder="{i + 1}"><navLabel><text>Chapter {i + 1}</text>'
+                             f'</navLabel><content src="{name}"/></navPoint>' for i, name in nav_points)
+            z.writestr("OEBPS/toc.ncx",
+                       '<?xml version="1.0" encoding="utf-8"?><ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" '
+                       'version="2005-1"><head><meta name="dtb:uid" content="bench"/></head>'
+                       f'<docTitle><text>Bench</text></docTitle><navMap>{points}</navMap></ncx>')
+            manifest.append('<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>')
+
+        spine_attrs = "" if version >= 3 else ' toc="ncx"'
+        z.writestr("OEBPS/content.opf",
+                   f'<?xml version="1.0" encoding="utf-8"?><package xmlns="http://www.idpf.org/2007/opf" '
+                   f'version="{"3.0" if version >= 3 else "2.0"}" unique-identifier="id">'
+                   '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                   '<dc:identifier id="id">bench-book</dc:identifier><dc:title>Benchmark Book</dc:title>'
+                   '<dc:language>en</dc:language><dc:creator>Bench</dc:creator></metadata>'
+                   f'<manifest>{"".join(manifest)}</manifest>'
+                   f'<spine{spine_attrs}>{"".join(spine)}</spine></package>')
+
+    return chapters * words_per_chapter
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, in MB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(case):
+    """
+    Run one benchmark case in this process and return its result dict.
+    Only the EPUB modules are imported: book_downloader would also open the
+    caches and the outbox, which would count in the case's peak RSS.
+    """
+    import epub_pages
+    from ebooklib import epub
+    from epub_inspect import detect_page_navigation
+
+    result = dict(case)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "book.epub")
+        output = os.path.join(tmp, "out.epub")
+        total_words = generate_epub(source, case["version"], case["chapters"], case["words_per_chapter"],
+                                    case["nesting"], case["image_kb"])
+        result["input_mb"] = round(os.path.getsize(source) / (1024 * 1024), 3)
+        timings = {}
+
+        started = time.perf_counter()
+        book = epub.read_epub(source)
+        originals = epub_pages.item_contents(book)
+        timings["read"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        pages, _ = epub_pages.insert_page_markers(book, engine=case["engine"], workers=case.get("workers", 1))
+        timings["inject"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        epub_pages.build_page_navigation(book, pages)
+        timings["nav"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            epub_pages.repack_changes(book, originals, source, output)
+            result["output_mb"] = round(os.path.getsize(output) / (1024 * 1024), 3)
+        except Exception as e:
+            result["write_error"] = str(e)
+        timings["write"] = time.perf_counter() - started
+
+        # The marker scan sendpages runs on a candidate (up to its default limit)
+        started = time.perf_counter()
+        with zipfile.ZipFile(source) as archive:
+            detect_page_navigation(archive, scan_documents=True, stop_after=PAGE_SCAN_MARKER_LIMIT)
+        timings["page_scan"] = time.perf_counter() - started
+
+        result["pages"] = len(pages)
+        result["seconds"] = {name: round(value, 4) for name, value in timings.items()}
+        result["total_seconds"] = round(sum(timings.values()), 4)
+        result["words_per_second_inject"] = round(total_words / timings["inject"]) if timings["inject"] else None
+        result["mb_per_second_read"] = round(result["input_mb"] / timings["read"], 2) if timings["read"] else None
+        result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def bench_parse_size():
+    """
+    Micro-benchmark for parse_size_to_mb (uncached) over a realistic mix of
+    size strings, and for building, filtering and sorting a ResultSet of
+    search results as sendadd and batch do.
+    """
+    from results import ResultSet, parse_size_to_mb
+    samples = ["1.2MB", "500KB", "3.4 GB", "0.9mb", "12kb", "n/a", ""] * 100
+    runs = 20
+    parse = parse_size_to_mb.__wrapped__
+    seconds = timeit.timeit(lambda: [parse(s) for s in samples], number=runs)
+    books = [{"md5": f"{i:032x}", "title": f"Book {i}", "author": "Author", "format": "epub", "size": size}
+             for i, size in enumerate(samples)]
+    select_seconds = timeit.timeit(
+        lambda: ResultSet.from_books(books).filter(max_size_mb=3.0).sort_by_size().head(5), number=runs)
+    return {"calls": len(samples) * runs, "seconds": round(seconds, 4),
+            "ns_per_call": round(seconds / (len(samples) * runs) * 1e9),
+            "result_set_us_per_row": round(select_seconds / (len(books) * runs) * 1e6, 3)}
+
+
+def build_cases(matrix, engines, parallel_workers=None):
+    """
+    The cases of the matrix, single-process. With parallel_workers, every
+    stream case of a book with PARALLEL_MIN_CHAPTERS chapters or more is
+    run again on that many processes (PARALLEL_CASE when there is none).
+    """
+    keys = list(matrix)
+    cases = []
+    for values in itertools.product(*(matrix[key] for key in keys)):
+        for engine in engines:
+            case = dict(zip(keys, values))
+            case["engine"] = engine
+            case["workers"] = 1
+            cases.append(case)
+    if parallel_workers and parallel_workers > 1:
+        large = [case for case in cases if case["engine"] == "stream" and case["chapters"] >= PARALLEL_MIN_CHAPTERS]
+        if not large:
+            large = [dict(PARALLEL_CASE, workers=1)]
+            cases.extend(large)
+        cases.extend(dict(case, workers=parallel_workers) for case in large)
+    return cases
+
+
+def case_key(case):
+    return (case["version"], case["chapters"], case["words_per_chapter"],
+            case["nesting"], case["image_kb"], case["engine"], case.get("workers", 1))
+
+
+def case_label(case):
+    return "v{}/{}ch/{}w/n{}/img{}/{}/{}p".format(*case_key(case))
+
+
+def parallel_speedups(results):
+    """Inject time on one process vs on a pool, for the cases run both ways."""
+    single = {case_key(result)[:-1]: result for result in results
+              if result.get("workers", 1) == 1 and "seconds" in result}
+    speedups = []
+    for result in results:
+        base = single.get(case_key(result)[:-1])
+        if result.get("workers", 1) > 1 and base and "seconds" in result:
+            serial, parallel = base["seconds"]["inject"], result["seconds"]["inject"]
+            speedups.append({"case": case_label(result), "workers": result["workers"],
+                             "inject_seconds_1": serial, "inject_seconds_n": parallel,
+                             "speedup": round(serial / parallel, 2) if parallel else None})
+    return speedups
+
+
+def compare(current, baseline, threshold):
+    """Print per-case timing deltas; returns the number of regressions above threshold (%)."""
+    previous = {case_key(result): result for result in baseline.get("results", [])}
+    regressions = 0
+    print(f"\n{'case':<48} {'baseline':>10} {'current':>10} {'delta':>8}")
+    for result in current["results"]:
+        old = previous.get(case_key(result))
+        if not old or "total_seconds" not in old or "total_seconds" not in result:
+            continue
+        delta = (result["total_seconds"] - old["total_seconds"]) / old["total_seconds"] * 100 if old["total_seconds"] else 0
+        flag = ""
+        if delta > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        label = case_label(result)
+        print(f"{label:<48} {old['total_seconds']:>10.3f} {result['total_seconds']:>10.3f} {delta:>7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the EPUB processing pipeline.")
+    parser.add_argument("--quick", action="store_true", help="Use a small case matrix")
+    parser.add_argument("--engines", default="stream,soup", help="Comma-separated injection engines")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against an earlier results file")
+    parser.add_argument("--threshold", type=float, default=15.0, help="Regression threshold in percent")
+    parser.add_argument("--parallel-workers", type=int, default=max(2, os.cpu_count() or 1),
+                        help=f"Processes for the parallel injection cases (books of {PARALLEL_MIN_CHAPTERS}+ "
+                             "chapters); 1 skips them")
+    parser.add_argument("--case", help=argparse.SUPPRESS)   # internal: run one case as JSON
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    matrix = QUICK_MATRIX if args.quick else DEFAULT_MATRIX
+    cases = build_cases(matrix, args.engines.split(","), args.parallel_workers)
+    results = []
+    for number, case in enumerate(cases, 1):
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                                   capture_output=True, text=True, cwd=ROOT)
+        if completed.returncode != 0:
+            result = dict(case, error=completed.stderr.strip().splitlines()[-1:] or ["failed"])
+        else:
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(result)
+        label = case_label(case)
+        summary = (f"{result['total_seconds']:.3f}s  rss {result['peak_rss_mb']} MB"
+                   if "total_seconds" in result else f"ERROR {result.get('error')}")
+        print(f"[{number}/{len(cases)}] {label:<44} {summary}")
+
+    speedups = parallel_speedups(results)
+    for speedup in speedups:
+        print(f"Parallel injection {speedup['case']}: {speedup['inject_seconds_1']:.3f}s on 1 process, "
+              f"{speedup['inject_seconds_n']:.3f}s on {speedup['workers']} ({speedup['speedup']}x)")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "matrix": matrix,
+        },
+        "parse_size_to_mb": bench_parse_size(),
+        "parallel_injection": speedups,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{regressions} case(s) slower than the baseline by more than {args.threshold}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
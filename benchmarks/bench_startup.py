@@ -0,0 +1,166 @@
+"""
+Startup benchmark for the command-line program.
+
+Short invocations (cron jobs, a job runner calling `queue --drain`, a user
+who just wants `view`) pay the interpreter start plus everything
+book_downloader imports at module level. This measures, each in fresh
+subprocesses:
+
+    interpreter    python -c pass (the floor)
+    import         import book_downloader, timed inside the process
+    first_prompt   python book_downloader.py until "Enter a command:" appears
+    queue          python book_downloader.py queue, start to exit
+
+and lists which heavy libraries (HTTP, EPUB, SMTP) were loaded by the
+import, since those should only load when a command needs them. Runs use a
+throwaway HOME so the cache, store and outbox of the real user are untouched.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 15 --output startup.json
+    python benchmarks/bench_startup.py --compare startup.json      # flag regressions
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("requests", "aiohttp", "bs4", "ebooklib", "lxml", "remotezip", "smtplib", "email.message")
+PROMPT = b"Enter a command:"
+
+IMPORT_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+import book_downloader
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "heavy": [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def run_env(home):
+    env = dict(os.environ, HOME=home, PYTHONUNBUFFERED="1")
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    return env
+
+
+def time_command(command, env):
+    started = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, env=env, stdin=subprocess.DEVNULL,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started
+
+
+def time_import(env):
+    completed = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, env=env,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def time_first_prompt(env):
+    """Seconds from starting the REPL until its first prompt is printed."""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "book_downloader.py")], cwd=ROOT, env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    output = b""
+    try:
+        while PROMPT not in output:
+            chunk = os.read(process.stdout.fileno(), 4096)
+            if not chunk:
+                raise RuntimeError("program exited before prompting")
+            output += chunk
+        elapsed = time.perf_counter() - started
+        process.stdin.write(b"exit\n")
+        process.stdin.flush()
+        process.wait(timeout=30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+    return elapsed
+
+
+def summarize(samples):
+    return {"median_ms": round(statistics.median(samples) * 1000, 1),
+            "min_ms": round(min(samples) * 1000, 1),
+            "max_ms": round(max(samples) * 1000, 1),
+            "runs": len(samples)}
+
+
+def compare(current, baseline, threshold):
+    """Print per-measurement deltas; returns the number of regressions above threshold (%)."""
+    regressions = 0
+    print(f"\n{'measurement':<14} {'baseline':>10} {'current':>10} {'delta':>8}")
+    for name, result in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        delta = (result["median_ms"] - old["median_ms"]) / old["median_ms"] * 100 if old["median_ms"] else 0
+        flag = ""
+        if delta > threshold and name != "interpreter":
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{name:<14} {old['median_ms']:>8.1f}ms {result['median_ms']:>8.1f}ms {delta:>7.1f}%{flag}")
+    newly_heavy = set(current["heavy_modules_at_import"]) - set(baseline.get("heavy_modules_at_import", []))
+    if newly_heavy:
+        regressions += 1
+        print(f"Now loaded at import: {', '.join(sorted(newly_heavy))}  REGRESSION")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of book_downloader.py.")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per measurement (the median is reported)")
+    parser.add_argument("--output", default="startup_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against an earlier results file")
+    parser.add_argument("--threshold", type=float, default=20.0, help="Regression threshold in percent")
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix="epub-startup-")
+    env = run_env(home)
+    # Warm the bytecode caches so the first run is not an outlier
+    time_import(env)
+
+    samples = {"interpreter": [], "import": [], "first_prompt": [], "queue": []}
+    heavy = set()
+    for _ in range(args.runs):
+        samples["interpreter"].append(time_command([sys.executable, "-c", "pass"], env))
+        imported = time_import(env)
+        samples["import"].append(imported["seconds"])
+        heavy.update(imported["heavy"])
+        samples["first_prompt"].append(time_first_prompt(env))
+        samples["queue"].append(time_command([sys.executable, "book_downloader.py", "queue"], env))
+
+    results = {name: summarize(values) for name, values in samples.items()}
+    for name, result in results.items():
+        print(f"{name:<14} median {result['median_ms']:>7.1f} ms   (min {result['min_ms']:.1f}, max {result['max_ms']:.1f})")
+    print(f"Heavy libraries loaded at import: {', '.join(sorted(heavy)) or 'none'}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+        "heavy_modules_at_import": sorted(heavy),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{regressions} measurement(s) regressed by more than {args.threshold}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
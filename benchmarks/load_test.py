@@ -0,0 +1,287 @@
+"""
+Load driver for the downloader's network paths, run against the local mock
+API (benchmarks/mock_server.py) so pooling and retry settings can be tuned
+without spending RapidAPI quota.
+
+Each operation calls the same functions the commands use:
+    search    search_books()
+    resolve   fetch_download_link()
+    download  fetch_download_link() + the segmented downloader
+    batch     process_batch_entry() (search, select, download[, inject])
+    mix       a random one of the above per operation
+
+The API cache is bypassed and books go to a throwaway store, so every
+operation really hits the server. Reports p50/p90/p99 latency, throughput
+and error rates per operation, plus what the server injected.
+
+Usage:
+    python benchmarks/load_test.py --scenario mix --concurrency 8 --requests 200 \\
+        --latency-ms 30 --rate-429 0.05 --truncate 0.02
+    python benchmarks/load_test.py --url http://127.0.0.1:8765 --duration 30
+"""
+import argparse
+import contextlib
+import dataclasses
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+import mock_server
+from segmented_download import download_file
+
+SCENARIOS = ("search", "resolve", "download", "batch")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class LoadRunner:
+    def __init__(self, bd, catalog, work_dir, options):
+        self.bd = bd
+        self.catalog = catalog
+        self.work_dir = work_dir
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.random_lock = threading.Lock()
+        self.results = {}
+        self.results_lock = threading.Lock()
+        self.batch_options = types.SimpleNamespace(
+            ext="epub", policy=options.policy, max_size=None, output_dir=work_dir,
+            inject=options.inject, send=False)
+
+    def pick(self, sequence):
+        with self.random_lock:
+            return self.random.choice(sequence)
+
+    def record(self, scenario, seconds, error=None, nbytes=0):
+        with self.results_lock:
+            stats = self.results.setdefault(scenario, {"latencies": [], "errors": {}, "bytes": 0})
+            stats["latencies"].append(seconds)
+            stats["bytes"] += nbytes
+            if error:
+                stats["errors"][error] = stats["errors"].get(error, 0) + 1
+
+    def run_search(self):
+        book = self.pick(self.catalog)
+        querystring = {"q": book["title"], "ext": book["format"], "sort": "mostRelevant",
+                       "source": "libgenLi, libgenRs"}
+        books = self.bd.search_books(querystring)
+        if not books or not books.get("books"):
+            return "no_results", 0
+        return None, 0
+
+    def run_resolve(self):
+        if not self.bd.fetch_download_link(self.pick(self.catalog)["md5"]):
+            return "no_link", 0
+        return None, 0
+
+    def run_download(self):
+        book = self.pick(self.catalog)
+        link = self.bd.fetch_download_link(book["md5"])
+        if not link:
+            return "no_link", 0
+        fd, dest = tempfile.mkstemp(dir=self.work_dir, suffix="." + book["format"])
+        os.close(fd)
+        try:
+            config = self.bd.client.config
+            download_file(link, dest, segments=config.download_segments,
+                          min_segment_size=int(config.download_segment_min_mb * 1024 * 1024),
+                          client=self.bd.client.http)
+            size = os.path.getsize(dest)
+            if size != len(book["payload"]):
+                return "wrong_size", size
+            return None, size
+        finally:
+            for path in (dest, dest + ".part", dest + ".manifest.json"):
+                if os.path.exists(path): os.remove(path)
+
+    def run_batch(self):
+        book = self.pick([book for book in self.catalog if book["format"] == "epub"])
+        # Own output directory, so concurrent runs of the same title do not collide
+        options = types.SimpleNamespace(**vars(self.batch_options))
+        options.output_dir = tempfile.mkdtemp(dir=self.work_dir)
+        try:
+            record = self.bd.process_batch_entry({"query": book["title"], "md5": None}, options)
+            nbytes = os.path.getsize(record["path"]) if record["path"] and os.path.exists(record["path"]) else 0
+        finally:
+            shutil.rmtree(options.output_dir, ignore_errors=True)
+        # The store would answer repeats without the network; keep every run cold
+        stored = self.bd.book_store.path_for(record["md5"]) if record["md5"] else None
+        if stored and os.path.exists(stored):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(stored)
+        if record["status"] != "ok":
+            return record["status"] + (f": {record['error']}" if record["error"] else ""), nbytes
+        return None, nbytes
+
+    def run_one(self, scenario):
+        if scenario == "mix":
+            scenario = self.pick(SCENARIOS)
+        started = time.perf_counter()
+        try:
+            error, nbytes = getattr(self, f"run_{scenario}")()
+        except Exception as e:
+            error, nbytes = type(e).__name__, 0
+        self.record(scenario, time.perf_counter() - started, error, nbytes)
+
+    def run(self, scenario, concurrency, requests_total=None, duration=None):
+        """Run operations on `concurrency` threads until the count or the duration is reached."""
+        remaining = [requests_total]
+        counter_lock = threading.Lock()
+        deadline = time.monotonic() + duration if duration else None
+
+        def worker():
+            while True:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                if requests_total is not None:
+                    with counter_lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                self.run_one(scenario)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        return time.perf_counter() - started
+
+    def summary(self, elapsed):
+        report = {}
+        for scenario, stats in sorted(self.results.items()):
+            latencies = stats["latencies"]
+            failed = sum(stats["errors"].values())
+            report[scenario] = {
+                "operations": len(latencies),
+                "errors": failed,
+                "error_rate": round(failed / len(latencies), 4) if latencies else 0,
+                "error_kinds": stats["errors"],
+                "ops_per_second": round(len(latencies) / elapsed, 2) if elapsed else None,
+                "mb_per_second": round(stats["bytes"] / (1024 * 1024) / elapsed, 2) if elapsed else None,
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+                "p90_ms": round(percentile(latencies, 0.90) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+                "max_ms": round(max(latencies) * 1000, 1),
+            }
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the downloader against the local mock API.")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("mix",), default="mix")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100, help="Total operations (ignored with --duration)")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds instead")
+    parser.add_argument("--url", help="Use an already running mock server instead of starting one")
+    parser.add_argument("--policy", choices=("first", "smallest", "epub3"), default="first",
+                        help="Selection policy for the batch scenario")
+    parser.add_argument("--inject", action="store_true", help="Inject page numbers in the batch scenario")
+    # Client settings under test (default to the values in config.py)
+    parser.add_argument("--pool-size", type=int)
+    parser.add_argument("--per-host", type=int, help="Concurrent connections per host (async engine)")
+    parser.add_argument("--retries", type=int)
+    parser.add_argument("--api-rate", type=float, help="Client-side API requests per second")
+    parser.add_argument("--timeout", type=float)
+    parser.add_argument("--segments", type=int)
+    parser.add_argument("--segment-min-kb", type=int)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    mock_server.add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    import book_downloader as bd
+    from client import BookClient, ClientConfig
+    from http_client import configure_client
+
+    server = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+        print("Using running mock server; generating the matching catalog...")
+    else:
+        print("Generating catalog and starting mock server...")
+    catalog = mock_server.build_catalog(args.books, args.pdfs, seed=args.seed)
+    if not args.url:
+        server = mock_server.start_server(catalog, mock_server.faults_from_args(args))
+        base_url = server.base_url
+
+    work_dir = tempfile.mkdtemp(prefix="epub-load-")
+    base_config = ClientConfig.from_module(bd.config)
+    client_config = dataclasses.replace(
+        base_config,
+        api_base_url=base_url,
+        cache_path=None,
+        book_store_dir=os.path.join(work_dir, "store"),
+        async_pool_size=args.pool_size or base_config.async_pool_size,
+        async_per_host_limit=args.per_host or base_config.async_per_host_limit,
+        http_timeout=args.timeout or base_config.http_timeout,
+        http_max_retries=args.retries if args.retries is not None else base_config.http_max_retries,
+        api_requests_per_second=args.api_rate or base_config.api_requests_per_second,
+        download_segments=args.segments or base_config.download_segments,
+        download_segment_min_mb=(args.segment_min_kb / 1024 if args.segment_min_kb is not None
+                                 else base_config.download_segment_min_mb),
+    )
+    bd.use_client(BookClient(client_config))
+    settings = {name: getattr(client_config, name) for name in (
+        "async_pool_size", "async_per_host_limit", "http_timeout", "http_max_retries",
+        "api_requests_per_second", "download_segments", "download_segment_min_mb")}
+    # The remote EPUB probes (epub3 policy) use the requests session
+    configure_client(rate_limited_hosts=[bd.urlparse(base_url).hostname],
+                     pool_size=args.pool_size or getattr(bd.config, 'http_pool_size', 10),
+                     timeout=client_config.http_timeout, max_retries=client_config.http_max_retries,
+                     rate=client_config.api_requests_per_second)
+
+    runner = LoadRunner(bd, catalog, work_dir, args)
+    print(f"Running '{args.scenario}' at concurrency {args.concurrency} against {base_url}...")
+    # The downloader prints progress and errors; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed = runner.run(args.scenario, args.concurrency,
+                             None if args.duration else args.requests, args.duration)
+
+    try:
+        server_stats = requests.get(f"{base_url}/__stats", timeout=10).json()
+    except (requests.exceptions.RequestException, ValueError):
+        server_stats = None
+    if server:
+        server.shutdown()
+        server.server_close()
+
+    report = {"scenario": args.scenario, "concurrency": args.concurrency, "elapsed_seconds": round(elapsed, 3),
+              "client": settings, "results": runner.summary(elapsed), "server": server_stats}
+
+    print(f"\n{'operation':<10} {'ops':>6} {'err%':>6} {'ops/s':>8} {'MB/s':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for scenario, stats in report["results"].items():
+        print(f"{scenario:<10} {stats['operations']:>6} {stats['error_rate'] * 100:>5.1f}% "
+              f"{stats['ops_per_second']:>8} {stats['mb_per_second']:>7} {stats['p50_ms']:>8} {stats['p99_ms']:>8}")
+        for kind, count in stats["error_kinds"].items():
+            print(f"    {count} x {kind}")
+    if server_stats:
+        print("\nServer: " + ", ".join(f"{key}={value}" for key, value in sorted(server_stats.items())))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
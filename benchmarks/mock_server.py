@@ -0,0 +1,341 @@
+"""
+Local stand-in for the Anna's Archive API on RapidAPI and its file host.
+
+Serves the same JSON shapes as the real endpoints:
+    GET /search?q=...&ext=epub      -> {"books": [{title, author, md5, size, format, ...}]}
+    GET /download?md5=...           -> ["http://<host>/files/<md5>.<ext>"]
+    GET /files/<md5>.<ext>          -> the book bytes (range requests supported)
+    GET /__stats                    -> counters of what was served (for the load driver)
+
+The catalog is built from synthetic EPUBs (benchmarks/bench_pipeline.py) and
+small PDFs, and every md5 is the real md5 of its payload, so the downloader's
+integrity checks pass. Faults can be injected to exercise retries and pooling:
+latency, 429s with Retry-After and RapidAPI quota headers, truncated bodies
+and responses without content-length.
+
+Usage:
+    python benchmarks/mock_server.py --port 8765 --latency-ms 50 --rate-429 0.05
+then set api_base_url = "http://127.0.0.1:8765" in config.py.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_pipeline import generate_epub
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+TITLE_WORDS = ("Silent Harbour Winter Atlas Glass River Orchard Lantern Iron Garden "
+               "North Letters Salt Empire Hollow Meridian").split()
+AUTHORS = ("A. Marsh", "J. Okafor", "L. Brandt", "M. Silva", "R. Tanaka", "S. Novak")
+
+
+class Faults:
+    """
+    Fault injection settings. Probabilities are per request; latency is
+    applied to every request as latency_ms +/- jitter_ms.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, rate_429=0.0, retry_after=1, truncate=0.0,
+                 no_content_length=0.0, ranges=True, quota=None, quota_window=1.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.truncate = truncate
+        self.no_content_length = no_content_length
+        self.ranges = ranges
+        self.quota = quota              # API requests allowed per quota_window (None = unlimited)
+        self.quota_window = quota_window
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def roll(self, probability):
+        if probability <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < probability
+
+    def delay(self):
+        if not self.latency_ms and not self.jitter_ms:
+            return
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+
+def minimal_pdf(size, rng):
+    """A small valid-looking PDF padded to roughly `size` bytes."""
+    header = b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\n"
+    padding = rng.randbytes(max(0, size - len(header) - 64))
+    return header + b"%" + padding + b"\ntrailer<</Root 1 0 R>>\n%%EOF\n"
+
+
+def build_catalog(books=20, pdfs=5, chapters=20, words_per_chapter=1500, image_kb=32, seed=7):
+    """
+    Generate the catalog: a list of dicts with the API fields plus 'payload'.
+    EPUBs alternate between version 2 and 3 so the epub3 checks have both.
+    """
+    rng = random.Random(seed)
+    catalog = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for index in range(books + pdfs):
+            is_pdf = index >= books
+            if is_pdf:
+                payload = minimal_pdf(rng.randint(64, 512) * 1024, rng)
+            else:
+                path = os.path.join(tmp, f"{index}.epub")
+                generate_epub(path, version=3 if index % 2 else 2, chapters=chapters,
+                              words_per_chapter=words_per_chapter, image_kb=image_kb, seed=seed + index)
+                with open(path, "rb") as f:
+                    payload = f.read()
+            catalog.append({
+                "title": " ".join(rng.sample(TITLE_WORDS, 3)),
+                "author": rng.choice(AUTHORS),
+                "md5": hashlib.md5(payload).hexdigest(),
+                "imgUrl": "",
+                "size": f"{len(payload) / (1024 * 1024):.1f}MB",
+                "genre": "Fiction",
+                "format": "pdf" if is_pdf else "epub",
+                "year": str(rng.randint(1950, 2024)),
+                "payload": payload,
+            })
+    return catalog
+
+
+class MockArchiveServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, catalog, faults):
+        super().__init__(address, MockArchiveHandler)
+        self.catalog = catalog
+        self.by_md5 = {book["md5"]: book for book in catalog}
+        self.faults = faults
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.quota_used = 0
+        self.quota_reset_at = time.monotonic() + faults.quota_window
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (cancelled probes, injected faults) are expected
+        if isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            self.count("client_disconnects")
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def take_quota(self):
+        """Returns (allowed, remaining, seconds until reset) for one API call."""
+        with self.stats_lock:
+            now = time.monotonic()
+            if now >= self.quota_reset_at:
+                self.quota_used = 0
+                self.quota_reset_at = now + self.faults.quota_window
+            reset = max(0.0, self.quota_reset_at - now)
+            if self.faults.quota is None:
+                return True, None, reset
+            if self.quota_used >= self.faults.quota:
+                return False, 0, reset
+            self.quota_used += 1
+            return True, self.faults.quota - self.quota_used, reset
+
+
+class MockArchiveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, so client pooling is measurable
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        server = self.server
+        server.count("requests")
+        server.faults.delay()
+
+        if url.path == "/__stats":
+            with server.stats_lock:
+                return self.send_json(200, dict(server.stats))
+        if url.path in ("/search", "/download"):
+            return self.api(url.path, params)
+        if url.path.startswith("/files/"):
+            return self.file(url.path[len("/files/"):])
+        server.count("status_404")
+        self.send_json(404, {"message": "Not found"})
+
+    def send_json(self, status, body, extra_headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def api(self, path, params):
+        server = self.server
+        faults = server.faults
+        allowed, remaining, reset = server.take_quota()
+        quota_headers = {}
+        if remaining is not None:
+            quota_headers = {"X-RateLimit-Requests-Limit": str(faults.quota),
+                             "X-RateLimit-Requests-Remaining": str(remaining),
+                             "X-RateLimit-Requests-Reset": f"{reset:.2f}"}
+
+        if not allowed or faults.roll(faults.rate_429):
+            server.count("status_429")
+            quota_headers["Retry-After"] = str(faults.retry_after)
+            return self.send_json(429, {"message": "You have exceeded the rate limit per second for your plan"},
+                                  quota_headers)
+
+        if path == "/search":
+            server.count("search")
+            ext = params.get("ext", "").lower()
+            query = params.get("q", "").lower().split()
+            matches = [book for book in server.catalog if not ext or book["format"] == ext]
+            # Rank books sharing a word with the query first, like a relevance sort
+            matches.sort(key=lambda book: -sum(word in book["title"].lower() for word in query))
+            books = [{key: value for key, value in book.items() if key != "payload"} for book in matches[:10]]
+            return self.send_json(200, {"books": books, "total": len(matches)}, quota_headers)
+
+        server.count("download")
+        book = server.by_md5.get(params.get("md5", "").lower())
+        if book is None:
+            return self.send_json(200, [], quota_headers)
+        return self.send_json(200, [f"{server.base_url}/files/{book['md5']}.{book['format']}"], quota_headers)
+
+    def file(self, name):
+        server = self.server
+        faults = server.faults
+        book = server.by_md5.get(name.split(".", 1)[0].lower())
+        if book is None:
+            server.count("status_404")
+            return self.send_json(404, {"message": "No such file"})
+
+        payload = book["payload"]
+        start, end, status = 0, len(payload) - 1, 200
+        match = RANGE_PATTERN.match(self.headers.get("Range", ""))
+        if match and faults.ranges:
+            first, last = match.groups()
+            if first:
+                start = int(first)
+                end = min(int(last), end) if last else end
+            elif last:
+                start = max(0, len(payload) - int(last))
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(payload)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        body = payload[start:end + 1]
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/epub+zip" if book["format"] == "epub" else "application/pdf")
+        self.send_header("ETag", f'"{book["md5"]}"')
+        if faults.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(payload)}")
+
+        if faults.roll(faults.no_content_length):
+            # No length and no chunking: the body ends when the connection closes
+            server.count("no_content_length")
+            self.send_header("Connection", "close")
+            self.close_connection = True
+            self.end_headers()
+            self.wfile.write(body)
+            server.count("bytes_sent", len(body))
+            return
+
+        self.send_header("Content-Length", str(len(body)))
+        if len(body) > 1 and faults.roll(faults.truncate):
+            # Promise the full length, send part of it, hang up
+            server.count("truncated")
+            self.send_header("Connection", "close")
+            self.close_connection = True
+            self.end_headers()
+            with faults.lock:
+                cut = faults.random.randint(1, len(body) - 1)
+            self.wfile.write(body[:cut])
+            server.count("bytes_sent", cut)
+            return
+
+        self.end_headers()
+        self.wfile.write(body)
+        server.count(f"status_{status}")
+        server.count("bytes_sent", len(body))
+
+
+def add_fault_arguments(parser):
+    """Fault injection flags, shared with load_test.py."""
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random +/- spread on the latency")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of API calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--quota", type=int, help="API calls allowed per --quota-window (adds X-RateLimit headers)")
+    parser.add_argument("--quota-window", type=float, default=1.0)
+    parser.add_argument("--truncate", type=float, default=0.0, help="Fraction of file bodies cut short")
+    parser.add_argument("--no-content-length", type=float, default=0.0,
+                        help="Fraction of file responses sent without content-length")
+    parser.add_argument("--no-ranges", action="store_true", help="Ignore Range headers on the file host")
+    parser.add_argument("--books", type=int, default=20, help="EPUBs in the catalog")
+    parser.add_argument("--pdfs", type=int, default=5, help="PDFs in the catalog")
+    parser.add_argument("--seed", type=int, default=7)
+
+
+def faults_from_args(args):
+    return Faults(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+                  retry_after=args.retry_after, truncate=args.truncate, no_content_length=args.no_content_length,
+                  ranges=not args.no_ranges, quota=args.quota, quota_window=args.quota_window, seed=args.seed)
+
+
+def start_server(catalog, faults, host="127.0.0.1", port=0):
+    """Start the mock server on a background thread and return it (port 0 picks a free port)."""
+    server = MockArchiveServer((host, port), catalog, faults)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the Anna's Archive API and file host.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    print("Generating catalog...")
+    catalog = build_catalog(args.books, args.pdfs, seed=args.seed)
+    server = MockArchiveServer((args.host, args.port), catalog, faults_from_args(args))
+    print(f"Mock API serving {len(catalog)} books at {server.base_url} (Ctrl+C to stop)")
+    print(f'Set api_base_url = "{server.base_url}" in config.py to use it.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,141 +1,201 @@
 import json
-import requests
 import os
-import smtplib
-from email.message import EmailMessage
-from config import email_address, email_password, smtp_server, smtp_port, headers
-
-# --- IMPORTS FOR PAGE HANDLING ---
-from remotezip import RemoteZip
-from bs4 import BeautifulSoup
-from ebooklib import epub
+import argparse
+import atexit
+import csv
+import sys
+import time
+from config import headers
+import config
+from http_client import configure_client, get_client
+from async_http import run_sync, shutdown as shutdown_async_http
+from client import BookClient, ClientConfig, ClientError, IntegrityFailed
+from kindle_delivery import AttachmentTooLarge
+from outbox import Outbox, PENDING, SENDING, SENT, FAILED
+from pipeline import Pipeline, Stage
+from epub_inspect import inspect_epub, detect_page_navigation
+from results import ResultSet
+import instrumentation
+from instrumentation import span, count_bytes
+
+# --- IMPORTS FOR PAGE HANDLING (remotezip, bs4 and ebooklib load when first used) ---
 import warnings
 import logging
 import re # Added for parsing file size strings
+import zipfile
+from urllib.parse import urlparse
+import threading
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 # Suppress warnings from ebooklib
 warnings.filterwarnings('ignore')
 logging.getLogger('ebooklib').setLevel(logging.CRITICAL)
 
-# --- HARDCODED CONSTANTS (To bypass ImportErrors) ---
-ITEM_UNKNOWN     = 0
-ITEM_IMAGE       = 1
-ITEM_STYLE       = 2
-ITEM_SCRIPT      = 3
-ITEM_NAVIGATION  = 4
-ITEM_VECTOR      = 5
-ITEM_FONT        = 6
-ITEM_VIDEO       = 7
-ITEM_AUDIO       = 8
-ITEM_DOCUMENT    = 9
-ITEM_SMIL        = 10
-
-def parse_size_to_mb(size_str):
+# Searches, link lookups, downloads, page numbers and sends go through one
+# BookClient (client.py) built from config.py; use_client() swaps it out
+client = BookClient(ClientConfig.from_module(config))
+atexit.register(lambda: client.close())
+# The shared async client, used by downloads started without a BookClient
+atexit.register(shutdown_async_http)
+
+# Pooled HTTP client with retries, used for the range reads of remote EPUB probes
+configure_client(
+    pool_size=getattr(config, 'http_pool_size', 10),
+    timeout=getattr(config, 'http_timeout', 60),
+    max_retries=getattr(config, 'http_max_retries', 4),
+    rate=getattr(config, 'api_requests_per_second', 5),
+    rate_limited_hosts=[client.config.api_host, urlparse(client.api_base_url).hostname],
+)
+
+# The client's API response cache and book store
+api_cache = client.api_cache
+book_store = client.book_store
+
+# Page injection engine: "stream" (single pass, keeps original bytes) or "soup" (BeautifulSoup)
+INJECTION_ENGINE = client.config.page_injection_engine
+# Books with at least this many chapters are scanned on a process pool (workers <= 1 disables it)
+INJECTION_WORKERS = client.config.injection_workers or os.cpu_count() or 1
+PARALLEL_INJECTION_MIN_CHAPTERS = client.config.parallel_injection_min_chapters
+
+def use_client(new_client):
+    """Run the commands on another BookClient (the load driver uses this to point them at the mock API)."""
+    global client, api_cache, book_store
+    client = new_client
+    api_cache, book_store = new_client.api_cache, new_client.book_store
+
+# Sends are queued in a durable outbox and delivered by a background worker
+outbox = Outbox(
+    os.path.expanduser(getattr(config, 'outbox_dir', "~/.cache/epub-book-downloader/outbox")),
+    send=lambda path, recipient, filename: send_book_email(path, recipient, filename),
+    max_attempts=getattr(config, 'outbox_max_attempts', 5),
+    retry_base=getattr(config, 'outbox_retry_seconds', 30),
+    permanent_errors=(AttachmentTooLarge,),
+)
+
+# How many candidates are resolved/probed at the same time by sendadd/sendpages
+CANDIDATE_WORKERS = 5
+# How many search results sendadd/sendpages (and batch --policy epub3) check, and
+# the largest file sendadd considers (None = no limit)
+CANDIDATE_COUNT = getattr(config, 'candidate_count', 5)
+CANDIDATE_MAX_SIZE_MB = getattr(config, 'candidate_max_size_mb', 3.0)
+# download/downloadpdf list this many search results to pick from
+SEARCH_DISPLAY_COUNT = 5
+# library lists this many matches
+LIBRARY_DISPLAY_COUNT = 20
+# Books without a page list are scanned for pagebreak markers until this many are found
+PAGE_SCAN_MARKER_LIMIT = getattr(config, 'page_scan_marker_limit', 200)
+
+async def fetch_download_link_async(md5):
     """
-    Helper to convert size strings like '1.2MB', '500KB' to float MB.
-    Returns 0 if parsing fails.
+    Resolve a book md5 to a downloadable file URL via the API.
+    Returns None after printing an error when the API response is invalid.
     """
     try:
-        size_str = size_str.upper().strip()
-        # Remove any non-numeric/non-unit chars (keep dots)
-        val = float(re.findall(r"[\d\.]+", size_str)[0])
-        
-        if 'KB' in size_str:
-            return val / 1024
-        elif 'MB' in size_str:
-            return val
-        elif 'GB' in size_str:
-            return val * 1024
-        return 0
-    except:
-        return 0
+        return await client.resolve_async(md5)
+    except ClientError as e:
+        print(f"Error: {e}")
+        return None
+
+def fetch_download_link(md5):
+    """Blocking wrapper around fetch_download_link_async."""
+    return run_sync(fetch_download_link_async(md5))
 
-def parse_api_json(response, context):
+async def search_books_async(querystring):
     """
-    Safely parse JSON API responses and print a user-friendly error on failure.
+    Run a search against the API, or answer it from the on-disk cache.
+    Returns the parsed JSON (a dict with a 'books' list), or None after
+    printing an error.
     """
-    if response.status_code != 200:
-        print(f"Error: {context} failed with status code {response.status_code}")
-        print(f"Response: {response.text[:300]}")
+    try:
+        return (await client.query_async(querystring)).raw
+    except ClientError as e:
+        print(f"Error: {e}")
         return None
 
-    if not response.text.strip():
-        print(f"Error: {context} returned an empty response.")
-        return None
+def search_books(querystring):
+    """Blocking wrapper around search_books_async."""
+    return run_sync(search_books_async(querystring))
 
+def stream_search(title, ext="epub"):
+    """
+    Fan-out search for the interactive commands (BookClient.search_fanout):
+    yields a FanoutUpdate as each query finishes. Prints an error and stops
+    when every query failed.
+    """
     try:
-        return response.json()
-    except requests.exceptions.JSONDecodeError:
-        print(f"Error: {context} returned invalid JSON.")
-        print(f"Raw response: {response.text[:300]}")
+        yield from client.search_fanout(title, ext)
+    except ClientError as e:
+        print(f"Error: {e}")
+
+def search_books_merged(title, ext="epub", enough=None):
+    """
+    Run a whole fan-out search, printing each query as it finishes. When the
+    library has `enough` matches that were downloaded or inspected before
+    (not just seen in search results), the API is not queried. Returns the
+    merged results shaped like search_books ({'books': [...]}, best
+    combined rank first), or None after printing an error.
+    """
+    merged = None
+    for update in stream_search(title, ext):
+        merged = update.merged
+        params = update.result.params
+        if update.local:
+            print(f"  [library] {len(update.result.books)} matches ({update.result.checked} checked before)")
+            if enough and update.result.checked >= enough:
+                print("  Answered from your library (no API quota used).")
+                break
+            continue
+        print(f"  [{update.done}/{update.total}] '{params['q']}' ({params.get('source') or 'all sources'}): "
+              f"{len(update.result.books)} results, {len(update.new_books)} new")
+    if merged is None:
         return None
+    return {'books': [book.raw for book in merged.ranked()]}
 
-def fetch_download_link(md5):
+def show_search_results(title, ext="epub"):
     """
-    Resolve a book md5 to a downloadable file URL via the API.
-    Returns None when the API response is invalid.
+    Print the first SEARCH_DISPLAY_COUNT distinct results of a fan-out
+    search as they come in (numbered in the order shown) and return them.
+    The slower queries are cancelled once enough results are shown.
     """
-    url = "https://annas-archive-api.p.rapidapi.com/download"
+    shown = []
+    from_library = False
     try:
-        response = requests.get(url, headers=headers, params={"md5": md5})
+        for update in stream_search(title, ext):
+            if update.local:
+                from_library = True
+                print("From your library:")
+            elif from_library and update.new_books and len(shown) < SEARCH_DISPLAY_COUNT:
+                from_library = False
+                print("From the API:")
+            for book in update.new_books[:SEARCH_DISPLAY_COUNT - len(shown)]:
+                shown.append(book.raw)
+                print(f"{len(shown)}. {book.title} by {book.author}; size: {book.size}")
+            if len(shown) >= SEARCH_DISPLAY_COUNT:
+                break
     except Exception as e:
-        print(f"Error contacting download API: {e}")
-        return None
-
-    data = parse_api_json(response, "Download API")
-    if not isinstance(data, list) or not data:
-        print("Error: No download link found in API response.")
-        return None
-
-    return data[0]
+        print(f"An error occurred while displaying books: {e}")
+    return shown
 
 def downloadBook():
     title = input("What book would you like to download? ")
 
-    querystring = {"q":title, "ext":"epub", "sort":"mostRelevant", "source":"libgenLi, libgenRs"}
-    url = "https://annas-archive-api.p.rapidapi.com/search"
-
-    try:
-        response = requests.get(url, headers=headers, params=querystring)
-        if response.status_code != 200:
-                    print(f"Error: API request failed with status code {response.status_code}")
-                    print(f"Response: {response.text}")
-                    return
-    except Exception as e:
-        if "429" in str(e):
-            print("Error: API limit reached. Please try again later.")
-        else:
-            print(f"Error: {e}")
-        return
-
-    books = parse_api_json(response, "Search API")
-    if books is None:
+    books = show_search_results(title, "epub")
+    if not books:
+        print("\033[91mNo books found for that title.\033[0m")
         return
-    try:
-        if not books.get('books'):
-            print("\033[91mNo books found for that title.\033[0m")
-            return
-
-        for i in range(min(5, len(books['books']))): 
-            print(f"{i+1}. {books['books'][i]['title']} by {books['books'][i]['author']}; size: {books['books'][i]['size']}")
-    except Exception as e:
-        print(f"An error occurred while displaying books: {e}")
-        return 
 
     choice = int(input("Which book would you like to download? "))
-    md5 = books['books'][choice-1]['md5']
+    md5 = books[choice-1]['md5']
     choice = int(input("Which book would you like to download? "))
-    md5 = books['books'][choice-1]['md5']
+    md5 = books[choice-1]['md5']
 
-    downloadLink = fetch_download_link(md5)
-    if not downloadLink:
-        return
-    
     title = title.rstrip()
 
-    with open(f"{title}.epub", "wb") as f:
-        response = requests.get(downloadLink)
-        f.write(response.content)
+    if not fetch_book_file(md5, f"{title}.epub"):
+        print("\033[91mError: Download failed.\033[0m")
+        return
 
     print("\033[92mDownload successful!\033[0m")
     print(f"Book downloaded to {title}.epub")
@@ -150,205 +210,26 @@ def downloadBook():
 def downloadBookPDF():
     title = input("What book would you like to download? ")
 
-    querystring = {"q": title, "ext": "pdf", "sort": "mostRelevant", "source": "libgenLi, libgenRs"}
-    url = "https://annas-archive-api.p.rapidapi.com/search"
-
-    try:
-        response = requests.get(url, headers=headers, params=querystring)
-        if response.status_code != 200:
-            print(f"Error: API request failed with status code {response.status_code}")
-            print(f"Response: {response.text}")
-            return
-    except Exception as e:
-        if "429" in str(e):
-            print("Error: API limit reached. Please try again later.")
-        else:
-            print(f"Error: {e}")
-        return
-
-    try:
-        books = response.json()
-    except json.JSONDecodeError:
-        print("Error: Search API returned invalid JSON.")
-        print(f"Raw response: {response.text}")
-        return
-
-    if not books.get('books'):
+    books = show_search_results(title, "pdf")
+    if not books:
         print("\033[91mNo books found for that title.\033[0m")
         return
 
-    try:
-        for i in range(min(5, len(books['books']))):
-            print(f"{i+1}. {books['books'][i]['title']} by {books['books'][i]['author']}; size: {books['books'][i]['size']}")
-    except Exception as e:
-        print(f"An error occurred while displaying books: {e}")
-        return
-
     try:
         choice = int(input("Which book would you like to download? "))
-        md5 = books['books'][choice-1]['md5']
+        md5 = books[choice-1]['md5']
     except (ValueError, IndexError):
         print("\033[91mInvalid selection.\033[0m")
         return
 
-    url = f"https://annas-archive-api.p.rapidapi.com/download"
-    querystring = {"md5": md5}
-    
-    print("Fetching download link...")
-    try:
-        response = requests.get(url, headers=headers, params=querystring)
-        
-        if response.status_code != 200:
-            print(f"\033[91mError: Download API failed (Status: {response.status_code})\033[0m")
-            print(f"Server Message: {response.text}")
-            return
-            
-        if not response.text.strip():
-            print("\033[91mError: API returned an empty response.\033[0m")
-            return
-
-        data = response.json()
-        
-        if not data or not isinstance(data, list) or len(data) == 0:
-            print("\033[91mError: No download link found in API response.\033[0m")
-            return
-            
-        downloadLink = data[0]
-
-    except json.JSONDecodeError:
-        print(f"\033[91mError: Could not parse JSON from download API.\033[0m")
-        print(f"Raw Response: {response.text}")
-        return
-    except Exception as e:
-        print(f"Error: {e}")
-        return
-
     title = title.rstrip()
     print(f"Downloading {title}...")
 
-    try:
-        with requests.get(downloadLink, stream=True, headers=headers, timeout=60) as file_response:
-            file_response.raise_for_status() 
-            total_size = int(file_response.headers.get('content-length', 0))
-            
-            with open(f"{title}.pdf", "wb") as f:
-                downloaded = 0
-                for chunk in file_response.iter_content(chunk_size=8192): 
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        percent = int((downloaded / total_size) * 100)
-                        print(f"Progress: {percent}%", end='\r')
-
-        print("\n\033[92mDownload successful!\033[0m")
-
-    except Exception as e:
-        print(f"\nError writing file: {e}")
+    if not fetch_book_file(md5, f"{title}.pdf", show_progress=True):
+        print("\nError: Download failed.")
         return
 
-    print(f"Book downloaded to {title}.pdf")
-    print(f"Located at: {os.getcwd()}/{title}.pdf")
-
-    return title
-
-def downloadBookPDF():
-    title = input("What book would you like to download? ")
-
-    querystring = {"q": title, "ext": "pdf", "sort": "mostRelevant", "source": "libgenLi, libgenRs"}
-    url = "https://annas-archive-api.p.rapidapi.com/search"
-
-    try:
-        response = requests.get(url, headers=headers, params=querystring)
-        if response.status_code != 200:
-            print(f"Error: API request failed with status code {response.status_code}")
-            print(f"Response: {response.text}")
-            return
-    except Exception as e:
-        if "429" in str(e):
-            print("Error: API limit reached. Please try again later.")
-        else:
-            print(f"Error: {e}")
-        return
-
-    try:
-        books = response.json()
-    except json.JSONDecodeError:
-        print("Error: Search API returned invalid JSON.")
-        print(f"Raw response: {response.text}")
-        return
-
-    if not books.get('books'):
-        print("\033[91mNo books found for that title.\033[0m")
-        return
-
-    try:
-        for i in range(min(5, len(books['books']))):
-            print(f"{i+1}. {books['books'][i]['title']} by {books['books'][i]['author']}; size: {books['books'][i]['size']}")
-    except Exception as e:
-        print(f"An error occurred while displaying books: {e}")
-        return
-
-    try:
-        choice = int(input("Which book would you like to download? "))
-        md5 = books['books'][choice-1]['md5']
-    except (ValueError, IndexError):
-        print("\033[91mInvalid selection.\033[0m")
-        return
-
-    url = f"https://annas-archive-api.p.rapidapi.com/download"
-    querystring = {"md5": md5}
-    
-    print("Fetching download link...")
-    try:
-        response = requests.get(url, headers=headers, params=querystring)
-        
-        if response.status_code != 200:
-            print(f"\033[91mError: Download API failed (Status: {response.status_code})\033[0m")
-            print(f"Server Message: {response.text}")
-            return
-            
-        if not response.text.strip():
-            print("\033[91mError: API returned an empty response.\033[0m")
-            return
-
-        data = response.json()
-        
-        if not data or not isinstance(data, list) or len(data) == 0:
-            print("\033[91mError: No download link found in API response.\033[0m")
-            return
-            
-        downloadLink = data[0]
-
-    except json.JSONDecodeError:
-        print(f"\033[91mError: Could not parse JSON from download API.\033[0m")
-        print(f"Raw Response: {response.text}")
-        return
-    except Exception as e:
-        print(f"Error: {e}")
-        return
-
-    title = title.rstrip()
-    print(f"Downloading {title}...")
-
-    try:
-        with requests.get(downloadLink, stream=True, headers=headers, timeout=60) as file_response:
-            file_response.raise_for_status() 
-            total_size = int(file_response.headers.get('content-length', 0))
-            
-            with open(f"{title}.pdf", "wb") as f:
-                downloaded = 0
-                for chunk in file_response.iter_content(chunk_size=8192): 
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        percent = int((downloaded / total_size) * 100)
-                        print(f"Progress: {percent}%", end='\r')
-
-        print("\n\033[92mDownload successful!\033[0m")
-
-    except Exception as e:
-        print(f"\nError writing file: {e}")
-        return
+    print("\n\033[92mDownload successful!\033[0m")
 
     print(f"Book downloaded to {title}.pdf")
     print(f"Located at: {os.getcwd()}/{title}.pdf")
@@ -405,32 +286,21 @@ def downloadAndSendToKindle():
         storeKindleEmailInConfig()
 
     if title and os.path.exists(f"{title}.epub"):
-        msg = EmailMessage()
-        msg['Subject'] = ''
-        msg['From'] = email_address
-        msg['To'] = kindleEmail
-        msg.set_content('')
-        with open(f"{title}.epub", "rb") as f:
-            file_data = f.read()
-            file_name = f"{title}.epub"
-        msg.add_attachment(file_data, maintype="application", subtype="octet-stream", filename=file_name)
-
-        try:
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()
-                server.login(email_address, email_password)
-                server.send_message(msg)
-        except Exception as e:
-            print(f"Error: {e} --- Email not sent.")
-
-        print("\033[92mBook sent to kindle!\033[0m")
-        os.remove(f"{title}.epub")
-        print(f"Deleted {title}.epub from local directory.")
+        queue_book_for_kindle(f"{title}.epub", kindleEmail)
     else:
         print("\033[91mError: File not found or download cancelled.\033[0m")
 
 def exit():
+    due = [job for job in outbox.jobs([PENDING, SENDING]) if job['next_attempt_at'] <= time.time()]
+    if due:
+        print(f"Waiting for {len(due)} queued deliveries (Ctrl+C to leave them for next time)...")
+        try:
+            outbox.wait_idle()
+        except KeyboardInterrupt:
+            pass
     print("Exiting program.")
+    outbox.stop(timeout=5)
+    client.close()
     quit()
 
 def viewCurrentKindleEmail():
@@ -446,230 +316,317 @@ def viewCurrentKindleEmail():
 
 # --- HELPER FUNCTIONS ---
 
-def inject_page_numbers(input_path, output_path, words_per_page=300):
+
+async def download_to_store_async(md5, download_link, cancel_event=None, show_progress=False):
+    """
+    Download a book into the local store (segmented and resumable when the
+    host supports ranges) and verify its md5. Returns the stored path, or
+    None on failure or when cancel_event is set mid-download.
+    """
+    def print_progress(downloaded, total_size):
+        if total_size > 0:
+            percent = int((downloaded / total_size) * 100)
+            print(f"Progress: {percent}%", end='\r')
+
+    try:
+        return await client.download_to_store_async(md5, download_link,
+                                                    progress=print_progress if show_progress else None,
+                                                    cancel_event=cancel_event)
+    except IntegrityFailed as e:
+        print(f"  {e}")
+        return None
+    except Exception:
+        return None
+
+def download_to_store(md5, download_link, cancel_event=None, show_progress=False):
+    """Blocking wrapper around download_to_store_async."""
+    return run_sync(download_to_store_async(md5, download_link, cancel_event, show_progress))
+
+async def fetch_book_file_async(md5, dest_path, show_progress=False):
+    """
+    Place the book with this md5 at dest_path, from the local store when it
+    already has it, otherwise by resolving and downloading it into the store.
+    Returns True on success.
+    """
+    if book_store.has(md5) and await asyncio.to_thread(book_store.get, md5, dest_path):
+        print("Found in local book store. Skipping download.")
+        return True
+
+    download_link = await fetch_download_link_async(md5)
+    if not download_link:
+        return False
+    if await download_to_store_async(md5, download_link, show_progress=show_progress) is None:
+        return False
+    return await asyncio.to_thread(book_store.get, md5, dest_path)
+
+def fetch_book_file(md5, dest_path, show_progress=False):
+    """Blocking wrapper around fetch_book_file_async."""
+    return run_sync(fetch_book_file_async(md5, dest_path, show_progress))
+
+def probe_epub_archive(archive, scan_documents=False):
+    """
+    Inspect an open EPUB archive (a local ZipFile or a RemoteZip) without
+    parsing the whole book. Only the central directory, container.xml, the
+    start of the OPF (up to the spine) and the nav/NCX/page-map entries are
+    read. With scan_documents=True the spine documents are scanned for
+    pagebreak markers when none of those has a page list.
+
+    Returns a dict: {'version': float, 'info': EpubInfo, 'pages': PageNavigation,
+                     'has_pages': bool, 'page_source': str or None}
+    """
+    info = inspect_epub(archive)
+    pages = detect_page_navigation(archive, info, scan_documents, stop_after=PAGE_SCAN_MARKER_LIMIT)
+    return {'version': info.version, 'info': info, 'pages': pages,
+            'has_pages': pages.found, 'page_source': pages.source}
+
+def probe_epub(download_link, scan_documents=False):
+    """
+    Probe a remote EPUB over HTTP range requests (a few KB instead of the whole file).
+    Returns None when the server does not support ranges, so the caller can
+    fall back to a full download.
+    """
+    from remotezip import RemoteZip, RangeNotSupported
+
+    try:
+        with span("probe.remote"), \
+                RemoteZip(download_link, session=get_client(), headers=headers, timeout=60) as archive:
+            return probe_epub_archive(archive, scan_documents)
+    except RangeNotSupported:
+        return None
+
+def probe_local_epub(path, scan_documents=False):
+    """Same as probe_epub, for a file that was already downloaded."""
+    with span("probe.local"), zipfile.ZipFile(path) as archive:
+        return probe_epub_archive(archive, scan_documents)
+
+def probe_candidate(md5, download_link, scan_documents=False, cancel_event=None):
+    """
+    Probe a candidate: from the local store if it is already there, otherwise
+    with range requests, falling back to a full download into the store when
+    ranges are unsupported. Returns the probe dict, or None if the candidate
+    could not be fetched.
+    """
+    if book_store.has(md5):
+        probe = probe_local_epub(book_store.path_for(md5), scan_documents)
+        probe['ranged'] = True
+    else:
+        probe = probe_epub(download_link, scan_documents)
+        if probe is not None:
+            probe['ranged'] = True
+        else:
+            stored_path = download_to_store(md5, download_link, cancel_event)
+            if stored_path is None:
+                return None
+            probe = probe_local_epub(stored_path, scan_documents)
+            probe['ranged'] = False
+
+    # Remember what was learned, for the library and later searches
+    info, pages = probe['info'], probe['pages']
+    client.catalog.record_inspection(md5, probe['version'], info.title, info.identifiers, info.spine_size,
+                                     pages.kind if pages.found else None, pages.count if pages.found else None)
+    return probe
+
+def claim_candidate(md5, download_link, final_path):
+    """
+    Copy a probed candidate to final_path. Candidates probed remotely are not
+    in the store yet, so they are downloaded now. Returns True on success.
+    """
+    if not book_store.has(md5):
+        download_link = download_link or fetch_download_link(md5)
+        if not download_link or download_to_store(md5, download_link) is None:
+            return False
+    return book_store.get(md5, final_path)
+
+def evaluate_candidates(candidates, evaluate, is_match, report=None, workers=CANDIDATE_WORKERS):
     """
-    Injects synthetic page numbers and forces an EPUB 3 Navigation file.
-    This 'Upgrade' strategy is required for modern Kindle Page Number support.
+    Run evaluate(rank, book, cancel_event) for the candidates on a thread pool.
+
+    The search ranking still decides: a match only wins once every better-ranked
+    candidate has finished without matching. As soon as a match is found, the
+    worse-ranked candidates are cancelled (queued ones never start, running ones
+    see their cancel_event set). report(rank, result) is called in ranking order
+    for every candidate that finished.
+
+    Returns (results, match_rank); results[rank] is None for cancelled candidates.
     """
+    results = [None] * len(candidates)
+    cancel_events = [threading.Event() for _ in candidates]
+    match_rank = None
+    next_report = 0
+
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
     try:
-        print(f"DEBUG: Reading EPUB: {input_path}")
-        book = epub.read_epub(input_path)
-        
-        # FORCE EPUB 3.0 (Required for Kindle to respect the Page List)
-        book.version = '3.0'
-        
-        page_count = 1
-        page_list_items = []
-        word_accumulator = 0
-
-        # --- STEP 1: INSERT INVISIBLE PAGE MARKERS ---
-        docs = list(book.get_items_of_type(ITEM_DOCUMENT))
-        print(f"DEBUG: Found {len(docs)} text chapters/documents.")
-
-        for item in docs:
-            try:
-                soup = BeautifulSoup(item.get_content(), 'html.parser')
-                if len(soup.get_text()) < 50: continue
-
-                paragraphs = soup.find_all(['p', 'div', 'span'])
-                modified = False
-
-                for tag in paragraphs:
-                    text = tag.get_text()
-                    word_accumulator += len(text.split())
-
-                    if word_accumulator >= words_per_page:
-                        page_id = f"page-{page_count}"
-                        
-                        # Kindle-safe anchor
-                        anchor = soup.new_tag("span", id=page_id)
-                        anchor.string = "" 
-                        tag.insert_before(anchor)
-                        
-                        page_list_items.append({'id': page_id, 'href': item.get_name(), 'num': page_count})
-                        page_count += 1
-                        word_accumulator = 0
-                        modified = True
-
-                if modified: 
-                    item.set_content(str(soup).encode('utf-8'))
-            except Exception as e_inner:
-                print(f"DEBUG: Warning processing chapter {item.get_name()}: {e_inner}")
-
-        print(f"DEBUG: Generated {page_count} synthetic pages.")
-
-        # --- STEP 2: CREATE MODERN EPUB 3 NAVIGATION ---
-        # We ignore the old NCX and build a fresh HTML5 Nav file.
-        # This is the "Magic Bullet" for Kindle.
-
-        # Check if an HTML Nav already exists
-        nav_item = next((item for item in book.get_items() if item.get_type() == ITEM_NAVIGATION), None)
-        
-        if not nav_item:
-            print("DEBUG: Creating new EPUB 3 Navigation file (nav.xhtml)...")
-            nav_item = epub.EpubItem(uid='nav', file_name='nav.xhtml', media_type='application/xhtml+xml', content='')
-            nav_item.add_item(book) # This might crash if we don't set proper flags, handled below
-            book.add_item(nav_item)
-        
-        # Create the HTML structure
-        # We need a TOC nav (required) and a Page-List nav (what we want)
-        nav_html = """
-        <?xml version='1.0' encoding='utf-8'?>
-        <html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
-        <head><title>Navigation</title></head>
-        <body>
-            <nav epub:type="toc" id="toc">
-                <h1>Table of Contents</h1>
-                <ol>
-                    <li><a href="{first_href}">Start of Book</a></li>
-                </ol>
-            </nav>
-            <nav epub:type="page-list" hidden="">
-                <ol>
-        """.format(first_href=page_list_items[0]['href'] if page_list_items else "#")
-
-        # Append pages
-        for entry in page_list_items:
-            nav_html += f'<li><a href="{entry["href"]}#{entry["id"]}">{entry["num"]}</a></li>\n'
-        
-        nav_html += """
-                </ol>
-            </nav>
-        </body>
-        </html>
-        """
-        
-        # Set the content
-        nav_item.set_content(nav_html.encode('utf-8'))
-        
-        # CRITICAL: Mark this item as the 'nav' property for EPUB 3
-        book.set_identifier("nav") 
-
-        epub.write_epub(output_path, book)
-        print("DEBUG: EPUB 3 Upgrade complete.")
-        return page_count
+        futures = {executor.submit(evaluate, rank, book, cancel_events[rank]): rank
+                   for rank, book in enumerate(candidates)}
+        pending = set(futures)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rank = futures[future]
+                if future.cancelled():
+                    continue
+                results[rank] = future.result()
+                if is_match(results[rank]) and (match_rank is None or rank < match_rank):
+                    match_rank = rank
+
+            if match_rank is not None:
+                # Nothing ranked below the match can win anymore
+                for future in list(pending):
+                    if futures[future] > match_rank:
+                        cancel_events[futures[future]].set()
+                        future.cancel()
+                        pending.discard(future)
+
+            last = len(candidates) if match_rank is None else match_rank + 1
+            while next_report < last and results[next_report] is not None:
+                if report: report(next_report, results[next_report])
+                next_report += 1
+    finally:
+        executor.shutdown(wait=True)
+        instrumentation.record("candidates.evaluate", time.perf_counter() - started)
+
+    return results, match_rank
+
+def check_candidate(rank, book, cancel_event, scan_documents=False, link=None):
+    """
+    Resolve (unless link is given) and probe one search result (runs on the
+    candidate pool). Never raises: problems are returned in result['error']
+    so they can be printed in ranking order.
+    """
+    result = {'book': book, 'link': link, 'probe': None, 'error': None}
+
+    # Books already in the local store are probed without resolving a link
+    if not link and not book_store.has(book['md5']):
+        result['link'] = fetch_download_link(book['md5'])
+    if not result['link'] and not book_store.has(book['md5']):
+        result['error'] = "Download link unavailable. Skipping."
+        return result
+    if cancel_event.is_set():
+        result['error'] = "Cancelled."
+        return result
 
+    try:
+        result['probe'] = probe_candidate(book['md5'], result['link'], scan_documents, cancel_event)
+        if result['probe'] is None:
+            result['error'] = "Download failed. Skipping."
+    except Exception as e:
+        result['error'] = f"Error reading file: {e}"
+    return result
+
+def report_version_check(rank, result):
+    book = result['book']
+    print(f"\nChecking Candidate {rank+1}: {book['title']} ({book['size']})")
+    if result['error']:
+        print(f"  {result['error']}")
+        return
+    if not result['probe']['ranged']:
+        print("  (Server does not support range requests; downloaded full file)")
+
+    version = result['probe']['version']
+    print(f"  Detected Version: EPUB {version} ({result['probe']['info'].spine_size} spine documents)")
+    if version >= 3.0:
+        print(f"\033[92m  ✅ BINGO! Found EPUB 3.0 match.\033[0m")
+    else:
+        print("  ❌ Too old (EPUB 2).")
+
+def report_page_check(rank, result):
+    book = result['book']
+    print(f"\nChecking candidate {rank+1}: {book['title']}...")
+    if result['error']:
+        print(f"  Skipping: {result['error']}")
+        return
+    if not result['probe']['ranged']:
+        print("  (Server does not support range requests; downloaded full file)")
+
+    pages = result['probe']['pages']
+    if pages.structural:
+        print(f"  DEBUG: Found {pages.count} page numbers ({pages.kind}) in {pages.source}")
+        print(f"\033[92m  ✅ Found Match! Candidate {rank+1} has a page list.\033[0m")
+    elif pages.found:
+        more = "+" if pages.count >= PAGE_SCAN_MARKER_LIMIT else ""
+        print(f"  DEBUG: Found {pages.count}{more} pagebreak markers in {pages.documents_scanned} documents, "
+              f"but no page list")
+    else:
+        print("  ❌ No page numbers detected.")
+
+def inject_page_numbers(input_path, output_path, words_per_page=300, engine=None):
+    """
+    epub_pages.inject_page_numbers with the injection settings from config.py,
+    printing its progress. Returns the page count, or 0 after printing the error.
+    """
+    import epub_pages
+    try:
+        return epub_pages.inject_page_numbers(input_path, output_path, words_per_page, engine or INJECTION_ENGINE,
+                                              INJECTION_WORKERS, PARALLEL_INJECTION_MIN_CHAPTERS, log=print)
     except Exception as e:
         print(f"❌ Critical Error in inject_page_numbers: {e}")
         return 0
 
+def insert_page_markers(book, words_per_page=300, engine=None):
+    """epub_pages.insert_page_markers with the injection settings from config.py."""
+    import epub_pages
+    return epub_pages.insert_page_markers(book, words_per_page, engine or INJECTION_ENGINE,
+                                          INJECTION_WORKERS, PARALLEL_INJECTION_MIN_CHAPTERS, log=print)
+
+def build_page_navigation(book, pages):
+    """See epub_pages.build_page_navigation."""
+    import epub_pages
+    return epub_pages.build_page_navigation(book, pages, log=print)
+
 # --- SMART COMMAND: DOWNLOAD + CHECK VERSION + INJECT ---
 def downloadAddPagesAndSend(prompt_to_send=True):
     title = input("What book would you like to download? ")
-    querystring = {"q": title, "ext": "epub", "sort": "mostRelevant", "source": "libgenLi, libgenRs"}
-    url = "https://annas-archive-api.p.rapidapi.com/search"
 
     print(f"Searching for '{title}'...")
-    try:
-        response = requests.get(url, headers=headers, params=querystring)
-        books_data = parse_api_json(response, "Search API")
-    except Exception as e:
-        print(f"Error searching: {e}")
-        return
-
+    books_data = search_books_merged(title, "epub", enough=CANDIDATE_COUNT)
     if books_data is None:
         return
 
     if not books_data.get('books'): return
     
-    all_results = books_data['books']
-    print(f"Found {len(all_results)} total results. Scanning for best candidate (Size < 3MB)...")
+    all_results = ResultSet.from_books(books_data['books'])
+    size_limit = f"Size < {CANDIDATE_MAX_SIZE_MB:g}MB" if CANDIDATE_MAX_SIZE_MB else "any size"
+    print(f"Found {len(all_results)} total results. Scanning for best candidate ({size_limit})...")
+
+    # Only files under the size limit are considered; the first CANDIDATE_COUNT of them are checked in parallel
+    candidates = list(all_results.filter(max_size_mb=CANDIDATE_MAX_SIZE_MB).head(CANDIDATE_COUNT))
+    results, match_rank = evaluate_candidates(
+        candidates,
+        check_candidate,
+        lambda result: result['probe'] is not None and result['probe']['version'] >= 3.0,
+        report=report_version_check)
+
+    if match_rank is None and candidates:
+        print(f"\nChecked {len(candidates)} valid candidates. No EPUB 3 found.")
+
+    # Decision Time: the EPUB 3 match, otherwise the best-ranked valid EPUB 2 as fallback
+    order = [match_rank] if match_rank is not None else []
+    order += [rank for rank, result in enumerate(results)
+              if rank != match_rank and result is not None and result['probe'] is not None]
 
-    best_candidate_path = None
-    best_candidate_title = None
-    
-    # We will store valid EPUB 2 candidates here as fallbacks
-    # We stop scanning once we check 5 VALID candidates (under 3MB)
-    valid_candidates_checked = 0
-    fallback_path = None
-    fallback_title = None
-
-    for i, book in enumerate(all_results):
-        # Stop if we have checked 5 valid candidates and haven't found EPUB 3 yet
-        if valid_candidates_checked >= 5:
-            print("\nChecked 5 valid candidates. No EPUB 3 found.")
+    final_file = None
+    for rank in order:
+        result = results[rank]
+        safe_title = "".join([c for c in result['book']['title'] if c.isalpha() or c.isdigit() or c==' ']).rstrip()
+        if claim_candidate(result['book']['md5'], result['link'], f"{safe_title}.epub"):
+            final_file = f"{safe_title}.epub"
             break
+        print(f"  Download failed for {safe_title}. Trying next candidate...")
 
-        # 1. SIZE CHECK
-        size_mb = parse_size_to_mb(book.get('size', '0'))
-        
-        if size_mb > 3.0:
-            # Silently skip large files, do not count towards "checked" limit
-            continue
-            
-        print(f"\nChecking Candidate {valid_candidates_checked+1}: {book['title']} ({book['size']})")
-        valid_candidates_checked += 1
-        
-        # Download Logic
-        dl_link = fetch_download_link(book['md5'])
-        if not dl_link:
-            print("  Download link unavailable. Skipping.")
-            continue
-
-        try:
-            safe_title = "".join([c for c in book['title'] if c.isalpha() or c.isdigit() or c==' ']).rstrip()
-            temp_filename = f"temp_{i}.epub"
-            
-            with requests.get(dl_link, stream=True, headers=headers, timeout=60) as r:
-                r.raise_for_status()
-                with open(temp_filename, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192): f.write(chunk)
-        except: 
-            print("  Download failed. Skipping.")
-            continue
-
-        # Check Version
-        try:
-            check_book = epub.read_epub(temp_filename)
-            version = float(check_book.version) if check_book.version else 2.0
-            print(f"  Detected Version: EPUB {version}")
-
-            if version >= 3.0:
-                print(f"\033[92m  ✅ BINGO! Found EPUB 3.0 match.\033[0m")
-                best_candidate_path = f"{safe_title}.epub"
-                if os.path.exists(best_candidate_path): os.remove(best_candidate_path)
-                os.rename(temp_filename, best_candidate_path)
-                best_candidate_title = safe_title
-                break # Stop searching, we found the gold standard
-            else:
-                print("  ❌ Too old (EPUB 2).")
-                
-                # If we don't have a fallback yet, keep this one!
-                if fallback_path is None:
-                    fallback_path = f"{safe_title}.epub"
-                    if os.path.exists(fallback_path): os.remove(fallback_path)
-                    os.rename(temp_filename, fallback_path)
-                    fallback_title = safe_title
-                    print("  (Saved as fallback option)")
-                else:
-                    os.remove(temp_filename)
-
-        except Exception as e:
-            print(f"  Error reading file: {e}")
-            if os.path.exists(temp_filename): os.remove(temp_filename)
-
-    # Decision Time
-    final_file = None
-    
-    if best_candidate_path:
-        final_file = best_candidate_path
-        print(f"\n🏆 Selected EPUB 3 candidate: {best_candidate_title}")
-    elif fallback_path:
-        final_file = fallback_path
-        print(f"\n⚠️ No EPUB 3 found. Defaulting to best valid result: {fallback_title}")
-        print("   Note: Since this is EPUB 2, page numbers might NOT show up on Kindle.")
-    else:
-        print("\n❌ No valid books found (all were > 3MB or failed download).")
+    if final_file is None:
+        print("\n❌ No valid books found (all were too large or failed download).")
         return
+    elif rank == match_rank:
+        print(f"\n🏆 Selected EPUB 3 candidate: {safe_title}")
+    else:
+        print(f"\n⚠️ No EPUB 3 found. Defaulting to best valid result: {safe_title}")
+        print("   Note: Since this is EPUB 2, page numbers might NOT show up on Kindle.")
 
-    # Inject Pages
+    # Inject Pages (the file is replaced atomically)
     print("Injecting page numbers...")
-    paged_file = f"paged_{final_file}"
-    pages = inject_page_numbers(final_file, paged_file)
-    
-    # Replace original
-    if os.path.exists(final_file): os.remove(final_file)
-    os.rename(paged_file, final_file)
+    pages = inject_page_numbers(final_file, final_file)
     
     print(f"\033[92mReady! Book has {pages} pages.\033[0m")
 
@@ -683,20 +640,7 @@ def downloadAddPagesAndSend(prompt_to_send=True):
             with open("config.json", "r") as f: data = json.load(f)
             kindleEmail = data.get("kindleEmail")
 
-        msg = EmailMessage()
-        msg['From'] = email_address
-        msg['To'] = kindleEmail
-        with open(final_file, "rb") as f:
-            msg.add_attachment(f.read(), maintype="application", subtype="octet-stream", filename=final_file)
-        
-        try:
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()
-                server.login(email_address, email_password)
-                server.send_message(msg)
-            print("\033[92mBook sent!\033[0m")
-            os.remove(final_file)
-        except Exception as e: print(e)
+        queue_book_for_kindle(final_file, kindleEmail)
     else:
         print(f"Saved locally: {final_file}")
 
@@ -715,17 +659,9 @@ def downloadAndSendPagesOnly():
     Checks for Navigation Lists AND internal pagebreak markers.
     """
     title = input("What book would you like to download? ")
-    querystring = {"q": title, "ext": "epub", "sort": "mostRelevant", "source": "libgenLi, libgenRs"}
-    url = "https://annas-archive-api.p.rapidapi.com/search"
 
     print(f"Searching for '{title}'...")
-    try:
-        response = requests.get(url, headers=headers, params=querystring)
-    except Exception as e:
-        print(f"Error searching: {e}")
-        return
-
-    books = parse_api_json(response, "Search API")
+    books = search_books_merged(title, "epub", enough=CANDIDATE_COUNT)
     if books is None:
         return
 
@@ -733,81 +669,36 @@ def downloadAndSendPagesOnly():
         print("\033[91mNo books found.\033[0m")
         return
 
-    candidates = books['books'][:5]
+    candidates = books['books'][:CANDIDATE_COUNT]
     found_book_path = None
     found_book_title = None
 
     print("Checking top results for built-in page numbers...")
-    print("(This downloads files temporarily to verify accuracy)")
-
-    for i, book in enumerate(candidates):
-        print(f"\nChecking candidate {i+1}/{len(candidates)}: {book['title']}...")
-        
-        download_link = fetch_download_link(book['md5'])
-        if not download_link:
-            print("  Skipping: Could not retrieve download link.")
-            continue
-
-        safe_title = "".join([c for c in book['title'] if c.isalpha() or c.isdigit() or c==' ']).rstrip()
-        temp_filename = f"temp_check_{i}.epub"
-        
-        try:
-            with requests.get(download_link, stream=True, headers=headers, timeout=60) as r:
-                r.raise_for_status()
-                with open(temp_filename, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        f.write(chunk)
-        except Exception:
-            print("  Skipping: Download failed.")
-            if os.path.exists(temp_filename): os.remove(temp_filename)
-            continue
-
-        has_pages = False
-        try:
-            check_book = epub.read_epub(temp_filename)
-            
-            # --- AGGRESSIVE BRUTE FORCE SEARCH ---
-            # We search the raw bytes of every text-like file.
-            # We look for the List (Standard) OR the Markers (Fallback)
-            
-            for item in check_book.get_items():
-                name = item.get_name().lower()
-                # Check for standard text/xml extensions
-                if any(name.endswith(ext) for ext in ['.html', '.xhtml', '.xml', '.ncx', '.opf']):
-                    content = item.get_content()
-                    
-                    # 1. Standard: Navigation List
-                    if b'page-list' in content or b'pageList' in content:
-                        has_pages = True
-                        print(f"  DEBUG: Found 'page-list' structure in {item.get_name()}")
-                        break
-                    
-                    # 2. Aggressive: Internal Page Break Markers
-                    # (Finds pages even if the TOC is broken/missing)
-                    if b'epub:type="pagebreak"' in content or b'title="page' in content:
-                        has_pages = True
-                        print(f"  DEBUG: Found internal 'pagebreak' markers in {item.get_name()}")
-                        break
-            # -------------------------------------
-
-        except Exception as e:
-            print(f"  Warning: Structure error in candidate {i+1} ({e})")
-        
-        if has_pages:
-            print(f"\033[92m  ✅ Found Match! Candidate {i+1} has detected page numbers.\033[0m")
-            final_filename = f"{safe_title}.epub"
-            if os.path.exists(final_filename): os.remove(final_filename)
-            os.rename(temp_filename, final_filename)
+    print("(Only the navigation files are fetched, unless the server requires a full download)")
+
+    # A page list wins by search rank; without one, the book with the most markers is used
+    results, match_rank = evaluate_candidates(
+        candidates,
+        lambda rank, book, cancel_event: check_candidate(rank, book, cancel_event, scan_documents=True),
+        lambda result: result['probe'] is not None and result['probe']['pages'].structural,
+        report=report_page_check)
+
+    if match_rank is None:
+        scanned = [(result['probe']['pages'].count, -rank) for rank, result in enumerate(results)
+                   if result is not None and result['probe'] is not None and result['probe']['has_pages']]
+        if scanned:
+            match_rank = -max(scanned)[1]
+            print(f"\nNo page list found. Using candidate {match_rank+1}, which has the most pagebreak markers.")
+
+    if match_rank is not None:
+        result = results[match_rank]
+        safe_title = "".join([c for c in result['book']['title'] if c.isalpha() or c.isdigit() or c==' ']).rstrip()
+        final_filename = f"{safe_title}.epub"
+        if claim_candidate(result['book']['md5'], result['link'], final_filename):
             found_book_path = final_filename
             found_book_title = safe_title
-            
-            for j in range(len(candidates)):
-                junk_file = f"temp_check_{j}.epub"
-                if os.path.exists(junk_file): os.remove(junk_file)
-            break 
         else:
-            print("  ❌ No page numbers detected. Deleting...")
-            os.remove(temp_filename)
+            print("  Download failed.")
 
     if not found_book_path:
         print("\n\033[91mNo books with built-in page numbers were found in the top results.\033[0m")
@@ -831,26 +722,483 @@ def downloadAndSendPagesOnly():
         with open("config.json", "r") as f: data = json.load(f)
         kindleEmail = data.get("kindleEmail")
 
-    msg = EmailMessage()
-    msg['Subject'] = ''
-    msg['From'] = email_address
-    msg['To'] = kindleEmail
-    msg.set_content('')
-    
-    with open(found_book_path, "rb") as f:
-        file_data = f.read()
-    msg.add_attachment(file_data, maintype="application", subtype="octet-stream", filename=found_book_path)
+    queue_book_for_kindle(found_book_path, kindleEmail)
 
+# --- LOCAL LIBRARY ---
+
+def describe_catalog_entry(entry):
+    details = [f"size: {entry.size or '?'}"]
+    if entry.epub_version:
+        details.append(f"EPUB {entry.epub_version:g}")
+    if entry.pages:
+        # Marker scans stop counting at PAGE_SCAN_MARKER_LIMIT
+        capped = entry.page_kind == "markers" and entry.pages >= PAGE_SCAN_MARKER_LIMIT
+        details.append(f"{entry.pages}{'+' if capped else ''} pages ({entry.page_kind})")
+    if entry.downloaded:
+        details.append("downloaded " + time.strftime("%Y-%m-%d", time.localtime(entry.downloaded_at)))
+    return f"{entry.title or entry.md5} by {entry.author or 'unknown'}; " + "; ".join(details)
+
+def viewLibrary(query=None, prompt=True):
+    """
+    Look up books in the local catalog (everything seen in search results or
+    downloaded) without spending API quota. With prompt, offer to copy the
+    chosen book into the current directory.
+    """
+    total, downloaded = client.catalog.counts()
+    print(f"Library: {total} books seen, {downloaded} downloaded.")
+    if query is None:
+        query = input("Search your library (Enter for recent downloads): ")
+
+    started = time.perf_counter()
+    if query.strip():
+        entries = client.catalog.search(query, limit=LIBRARY_DISPLAY_COUNT, fuzzy=True)
+    else:
+        entries = client.catalog.recent(limit=LIBRARY_DISPLAY_COUNT)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if not entries:
+        print("\033[91mNo matching books in your library.\033[0m")
+        return
+    for i, entry in enumerate(entries):
+        print(f"{i+1}. {describe_catalog_entry(entry)}")
+    print(f"({len(entries)} matches in {elapsed_ms:.2f} ms)")
+
+    if not prompt:
+        return
+    choice = input("Which book would you like to download? (Enter to skip) ").strip()
+    if not choice:
+        return
     try:
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(email_address, email_password)
-            server.send_message(msg)
-        print("\033[92mBook sent to kindle!\033[0m")
-        os.remove(found_book_path)
-        print(f"Deleted {found_book_path} from local directory.")
+        entry = entries[int(choice)-1]
+    except (ValueError, IndexError):
+        print("\033[91mInvalid selection.\033[0m")
+        return
+
+    filename = f"{safe_filename(entry.title) or entry.md5}.{entry.extension or 'epub'}"
+    if not fetch_book_file(entry.md5, filename, show_progress=True):
+        print("\nError: Download failed.")
+        return
+    print("\n\033[92mDownload successful!\033[0m")
+    print(f"Located at: {os.getcwd()}/{filename}")
+
+# --- KINDLE DELIVERY QUEUE ---
+
+def queue_book_for_kindle(path, kindle_email):
+    """
+    Check the Kindle size limit, then move the book into the outbox for the
+    background worker to email. Asks for the Kindle email when none is set.
+    Returns the job id, or None if it cannot be sent (the book stays where it is).
+    """
+    if not kindle_email:
+        storeKindleEmailInConfig()
+        kindle_email = get_kindle_email()
+    if not kindle_email:
+        print(f"\033[91mError: No Kindle email set --- {os.path.basename(path)} was kept, not sent.\033[0m")
+        return None
+    try:
+        client.mailer.check_size(path)
+    except AttachmentTooLarge as e:
+        print(f"\033[91mError: {e} --- Email not sent.\033[0m")
+        return None
+    job_id = outbox.enqueue(path, kindle_email)
+    print(f"\033[92m📬 Queued {os.path.basename(path)} for delivery to {kindle_email}.\033[0m")
+    print("It is sent in the background; type 'queue' to check on it.")
+    return job_id
+
+def report_delivery(job, status):
+    """Called by the outbox worker after every send attempt."""
+    if status == SENT:
+        print(f"\n\033[92mBook sent to kindle: {job['filename']}\033[0m")
+    elif status == FAILED:
+        print(f"\n\033[91mSending {job['filename']} failed: {job['last_error']} (type 'queue' to retry)\033[0m")
+    else:
+        wait = max(0, job['next_attempt_at'] - time.time())
+        print(f"\n\033[93mSending {job['filename']} failed: {job['last_error']}; retrying in {wait:.0f}s\033[0m")
+
+def viewQueue(retry_failed=None):
+    """
+    List queued, failed and recently sent deliveries. retry_failed=None asks
+    whether failed jobs should be queued again.
+    """
+    jobs = outbox.jobs()
+    if not jobs:
+        print("The delivery queue is empty.")
+        return
+
+    colours = {PENDING: "\033[93m", SENDING: "\033[94m", SENT: "\033[92m", FAILED: "\033[91m"}
+    print("\n\033[1mDeliveries:\033[0m")
+    for job in jobs:
+        line = f"{colours[job['status']]}{job['status']:<8}\033[0m {job['filename']} -> {job['recipient']}"
+        if job['attempts']:
+            line += f" (attempts: {job['attempts']})"
+        if job['status'] == PENDING and job['next_attempt_at'] > time.time():
+            line += f", next try in {job['next_attempt_at'] - time.time():.0f}s"
+        print(line)
+        if job['last_error'] and job['status'] != SENT:
+            print(f"         last error: {job['last_error']}")
+
+    failed = sum(job['status'] == FAILED for job in jobs)
+    if failed:
+        if retry_failed is None:
+            retry_failed = input(f"Retry {failed} failed deliveries? (y/n): ").lower() == 'y'
+        if retry_failed:
+            print(f"Queued {outbox.retry_failed()} deliveries again.")
+
+# --- BATCH MODE (NON-INTERACTIVE) ---
+
+BATCH_POLICIES = ("first", "smallest", "epub3")
+MD5_PATTERN = re.compile(r"^[0-9a-fA-F]{32}$")
+ISBN_PATTERN = re.compile(r"^(97[89])?\d{9}[\dXx]$")
+
+def safe_filename(title):
+    return "".join([c for c in title if c.isalpha() or c.isdigit() or c==' ']).rstrip()
+
+# Output paths handed out in this batch run: entries that resolve to the same
+# book or title must not download and inject into the same file concurrently
+batch_output_paths = set()
+batch_output_lock = threading.Lock()
+
+def claim_output_path(directory, name, ext):
+    """A path in directory for name.ext that no other entry of the run uses ("name (2).ext", ...)."""
+    with batch_output_lock:
+        path = os.path.join(directory, f"{name}.{ext}")
+        n = 2
+        while path in batch_output_paths:
+            path = os.path.join(directory, f"{name} ({n}).{ext}")
+            n += 1
+        batch_output_paths.add(path)
+        return path
+
+def get_kindle_email():
+    """Read the Kindle email from config.json without prompting. Returns None if unset."""
+    if not os.path.exists("config.json"):
+        return None
+    with open("config.json", "r") as f:
+        return json.load(f).get("kindleEmail")
+
+def send_book_email(path, kindle_email, filename=None):
+    """
+    Email a book to the Kindle address over the shared SMTP connection.
+    Raises AttachmentTooLarge (before uploading anything) or SMTP errors.
+    """
+    with span("smtp.send"):
+        client.mailer.send(path, kindle_email, filename=filename or os.path.basename(path))
+    count_bytes("smtp.attachment", os.path.getsize(path))
+
+def read_batch_entries(stream, fmt):
+    """
+    Parse a reading list. Each entry is a dict with 'query' and optionally
+    'md5'. Formats: text (one title/ISBN/md5 per line, '#' comments),
+    csv (columns title, isbn and/or md5; otherwise the first column) and
+    jsonl (objects with title, isbn, md5 or query keys).
+    """
+    entries = []
+    if fmt == "csv":
+        rows = list(csv.reader(stream))
+        header = [column.strip().lower() for column in rows[0]] if rows else []
+        if set(header) & {"title", "isbn", "md5", "query"}:
+            records = [dict(zip(header, row)) for row in rows[1:]]
+        else:
+            records = [{"query": row[0]} for row in rows if row]
+    elif fmt == "jsonl":
+        records = [json.loads(line) for line in stream if line.strip()]
+    else:
+        records = [{"query": line} for line in stream if line.strip() and not line.lstrip().startswith("#")]
+
+    for record in records:
+        md5 = (record.get("md5") or "").strip()
+        query = (record.get("query") or record.get("isbn") or record.get("title") or "").strip()
+        if not md5 and MD5_PATTERN.match(query):
+            md5 = query
+        compact = query.replace("-", "").replace(" ", "")
+        if ISBN_PATTERN.match(compact):
+            query = compact
+        if not query and not md5:
+            continue
+        entries.append({"query": query or md5, "md5": md5.lower() or None})
+    return entries
+
+def shortlist_batch_results(books, policy, max_size_mb, ext):
+    """
+    Pick the search results the selection policy looks at, without asking:
+    the top result, the smallest one, or (epub3) the top CANDIDATE_COUNT to
+    be probed. Returns an empty list if nothing qualifies.
+    """
+    results = ResultSet.from_books(books).filter(max_size_mb=max_size_mb)
+
+    if policy == "smallest":
+        # Unparseable sizes (0) go last
+        return list(results.sort_by_size().head(1))
+
+    if policy == "epub3" and ext == "epub":
+        return list(results.head(CANDIDATE_COUNT))
+
+    return list(results.head(1))
+
+def new_batch_item(entry):
+    """The work item one reading-list entry carries through the batch stages."""
+    return {
+        "entry": entry, "started": time.monotonic(), "candidates": [], "links": [], "book": None, "link": None,
+        "record": {"input": entry["query"], "status": "failed", "md5": entry["md5"], "title": None,
+                   "author": None, "size": None, "path": None, "version": None, "pages": None,
+                   "delivery_job": None, "error": None},
+    }
+
+def finish_batch_item(item):
+    record = item["record"]
+    record["seconds"] = round(time.monotonic() - item["started"], 3)
+    return record
+
+# Each batch stage takes a work item and returns it for the next stage, or
+# None when the item is finished early (its record says why).
+
+def batch_search(item, options):
+    """Search and shortlist the candidates (md5 entries skip the search)."""
+    entry, record = item["entry"], item["record"]
+    if entry["md5"]:
+        item["candidates"] = [{"md5": entry["md5"],
+                               "title": entry["query"] if entry["query"] != entry["md5"] else entry["md5"]}]
+        return item
+
+    querystring = {"q": entry["query"], "ext": options.ext, "sort": "mostRelevant", "source": "libgenLi, libgenRs"}
+    books = search_books(querystring)
+    if not books or not books.get('books'):
+        record.update(status="not_found", error="No search results")
+        return None
+    item["candidates"] = shortlist_batch_results(books['books'], options.policy, options.max_size, options.ext)
+    if not item["candidates"]:
+        record.update(status="not_found", error="No result matched the selection policy")
+        return None
+    return item
+
+def batch_resolve(item, options):
+    """
+    Resolve the download link of the picked result (books already in the
+    store need none). The epub3 shortlist is left to the probe stage, which
+    resolves the candidates concurrently and never pays for the links of
+    candidates cancelled once a better-ranked one matched.
+    """
+    if options.policy == "epub3" and options.ext == "epub":
+        item["links"] = [None] * len(item["candidates"])
+        return item
+
+    book = item["candidates"][0]
+    link = None if book_store.has(book["md5"]) else fetch_download_link(book["md5"])
+    if not link and not book_store.has(book["md5"]):
+        item["record"]["error"] = "Download link unavailable"
+        return None
+    item["links"] = [link]
+    return item
+
+def batch_probe(item, options):
+    """With the epub3 policy, probe the shortlist and pick the best EPUB 3 (or valid fallback)."""
+    if options.policy != "epub3" or options.ext != "epub":
+        item["book"], item["link"] = item["candidates"][0], item["links"][0]
+        return item
+
+    results, match_rank = evaluate_candidates(
+        item["candidates"],
+        lambda rank, book, cancel_event: check_candidate(rank, book, cancel_event, link=item["links"][rank]),
+        lambda result: result['probe'] is not None and result['probe']['version'] >= 3.0)
+    if match_rank is None:
+        match_rank = next((rank for rank, result in enumerate(results)
+                           if result is not None and result['probe'] is not None), None)
+    if match_rank is None:
+        errors = {result['error'] for result in results if result is not None and result['error']}
+        item["record"].update(status="not_found", error="No result matched the selection policy" +
+                              (f" ({'; '.join(sorted(errors))})" if errors else ""))
+        return None
+    item["book"], item["link"] = results[match_rank]['book'], results[match_rank]['link']
+    item["record"]["version"] = results[match_rank]['probe']['version']
+    return item
+
+def batch_fetch(item, options):
+    """Place the chosen book in the output directory (from the store or the network)."""
+    book, record = item["book"], item["record"]
+    record.update(md5=book["md5"], title=book.get("title"), author=book.get("author"), size=book.get("size"))
+
+    path = claim_output_path(options.output_dir, safe_filename(book.get('title') or book['md5']) or book['md5'],
+                             options.ext)
+    if not claim_candidate(book["md5"], item["link"], path):
+        record["error"] = "Download failed"
+        return None
+    record["path"] = path
+    return item
+
+def batch_inject(item, options, pool=None):
+    """
+    Add page numbers (EPUB only), on the process pool when one is given.
+    Injection errors propagate, so the entry fails instead of being sent
+    without page numbers.
+    """
+    import epub_pages
+    if not options.inject or options.ext != "epub":
+        return item
+    record = item["record"]
+    path = record["path"]
+    if pool is not None:
+        # The pool already runs books in parallel, so each one is injected on a
+        # single process, without progress output. Spans inside the worker
+        # process are not collected; time the whole call here
+        with span("inject.process_pool"):
+            record["pages"] = pool.submit(epub_pages.inject_page_numbers, path, path, 300, INJECTION_ENGINE,
+                                          1).result()
+    else:
+        record["pages"] = epub_pages.inject_page_numbers(path, path, 300, INJECTION_ENGINE, INJECTION_WORKERS,
+                                                         PARALLEL_INJECTION_MIN_CHAPTERS)
+    if not record["pages"]:
+        record["error"] = "No page numbers added (too little text)"
+        return None
+    return item
+
+def batch_deliver(item, options):
+    """Queue the book for the Kindle (with --send); the last stage marks the entry ok."""
+    record = item["record"]
+    if options.send:
+        kindle_email = get_kindle_email()
+        if not kindle_email:
+            record["error"] = "Kindle email not set (run the 'config' command first)"
+            return None
+        client.mailer.check_size(record["path"])
+        # The book stays in the output directory; the outbox sends a copy
+        record["delivery_job"] = outbox.enqueue(record["path"], kindle_email, keep_original=True)
+    record["status"] = "ok"
+    return item
+
+BATCH_STAGES = (("search", batch_search), ("resolve", batch_resolve), ("probe", batch_probe),
+                ("fetch", batch_fetch), ("inject", batch_inject), ("deliver", batch_deliver))
+
+def process_batch_entry(entry, options):
+    """
+    Run all batch stages for one entry, one after another.
+    Never raises; returns the report record.
+    """
+    item = new_batch_item(entry)
+    try:
+        for _, stage in BATCH_STAGES:
+            if stage(item, options) is None:
+                break
     except Exception as e:
-        print(f"Error sending email: {e}")
+        item["record"]["error"] = str(e)
+    return finish_batch_item(item)
+
+def batch_stage_workers(options):
+    """
+    Workers per batch stage: config.batch_stage_workers, then --workers for
+    the probe/fetch stages, then --stage-workers name=N,... on top.
+    """
+    workers = {"search": 2, "resolve": 2, "probe": options.workers, "fetch": options.workers,
+               "inject": os.cpu_count() or 1, "deliver": 1}
+    workers.update({name: count for name, count in getattr(config, 'batch_stage_workers', {}).items() if count})
+    for part in (options.stage_workers or "").split(","):
+        if "=" in part:
+            name, count = part.split("=", 1)
+            if name.strip() not in workers:
+                raise ValueError(f"Unknown batch stage '{name.strip()}' (stages: {', '.join(workers)})")
+            workers[name.strip()] = max(1, int(count))
+    return workers
+
+def print_stage_stats(stats):
+    print("\n\033[1mPipeline stages:\033[0m")
+    print(f"{'stage':<8} {'workers':>7} {'items':>6} {'errors':>6} {'busy s':>8} {'util':>6} {'max queue':>10}")
+    for row in stats:
+        print(f"{row['stage']:<8} {row['workers']:>7} {row['processed']:>6} {row['errors']:>6} "
+              f"{row['busy_seconds']:>8.1f} {row['utilization'] * 100:>5.0f}% "
+              f"{row['max_queue_depth']:>4}/{row['queue_capacity']:<5}")
+
+def runBatch(options):
+    """
+    Non-interactive mode: run every entry of a reading list through the
+    staged pipeline (search, resolve, probe, fetch, inject, deliver) and
+    write one JSONL result line per entry as it finishes.
+    """
+    if options.input == "-":
+        entries = read_batch_entries(sys.stdin, options.format)
+    else:
+        with open(options.input, "r", newline="", encoding="utf-8") as f:
+            entries = read_batch_entries(f, options.format)
+
+    if not entries:
+        print("\033[91mNo entries found in the input list.\033[0m")
+        return
+
+    try:
+        workers = batch_stage_workers(options)
+    except ValueError as e:
+        print(f"\033[91mError: {e}\033[0m")
+        return
+
+    os.makedirs(options.output_dir, exist_ok=True)
+    batch_output_paths.clear()
+    print(f"Processing {len(entries)} entries (policy: {options.policy}; workers: "
+          + ", ".join(f"{name}={count}" for name, count in workers.items()) + ")...")
+
+    if options.send:
+        # Deliveries run alongside the downloads
+        outbox.start()
+
+    # Injection is CPU-bound and runs on processes; every other stage waits on I/O.
+    # Workers are spawned, not forked: the stage threads, the event loop and the
+    # outbox are running, and a forked child could inherit a lock one of them
+    # holds (stdout, the profiler's) and hang on it
+    pool = None
+    if options.inject and options.ext == "epub":
+        pool = ProcessPoolExecutor(max_workers=workers["inject"], mp_context=multiprocessing.get_context("spawn"))
+
+    stages = []
+    for name, func in BATCH_STAGES:
+        if func is batch_inject:
+            run = lambda item, func=func: func(item, options, pool)
+        else:
+            run = lambda item, func=func: func(item, options)
+        stages.append(Stage(name, run, workers=workers[name], queue_size=options.queue_size))
+    pipeline = Pipeline(stages, on_error=lambda item, stage, e: item["record"].update(error=f"{stage}: {e}"))
+    pipeline.start()
+
+    def feed():
+        for entry in entries:
+            pipeline.put(new_batch_item(entry))     # Blocks while the search stage is behind
+        pipeline.close()
+    threading.Thread(target=feed, name="batch-feed", daemon=True).start()
+
+    report = sys.stdout if options.report == "-" else open(options.report, "a", encoding="utf-8")
+    counts = {}
+    job_ids = []
+    try:
+        for item in pipeline.results():
+            record = finish_batch_item(item)
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            if record["delivery_job"]:
+                job_ids.append(record["delivery_job"])
+            report.write(json.dumps(record) + "\n")
+            report.flush()
+            if record["status"] == "ok":
+                print(f"\033[92m✅ {record['input']}\033[0m -> {record['path']}")
+            else:
+                print(f"\033[91m❌ {record['input']}\033[0m ({record['error']})")
+    finally:
+        if report is not sys.stdout:
+            report.close()
+        if pool is not None:
+            pool.shutdown()
+
+    print_stage_stats(pipeline.stats())
+
+    print(f"Done: {counts.get('ok', 0)} ok, {counts.get('not_found', 0)} not found, {counts.get('failed', 0)} failed.")
+    if report is not sys.stdout:
+        print(f"Results written to {options.report}")
+
+    if options.send:
+        if job_ids:
+            print(f"Waiting for {len(job_ids)} Kindle deliveries...")
+            outbox.wait_idle()
+            statuses = [job['status'] for job in outbox.jobs() if job['id'] in job_ids]
+            print(f"Deliveries: {statuses.count(SENT)} sent, {statuses.count(PENDING)} waiting to retry, "
+                  f"{statuses.count(FAILED)} failed.")
+            if statuses.count(PENDING) or statuses.count(FAILED):
+                print("Run 'python book_downloader.py queue' to see and retry them.")
+        outbox.stop()
+        client.close()
 
 def helpMessage():
     print("\n\033[1mCommands:\033[0m")
@@ -862,11 +1210,89 @@ def helpMessage():
     print("\033[94mdownloadadd\033[0m - Download and add pages (save locally)")
     print("\033[94mconfig\033[0m - Configure your kindle email")
     print("\033[94mview\033[0m - View your current kindle email")
+    print("\033[94mqueue\033[0m - Show pending and failed Kindle deliveries")
+    print("\033[94mlibrary\033[0m - Search the books you have seen or downloaded (no API quota)")
     print("\033[94mhelp\033[0m - Show this help message")
     print("\033[94mexit\033[0m - Exit the program")
+    print("\nBatch mode: python book_downloader.py batch LIST [--policy first|smallest|epub3] (see --help)")
 
 def main():
+    parser = argparse.ArgumentParser(description="Search and download books from Anna's Archive.")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk API cache and search the API even when the library has matches")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time the search/download/injection/email phases and print a summary on exit")
+    parser.add_argument("--profile-json", metavar="PATH", help="Also write the profile as JSON")
+    parser.add_argument("--metrics-textfile", metavar="PATH",
+                        help="Also write the profile as Prometheus textfile metrics")
+    parser.add_argument("--cprofile", metavar="PATH", help="Run cProfile on the main thread and save pstats data")
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace memory allocations (slower)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch = subparsers.add_parser("batch", help="Download a list of titles/ISBNs/md5s without prompts")
+    batch.add_argument("input", help="Reading list file, or - for stdin")
+    batch.add_argument("--format", choices=["text", "csv", "jsonl"], default=None,
+                       help="Input format (default: from the file extension, else text)")
+    batch.add_argument("--ext", choices=["epub", "pdf"], default="epub")
+    batch.add_argument("--policy", choices=BATCH_POLICIES, default="first",
+                       help="How to pick a search result: first, smallest, or epub3 (prefer EPUB 3)")
+    batch.add_argument("--max-size", type=float, default=None, metavar="MB",
+                       help="Skip results larger than this many MB")
+    batch.add_argument("--workers", type=int, default=4, help="Workers for the probe and fetch stages")
+    batch.add_argument("--stage-workers", metavar="STAGE=N,...",
+                       help="Workers per stage (search, resolve, probe, fetch, inject, deliver)")
+    batch.add_argument("--queue-size", type=int, default=None,
+                       help="Items waiting in front of each stage (default: twice its workers)")
+    batch.add_argument("--inject", action="store_true", help="Add synthetic page numbers (EPUB only)")
+    batch.add_argument("--send", action="store_true", help="Email each book to the configured Kindle")
+    batch.add_argument("--output-dir", default=".")
+    batch.add_argument("--report", default="batch_results.jsonl", help="JSONL results file, or - for stdout")
+
+    queue = subparsers.add_parser("queue", help="Show pending and failed Kindle deliveries")
+    queue.add_argument("--retry-failed", action="store_true", help="Queue failed deliveries again")
+    queue.add_argument("--drain", action="store_true", help="Send everything that is due now, then exit")
+
+    library = subparsers.add_parser("library", help="Search the local catalog of seen and downloaded books")
+    library.add_argument("query", nargs="*", help="Title, author or ISBN words (none: recent downloads)")
+
+    args = parser.parse_args()
+    if args.no_cache:
+        # Every search goes to the API
+        api_cache.enabled = False
+        client.config.catalog_answer_searches = False
+
+    if args.profile or args.profile_json or args.metrics_textfile or args.cprofile or args.tracemalloc:
+        instrumentation.enable(profile_path=args.cprofile, trace_memory=args.tracemalloc)
+        # Runs however the program ends (exit command, Ctrl+C, end of batch)
+        atexit.register(instrumentation.finish, summary=args.profile or bool(args.cprofile) or args.tracemalloc,
+                        json_path=args.profile_json, prometheus_path=args.metrics_textfile)
+
+    if args.command == "batch":
+        if args.format is None:
+            extension = os.path.splitext(args.input)[1].lower().lstrip(".")
+            args.format = extension if extension in ("csv", "jsonl") else "text"
+        runBatch(args)
+        return
+
+    if args.command == "library":
+        viewLibrary(" ".join(args.query), prompt=False)
+        return
+
+    if args.command == "queue":
+        viewQueue(retry_failed=args.retry_failed)
+        if args.drain:
+            outbox.start(on_result=report_delivery)
+            outbox.wait_idle()
+            outbox.stop()
+            client.close()
+        return
+
+    # Deliver anything left in the outbox by an earlier run
+    queued = len(outbox.jobs([PENDING, SENDING]))
+    outbox.start(on_result=report_delivery)
+
     print("Welcome to the Book Downloader!")
+    if queued:
+        print(f"{queued} Kindle deliveries from an earlier run are queued (type 'queue' for details).")
     helpMessage()
     while True:
         command = input("Enter a command: ")
@@ -886,6 +1312,10 @@ def main():
             storeKindleEmailInConfig()
         elif command == "view":
             viewCurrentKindleEmail()
+        elif command == "queue":
+            viewQueue()
+        elif command == "library":
+            viewLibrary()
         elif command == "help":
             helpMessage()
         elif command == "exit":
@@ -893,4 +1323,5 @@ def main():
         else:
             print("\033[91mError: Command not recognized.\033[0m")
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
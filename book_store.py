@@ -0,0 +1,103 @@
+"""
+Content-addressed local store for downloaded books.
+
+Files are kept under `root/<md5[:2]>/<md5>`, keyed by the md5 reported by
+the API. Downloads are segmented and resumable, so the bytes do not arrive
+in order: a finished download is hashed once and only moved into the store
+if the hash matches. A later run can then reuse the bytes without touching
+the network. The store is capped in size; the least recently used books are
+evicted.
+"""
+import hashlib
+import os
+import shutil
+import threading
+
+
+class IntegrityError(Exception):
+    """Raised when downloaded bytes do not match the expected md5."""
+
+
+class BookStore:
+    def __init__(self, root, max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def path_for(self, md5):
+        md5 = md5.lower()
+        return os.path.join(self.root, md5[:2], md5)
+
+    def has(self, md5):
+        return os.path.isfile(self.path_for(md5))
+
+    def get(self, md5, dest_path):
+        """
+        Copy a stored book to dest_path. Returns False if it is not stored.
+        """
+        path = self.path_for(md5)
+        try:
+            shutil.copyfile(path, dest_path)
+        except FileNotFoundError:
+            return False
+        # The mtime doubles as "last used" for eviction
+        os.utime(path)
+        return True
+
+    def staging_path(self, md5):
+        """Where an in-progress download of md5 lives (stable, so it can resume)."""
+        path = self.path_for(md5) + ".download"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def adopt(self, md5, source_path):
+        """
+        Verify a downloaded file and move it into the store (no copy).
+        Raises IntegrityError and deletes the file if the md5 does not match.
+        Returns the stored path.
+        """
+        digest = hashlib.md5()
+        with open(source_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != md5.lower():
+            os.remove(source_path)
+            raise IntegrityError(f"md5 mismatch: expected {md5}, got {digest.hexdigest()}")
+
+        path = self.path_for(md5)
+        os.replace(source_path, path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used books until the store fits in max_bytes.
+        `keep` (a path) is never evicted, so a just-stored book stays usable.
+        """
+        with self.lock:
+            entries = []
+            total = 0
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    # Stored books are bare md5 names; anything else is staging
+                    if "." in name:
+                        continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,314 @@
+"""
+Local catalog of the books the program has seen.
+
+Every search result (md5, title, author, extension, size) is recorded in a
+SQLite table, along with what probing a candidate found out (EPUB version,
+identifiers, spine size, page navigation) and when the book was
+downloaded. Titles, authors and identifiers are indexed with FTS5, so
+searching the catalog is a local, ranked full-text query: no API quota,
+well under a millisecond for thousands of books.
+
+Lookups match every word of the query (as a prefix), case- and
+accent-insensitively, ranked by bm25 with title matches weighted highest.
+fuzzy=True tolerates typos when no book has all of the words: titles and
+authors are also indexed as trigrams (SQLite 3.34+), and books sharing
+most of the query's trigrams are returned, most similar first. Failing
+that, books matching any of the words are returned.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from search_fanout import find_isbn
+
+# bm25 weights of the indexed columns: title, author, identifiers
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+# Shorter query words are matched whole; as prefixes they would match a
+# large part of the vocabulary
+MIN_PREFIX_LENGTH = 3
+# Left out of queries that have other words: they match most of the catalog,
+# which costs time (bm25 reads every match) and adds nothing to the ranking
+STOPWORDS = frozenset("a an and at by for from in of on or the to with".split())
+# A typo-tolerant match shares at least this fraction of the query's trigrams
+FUZZY_MIN_SIMILARITY = 0.5
+# Trigram matches read per result wanted, to re-rank by similarity
+FUZZY_CANDIDATES = 5
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS books ("
+    " md5 TEXT PRIMARY KEY,"
+    " title TEXT NOT NULL DEFAULT '',"
+    " author TEXT NOT NULL DEFAULT '',"
+    " extension TEXT NOT NULL DEFAULT '',"
+    " size TEXT NOT NULL DEFAULT '',"
+    " identifiers TEXT NOT NULL DEFAULT '',"
+    " epub_version REAL,"
+    " spine_size INTEGER,"
+    " page_kind TEXT,"
+    " pages INTEGER,"
+    " downloaded_at REAL,"
+    " seen_at REAL NOT NULL,"
+    " raw TEXT NOT NULL DEFAULT '{}')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    " title, author, identifiers, content='books', content_rowid='rowid',"
+    " tokenize='unicode61 remove_diacritics 2')",
+    # Keep the index in step with the table
+    "CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN"
+    " INSERT INTO books_fts (rowid, title, author, identifiers)"
+    " VALUES (new.rowid, new.title, new.author, new.identifiers); END",
+    "CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN"
+    " INSERT INTO books_fts (books_fts, rowid, title, author, identifiers)"
+    " VALUES ('delete', old.rowid, old.title, old.author, old.identifiers); END",
+    "CREATE TRIGGER IF NOT EXISTS books_au AFTER UPDATE OF title, author, identifiers ON books BEGIN"
+    " INSERT INTO books_fts (books_fts, rowid, title, author, identifiers)"
+    " VALUES ('delete', old.rowid, old.title, old.author, old.identifiers);"
+    " INSERT INTO books_fts (rowid, title, author, identifiers)"
+    " VALUES (new.rowid, new.title, new.author, new.identifiers); END",
+    "CREATE INDEX IF NOT EXISTS books_recent ON books (downloaded_at, seen_at)",
+)
+
+# Trigram index of titles and authors for typo-tolerant lookups. Created
+# separately: SQLite before 3.34 has no trigram tokenizer
+TRIGRAM_SCHEMA = (
+    "CREATE VIRTUAL TABLE books_trigram USING fts5("
+    " title, author, content='books', content_rowid='rowid', tokenize='trigram')",
+    "CREATE TRIGGER books_tai AFTER INSERT ON books BEGIN"
+    " INSERT INTO books_trigram (rowid, title, author) VALUES (new.rowid, new.title, new.author); END",
+    "CREATE TRIGGER books_tad AFTER DELETE ON books BEGIN"
+    " INSERT INTO books_trigram (books_trigram, rowid, title, author)"
+    " VALUES ('delete', old.rowid, old.title, old.author); END",
+    "CREATE TRIGGER books_tau AFTER UPDATE OF title, author ON books BEGIN"
+    " INSERT INTO books_trigram (books_trigram, rowid, title, author)"
+    " VALUES ('delete', old.rowid, old.title, old.author);"
+    " INSERT INTO books_trigram (rowid, title, author) VALUES (new.rowid, new.title, new.author); END",
+    # Index the books recorded before the table existed
+    "INSERT INTO books_trigram (books_trigram) VALUES ('rebuild')",
+)
+
+COLUMNS = "b.md5, b.title, b.author, b.extension, b.size, b.epub_version, b.page_kind, b.pages, b.downloaded_at, b.raw"
+
+
+@dataclass
+class CatalogEntry:
+    md5: str
+    title: str
+    author: str
+    extension: str
+    size: str
+    epub_version: Optional[float] = None
+    page_kind: Optional[str] = None     # epub_inspect PageNavigation.kind, when page numbers were found
+    pages: Optional[int] = None
+    downloaded_at: Optional[float] = None
+    raw: dict = field(default_factory=dict, repr=False)     # the API's search result
+
+    @property
+    def downloaded(self):
+        return self.downloaded_at is not None
+
+    @property
+    def checked(self):
+        """Downloaded or inspected before, so more than a search result's word for what it is."""
+        return self.downloaded or self.epub_version is not None or self.pages is not None
+
+
+def match_expression(text, any_term=False):
+    """
+    FTS5 query for what the user typed: each word but stopwords as a
+    quoted term (a prefix from MIN_PREFIX_LENGTH letters), all of them
+    required or, with any_term, any of them. An ISBN is searched as one
+    term, without hyphens. Returns None when text has no words.
+    """
+    isbn = find_isbn(text)
+    terms = [isbn] if isbn else query_words(text)
+    if not terms:
+        return None
+    return (" OR " if any_term else " ").join(f'"{term}"*' if len(term) >= MIN_PREFIX_LENGTH else f'"{term}"'
+                                              for term in terms)
+
+
+def query_words(text):
+    """The words of text, lowercased, without stopwords (unless there is nothing else)."""
+    words = re.findall(r'\w+', text.lower())
+    return [word for word in words if word not in STOPWORDS] or words
+
+
+def trigrams(text):
+    """The set of three-letter sequences within the words of text."""
+    return {word[i:i + 3] for word in query_words(text) for i in range(len(word) - 2)}
+
+
+def identifier_text(identifiers):
+    """The identifiers to index, with ISBNs also written without hyphens."""
+    words = []
+    for identifier in identifiers:
+        words.append(identifier)
+        isbn = find_isbn(identifier)
+        if isbn and isbn != identifier:
+            words.append(isbn)
+    return " ".join(words)
+
+
+class Catalog:
+    """
+    SQLite/FTS5 catalog of seen and downloaded books. Safe to share between
+    threads. When `enabled` is False nothing is recorded and lookups find
+    nothing. Like the API cache, a broken catalog never breaks a command.
+    """
+
+    def __init__(self, path, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._create_trigram_index(conn)
+            self.conn = conn
+        return self.conn
+
+    @staticmethod
+    def _create_trigram_index(conn):
+        """Create the trigram index if needed; without a trigram tokenizer lookups go without it."""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'books_trigram'").fetchone():
+            return
+        try:
+            with conn:
+                for statement in TRIGRAM_SCHEMA:
+                    conn.execute(statement)
+        except sqlite3.OperationalError:
+            pass
+
+    def _write(self, sql, rows):
+        if not self.enabled or not rows:
+            return
+        try:
+            with self.lock:
+                conn = self._connect()
+                conn.executemany(sql, rows)
+                conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def _query(self, sql, params):
+        if not self.enabled:
+            return []
+        try:
+            with self.lock:
+                rows = self._connect().execute(sql, params).fetchall()
+        except sqlite3.Error:
+            return []
+        return [CatalogEntry(*row[:9], raw=json.loads(row[9] or "{}")) for row in rows]
+
+    def add_results(self, books):
+        """Record search results (API dicts); known books get their fields refreshed."""
+        now = time.time()
+        rows = [((book.get('md5') or "").lower(), book.get('title') or "", book.get('author') or "",
+                 (book.get('format') or book.get('extension') or "").lower(), book.get('size') or "",
+                 json.dumps(book), now)
+                for book in books or [] if book.get('md5')]
+        self._write(
+            "INSERT INTO books (md5, title, author, extension, size, raw, seen_at) VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (md5) DO UPDATE SET title = excluded.title, author = excluded.author,"
+            " extension = excluded.extension, size = excluded.size, raw = excluded.raw, seen_at = excluded.seen_at",
+            rows)
+
+    def record_inspection(self, md5, version, title=None, identifiers=(), spine_size=None, page_kind=None,
+                          pages=None):
+        """
+        Record what inspecting a book's EPUB found. page_kind/pages are only
+        overwritten when given, so a version-only probe keeps an earlier
+        page count. title is used for books no search has returned.
+        """
+        self._write(
+            "INSERT INTO books (md5, title, extension, identifiers, epub_version, spine_size, page_kind, pages,"
+            " seen_at) VALUES (?, ?, 'epub', ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (md5) DO UPDATE SET identifiers = excluded.identifiers,"
+            " epub_version = excluded.epub_version, spine_size = excluded.spine_size,"
+            " page_kind = coalesce(excluded.page_kind, page_kind), pages = coalesce(excluded.pages, pages)",
+            [(md5.lower(), title or "", identifier_text(identifiers), version, spine_size, page_kind, pages,
+              time.time())])
+
+    def mark_downloaded(self, md5, title="", extension=""):
+        """
+        Record that md5 was downloaded. A book no search or probe returned
+        gets a row of its own, with what the caller knows of its title and
+        extension; known books only have blank fields filled in.
+        """
+        now = time.time()
+        self._write(
+            "INSERT INTO books (md5, title, extension, downloaded_at, seen_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (md5) DO UPDATE SET downloaded_at = excluded.downloaded_at,"
+            " title = CASE WHEN books.title = '' THEN excluded.title ELSE books.title END,"
+            " extension = CASE WHEN books.extension = '' THEN excluded.extension ELSE books.extension END",
+            [(md5.lower(), title or "", (extension or "").lower(), now, now)])
+
+    def search(self, text, exts=None, limit=20, fuzzy=False):
+        """
+        Books matching text, best first. exts restricts the extensions
+        ("epub" or a tuple). With fuzzy, books with titles or authors like
+        the text (typos), then books matching any word, are returned when
+        none matches all of them.
+        """
+        if isinstance(exts, str):
+            exts = (exts,)
+        expression = match_expression(text)
+        if expression is None:
+            return []
+        entries = self._match("books_fts", RANK_WEIGHTS, expression, exts, limit)
+        if entries or not fuzzy:
+            return entries
+        return self._similar(text, exts, limit) or self._match("books_fts", RANK_WEIGHTS,
+                                                                match_expression(text, any_term=True), exts, limit)
+
+    def _match(self, table, weights, expression, exts, limit):
+        ext_filter = f" AND b.extension IN ({', '.join('?' * len(exts))})" if exts else ""
+        return self._query(
+            f"SELECT {COLUMNS} FROM {table} JOIN books b ON b.rowid = {table}.rowid"
+            f" WHERE {table} MATCH ?{ext_filter}"
+            f" ORDER BY bm25({table}, {', '.join(map(str, weights))}) LIMIT ?",
+            (expression, *(exts or ()), limit))
+
+    def _similar(self, text, exts, limit):
+        """Books sharing at least FUZZY_MIN_SIMILARITY of text's trigrams, most similar first."""
+        grams = trigrams(text)
+        if not grams:
+            return []
+        # Without the trigram index (old SQLite) the query fails and finds nothing
+        expression = " OR ".join(f'"{gram}"' for gram in sorted(grams))
+        scored = []
+        for entry in self._match("books_trigram", RANK_WEIGHTS[:2], expression, exts, limit * FUZZY_CANDIDATES):
+            similarity = len(grams & trigrams(f"{entry.title} {entry.author}")) / len(grams)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((similarity, entry))
+        scored.sort(key=lambda item: -item[0])
+        return [entry for _, entry in scored[:limit]]
+
+    def recent(self, limit=20):
+        """Downloaded books, most recent first, then the most recently seen ones."""
+        return self._query(
+            f"SELECT {COLUMNS} FROM books b ORDER BY b.downloaded_at IS NULL, b.downloaded_at DESC, b.seen_at DESC"
+            " LIMIT ?", (limit,))
+
+    def counts(self):
+        """(books, downloaded books) in the catalog."""
+        if not self.enabled:
+            return 0, 0
+        try:
+            with self.lock:
+                return self._connect().execute(
+                    "SELECT COUNT(*), COUNT(downloaded_at) FROM books").fetchone()
+        except sqlite3.Error:
+            return 0, 0
@@ -0,0 +1,492 @@
+"""
+Programmatic API for the book downloader.
+
+BookClient does what the interactive commands do (search, resolve an md5 to
+a download link, fetch the book, inject page numbers, email it to a Kindle)
+without input(), without files in the working directory and without
+reading config.py: settings are passed in as a ClientConfig. Methods return
+small typed records and raise ClientError subclasses where the commands
+print an error.
+
+    from client import BookClient, ClientConfig
+
+    with BookClient(ClientConfig(api_key="...")) as books:
+        found = books.search("Dune")
+        fetched = books.fetch(found.books[0].md5, "dune.epub")
+        books.inject_pages(fetched.path)
+        books.send(fetched.path, "me@kindle.com")
+
+The network methods have *_async twins for code running in an event loop
+(await aclose() before that loop ends); the plain methods run them on the
+shared background loop of async_http.
+The command-line program (book_downloader.py) is built on one BookClient.
+The HTTP, SMTP and EPUB libraries are imported when first needed.
+"""
+import asyncio
+import dataclasses
+import os
+import weakref
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import urlparse
+
+from api_cache import ApiCache, normalize_query
+from async_http import AsyncHttpClient, iterate_sync, run_sync
+from book_store import BookStore, IntegrityError
+from catalog import Catalog
+from instrumentation import span, count_bytes
+from results import ResultSet, parse_size_to_mb
+from search_fanout import MergedResults, fanout_params
+from segmented_download import DownloadCancelled, download_file_async
+
+DEFAULT_API_HOST = "annas-archive-api.p.rapidapi.com"
+DEFAULT_SOURCES = "libgenLi, libgenRs"
+LIBRARY_SOURCE = "library"      # SearchResult.params['source'] of results answered by the catalog
+
+
+class ClientError(Exception):
+    pass
+
+
+class ApiError(ClientError):
+    """The API could not be reached or gave an unusable answer. status is the HTTP status, if any."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class DownloadFailed(ClientError):
+    pass
+
+
+class IntegrityFailed(DownloadFailed):
+    """The downloaded file does not match its md5 (it has been discarded)."""
+
+
+class InjectionFailed(ClientError):
+    pass
+
+
+@dataclass
+class ClientConfig:
+    """Settings for a BookClient. The names and defaults match config.py."""
+    api_key: str = ""
+    api_host: str = DEFAULT_API_HOST
+    api_base_url: str = f"https://{DEFAULT_API_HOST}"
+    http_timeout: float = 60
+    http_max_retries: int = 4
+    api_requests_per_second: float = 5
+    async_pool_size: int = 100
+    async_per_host_limit: int = 8
+    async_host_limits: dict = field(default_factory=dict)
+    cache_path: Optional[str] = "~/.cache/epub-book-downloader/api_cache.sqlite3"   # None disables the cache
+    cache_max_entries: int = 5000
+    search_cache_ttl: float = 24 * 60 * 60
+    link_cache_ttl: float = 6 * 60 * 60
+    catalog_path: Optional[str] = "~/.cache/epub-book-downloader/catalog.sqlite3"  # None disables the catalog
+    catalog_answer_searches: bool = True        # fan-out searches try the catalog before the API
+    search_fanout_sources: tuple = (DEFAULT_SOURCES,)     # "" = all sources
+    search_fanout_max_queries: int = 6
+    search_fanout_all_sources_fallback: bool = True     # search all sources when the listed ones find nothing
+    book_store_dir: str = "~/.cache/epub-book-downloader/books"
+    book_store_max_mb: float = 2048
+    download_segments: int = 4
+    download_segment_min_mb: float = 4
+    page_injection_engine: str = "stream"
+    injection_workers: Optional[int] = None     # None = one per CPU, 1 = no process pool
+    parallel_injection_min_chapters: int = 64
+    email_address: str = ""
+    email_password: str = ""
+    smtp_server: str = "smtp.gmail.com"
+    smtp_port: int = 587
+    smtp_idle_timeout: float = 60
+    kindle_max_attachment_mb: float = 50
+
+    @classmethod
+    def from_module(cls, module):
+        """Build a config from a config.py-style module; missing names keep their defaults."""
+        names = {f.name for f in dataclasses.fields(cls)}
+        settings = {name: getattr(module, name) for name in names if hasattr(module, name)}
+        module_headers = getattr(module, 'headers', {})
+        settings.setdefault('api_key', module_headers.get("x-rapidapi-key", ""))
+        settings.setdefault('api_host', module_headers.get("x-rapidapi-host", DEFAULT_API_HOST))
+        return cls(**settings)
+
+    @property
+    def api_headers(self):
+        return {"x-rapidapi-key": self.api_key, "x-rapidapi-host": self.api_host}
+
+
+@dataclass
+class Book:
+    """One search result. raw is the API's dict, for fields not listed here."""
+    md5: str
+    title: str
+    author: str
+    size: str
+    extension: str
+    raw: dict = field(repr=False)
+
+    @classmethod
+    def from_api(cls, data):
+        return cls(md5=data.get('md5', ""), title=data.get('title') or "", author=data.get('author') or "",
+                   size=data.get('size') or "", extension=data.get('format') or data.get('extension') or "",
+                   raw=data)
+
+    @property
+    def size_mb(self):
+        return parse_size_to_mb(self.size)
+
+
+def link_extension(link):
+    """The file extension at the end of a download link's path ("epub"), or ""."""
+    name = urlparse(link).path.rsplit("/", 1)[-1]
+    _, dot, extension = name.rpartition(".")
+    return extension.lower() if dot and extension.isalnum() and len(extension) <= 5 else ""
+
+
+@dataclass
+class SearchResult:
+    params: dict
+    books: list
+    cached: bool
+    raw: dict = field(repr=False)
+    checked: int = 0        # catalog answers: books downloaded or inspected before (CatalogEntry.checked)
+
+    def result_set(self):
+        """The books as a ResultSet, for filtering and sorting by size or extension."""
+        return ResultSet.from_books(self.raw.get('books'))
+
+
+@dataclass
+class FanoutUpdate:
+    """One finished query of a fan-out search and the merged results so far."""
+    result: SearchResult
+    new_books: list         # books no earlier query returned, in this query's rank order
+    merged: MergedResults
+    done: int               # queries finished (including failed ones)
+    total: int
+
+    @property
+    def local(self):
+        """True for the catalog's answer, which comes before the API queries."""
+        return self.result.params.get("source") == LIBRARY_SOURCE
+
+
+@dataclass
+class FetchResult:
+    md5: str
+    path: str
+    size: int
+    from_store: bool
+
+
+@dataclass
+class InjectionResult:
+    path: str
+    pages: int
+
+
+@dataclass
+class DeliveryResult:
+    path: str
+    recipient: str
+    size: int
+
+
+def parse_api_json(response, context):
+    """Return the parsed JSON body of an API response, or raise ApiError."""
+    if response.status_code == 429:
+        raise ApiError(f"{context} limit reached. Please try again later.", 429)
+
+    if response.status_code != 200:
+        raise ApiError(f"{context} failed with status code {response.status_code}\n"
+                       f"Response: {response.text[:300]}", response.status_code)
+
+    if not response.text.strip():
+        raise ApiError(f"{context} returned an empty response.", response.status_code)
+
+    try:
+        return response.json()
+    except ValueError:
+        raise ApiError(f"{context} returned invalid JSON.\nRaw response: {response.text[:300]}",
+                       response.status_code)
+
+
+class BookClient:
+    """
+    Search, fetch, page-number and send books. Safe to share between
+    threads and event loops. Call close() (or use it as a context manager)
+    to release connections.
+    """
+
+    def __init__(self, config=None):
+        self.config = config = config or ClientConfig()
+        self.api_base_url = config.api_base_url.rstrip("/")
+        self.http = AsyncHttpClient(
+            pool_size=config.async_pool_size,
+            per_host_limit=config.async_per_host_limit,
+            host_limits=config.async_host_limits,
+            timeout=config.http_timeout,
+            max_retries=config.http_max_retries,
+            rate=config.api_requests_per_second,
+            rate_limited_hosts=[config.api_host, urlparse(self.api_base_url).hostname],
+        )
+        self.api_cache = ApiCache(os.path.expanduser(config.cache_path or ""), max_entries=config.cache_max_entries,
+                                  enabled=bool(config.cache_path))
+        self.catalog = Catalog(os.path.expanduser(config.catalog_path or ""), enabled=bool(config.catalog_path))
+        self.book_store = BookStore(os.path.expanduser(config.book_store_dir),
+                                    max_bytes=int(config.book_store_max_mb * 1024 * 1024))
+        self._mailer = None
+        self.download_locks = weakref.WeakKeyDictionary()
+
+    @property
+    def mailer(self):
+        """The KindleMailer for send(), created on first use."""
+        if self._mailer is None:
+            from kindle_delivery import KindleMailer
+            config = self.config
+            self._mailer = KindleMailer(
+                config.smtp_server, config.smtp_port, config.email_address, config.email_password,
+                idle_timeout=config.smtp_idle_timeout,
+                max_attachment_bytes=int(config.kindle_max_attachment_mb * 1024 * 1024),
+            )
+        return self._mailer
+
+    # --- Search and resolve ---
+
+    async def query_async(self, params):
+        """Run a search with raw API parameters (q, ext, sort, source, ...). Returns a SearchResult."""
+        key = normalize_query(params)
+        cached = self.api_cache.get("search", key)
+        if cached is not None:
+            self.catalog.add_results(cached.get('books'))
+            return SearchResult(dict(params), [Book.from_api(book) for book in cached.get('books') or []],
+                                True, cached)
+
+        try:
+            with span("api.search"):
+                response = await self.http.get(f"{self.api_base_url}/search", headers=self.config.api_headers,
+                                               params=params)
+            count_bytes("http.api", len(response.content))
+        except Exception as e:
+            raise ApiError(f"Could not reach the Search API: {e}") from e
+
+        data = parse_api_json(response, "Search API")
+        if not isinstance(data, dict):
+            raise ApiError("Search API returned an unexpected response.", response.status_code)
+
+        if data.get('books'):
+            self.api_cache.set("search", key, data, self.config.search_cache_ttl)
+            self.catalog.add_results(data['books'])
+        return SearchResult(dict(params), [Book.from_api(book) for book in data.get('books') or []], False, data)
+
+    async def search_async(self, query, ext="epub", sort="mostRelevant", source=DEFAULT_SOURCES):
+        return await self.query_async({"q": query, "ext": ext, "sort": sort, "source": source})
+
+    def search(self, query, ext="epub", sort="mostRelevant", source=DEFAULT_SOURCES):
+        """Search by title (or any text the API accepts). Returns a SearchResult; raises ApiError."""
+        return run_sync(self.search_async(query, ext, sort, source))
+
+    def search_local(self, query, ext="epub", limit=20):
+        """
+        Answer a search from the catalog of books seen before (no API call).
+        Returns a SearchResult whose params['source'] is LIBRARY_SOURCE.
+        """
+        params = {"q": query, "ext": ext, "source": LIBRARY_SOURCE}
+        with span("catalog.search"):
+            entries = self.catalog.search(query, ext, limit)
+        raw = [entry.raw or {'md5': entry.md5, 'title': entry.title, 'author': entry.author, 'size': entry.size,
+                             'format': entry.extension} for entry in entries]
+        return SearchResult(params, [Book.from_api(book) for book in raw], True, {'books': raw},
+                            sum(entry.checked for entry in entries))
+
+    async def search_fanout_async(self, query, ext="epub", sort="mostRelevant", author=None):
+        """
+        Search for query with several variants, extensions (ext may be a
+        tuple) and sources at once (see search_fanout.py). Yields a
+        FanoutUpdate as each query finishes, fastest first. When
+        catalog_answer_searches is set, the catalog's matches come first
+        and the API is only queried if the caller asks for more. When no
+        query finds anything and search_fanout_all_sources_fallback is set,
+        the variants are searched again against all sources. Queries that
+        fail are skipped; ApiError is raised only when all of them failed.
+        """
+        exts = (ext,) if isinstance(ext, str) else tuple(ext)
+        sources = self.config.search_fanout_sources or (DEFAULT_SOURCES,)
+        param_sets = fanout_params(query, exts, sources, sort, author, self.config.search_fanout_max_queries)
+        # Searching every source costs as many API calls again, so it is only
+        # paid for when the listed sources come back empty
+        fallback = []
+        if self.config.search_fanout_all_sources_fallback and all(sources):
+            fallback = fanout_params(query, exts, ("",), sort, author, self.config.search_fanout_max_queries)
+        merged = MergedResults()
+        if self.config.catalog_answer_searches:
+            local = self.search_local(query, exts)
+            if local.books:
+                yield FanoutUpdate(local, merged.add(local.books), merged, 0, len(param_sets))
+        done = 0
+        found = False
+        for wave in (param_sets, fallback):
+            if found or not wave:
+                break
+            total = done + len(wave)
+            tasks = [asyncio.ensure_future(self.query_async(params)) for params in wave]
+            errors = []
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    done += 1
+                    try:
+                        result = await finished
+                    except ApiError as e:
+                        errors.append(e)
+                        continue
+                    found = found or bool(result.books)
+                    yield FanoutUpdate(result, merged.add(result.books), merged, done, total)
+            finally:
+                # Stopped early (or failed): the slower queries are not needed
+                for task in tasks:
+                    task.cancel()
+            if len(errors) == len(tasks):
+                raise errors[0]
+
+    def search_fanout(self, query, ext="epub", sort="mostRelevant", author=None):
+        """
+        Blocking iterator over search_fanout_async's updates; the first
+        results arrive while slower queries are still running. Break out of
+        the loop to cancel the rest.
+        """
+        return iterate_sync(self.search_fanout_async(query, ext, sort, author))
+
+    async def resolve_async(self, md5):
+        cached = self.api_cache.get("download", md5)
+        if cached:
+            return cached
+
+        try:
+            with span("api.download_link"):
+                response = await self.http.get(f"{self.api_base_url}/download", headers=self.config.api_headers,
+                                               params={"md5": md5})
+            count_bytes("http.api", len(response.content))
+        except Exception as e:
+            raise ApiError(f"Could not reach the Download API: {e}") from e
+
+        data = parse_api_json(response, "Download API")
+        if not isinstance(data, list) or not data:
+            raise ApiError("No download link found in API response.", response.status_code)
+
+        self.api_cache.set("download", md5, data[0], self.config.link_cache_ttl)
+        return data[0]
+
+    def resolve(self, md5):
+        """Return the download URL for a book md5; raises ApiError."""
+        return run_sync(self.resolve_async(md5))
+
+    # --- Downloads ---
+
+    def download_lock(self, md5):
+        """One download per md5 at a time in an event loop (callers can share a file)."""
+        locks = self.download_locks.setdefault(asyncio.get_running_loop(), {})
+        return locks.setdefault(md5, asyncio.Lock())
+
+    async def download_to_store_async(self, md5, link=None, progress=None, cancel_event=None):
+        """
+        Download a book into the store (segmented and resumable when the host
+        supports ranges) and verify its md5. Returns the stored path. Raises
+        ApiError, DownloadFailed or IntegrityFailed, and DownloadCancelled
+        when cancel_event is set mid-download.
+        """
+        async with self.download_lock(md5):
+            if self.book_store.has(md5):
+                return self.book_store.path_for(md5)
+            link = link or await self.resolve_async(md5)
+            staging_path = self.book_store.staging_path(md5)
+            try:
+                with span("download.book"):
+                    await download_file_async(
+                        link, staging_path, headers=self.config.api_headers,
+                        segments=self.config.download_segments,
+                        min_segment_size=int(self.config.download_segment_min_mb * 1024 * 1024),
+                        progress=progress, cancel_event=cancel_event, client=self.http)
+                count_bytes("http.download", os.path.getsize(staging_path))
+                with span("download.verify"):
+                    # Hashing the file would stall the other downloads on this loop
+                    path = await asyncio.to_thread(self.book_store.adopt, md5, staging_path)
+                self.catalog.mark_downloaded(md5, extension=link_extension(link))
+                return path
+            except IntegrityError as e:
+                raise IntegrityFailed(f"Integrity check failed ({e}). File discarded.") from e
+            except DownloadCancelled:
+                raise
+            except Exception as e:
+                raise DownloadFailed(f"Download of {md5} failed: {e}") from e
+
+    async def fetch_async(self, md5, dest_path=None, link=None, progress=None, cancel_event=None):
+        from_store = self.book_store.has(md5)
+        path = await self.download_to_store_async(md5, link, progress, cancel_event)
+        if dest_path:
+            if not await asyncio.to_thread(self.book_store.get, md5, dest_path):
+                raise DownloadFailed(f"Could not copy {md5} out of the book store")
+            path = dest_path
+        return FetchResult(md5, path, os.path.getsize(path), from_store)
+
+    def fetch(self, md5, dest_path=None, link=None, progress=None, cancel_event=None):
+        """
+        Make sure the book is in the store (resolving and downloading it if
+        needed) and copy it to dest_path when given. progress(done, total)
+        is called as data arrives. Returns a FetchResult whose path is
+        dest_path, or the store's copy (do not modify that one).
+        """
+        return run_sync(self.fetch_async(md5, dest_path, link, progress, cancel_event))
+
+    # --- Page numbers and delivery ---
+
+    def inject_pages(self, path, output_path=None, words_per_page=300):
+        """
+        Add synthetic page numbers (EPUB 3 page-list) to the EPUB at path,
+        writing output_path or replacing the file. Returns an InjectionResult;
+        raises InjectionFailed (with the original error as its cause).
+        """
+        import epub_pages
+
+        # inject_page_numbers writes atomically, so the target is never left half-written
+        target = output_path or path
+        try:
+            pages = epub_pages.inject_page_numbers(
+                path, target, words_per_page, self.config.page_injection_engine,
+                self.config.injection_workers or os.cpu_count() or 1, self.config.parallel_injection_min_chapters)
+        except Exception as e:
+            raise InjectionFailed(f"Could not add page numbers to {os.path.basename(path)}: {e}") from e
+        if not pages:
+            raise InjectionFailed(f"Could not add page numbers to {os.path.basename(path)}: too little text")
+        return InjectionResult(target, pages)
+
+    def send(self, path, to_address, filename=None, subject=""):
+        """
+        Email a book to a Kindle address over the client's SMTP connection.
+        Returns a DeliveryResult; raises kindle_delivery.DeliveryError
+        (AttachmentTooLarge) or smtplib exceptions.
+        """
+        with span("smtp.send"):
+            self.mailer.send(path, to_address, filename=filename or os.path.basename(path), subject=subject)
+        size = os.path.getsize(path)
+        count_bytes("smtp.attachment", size)
+        return DeliveryResult(path, to_address, size)
+
+    async def aclose(self):
+        """Close the connection pool of the running event loop (call it before your loop ends)."""
+        await self.http.close()
+
+    def close(self):
+        """Close the SMTP connection and the connection pool of the background loop."""
+        if self._mailer is not None:
+            self._mailer.close()
+        if self.http.loops:
+            run_sync(self.http.close())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -3,8 +3,72 @@ email_address = ""
 email_password = ""
 smtp_server = "smtp.gmail.com"
 smtp_port = 587
+smtp_idle_timeout = 60          # Seconds an open SMTP connection is reused before reconnecting
+kindle_max_attachment_mb = 50   # Send to Kindle email size limit; larger books are not sent
+
+# Kindle delivery queue (books waiting to be emailed, retried in the background)
+outbox_dir = "~/.cache/epub-book-downloader/outbox"
+outbox_max_attempts = 5     # Attempts before a delivery is marked failed
+outbox_retry_seconds = 30   # First retry delay; doubles after each failed attempt
 
 headers = {
 	"x-rapidapi-key": "",
 	"x-rapidapi-host": "annas-archive-api.p.rapidapi.com"
-}
\ No newline at end of file
+}
+
+# API endpoint (set to e.g. "http://127.0.0.1:8765" to use benchmarks/mock_server.py)
+api_base_url = "https://annas-archive-api.p.rapidapi.com"
+
+# HTTP client tuning (optional; defaults are used if these are removed)
+http_pool_size = 10         # Connections kept alive per host
+http_timeout = 60           # Read timeout in seconds
+http_max_retries = 4        # Retries for connection errors, 429 and 5xx
+api_requests_per_second = 5 # Client-side cap for RapidAPI calls
+
+# Async engine used for API calls and downloads (sync commands share it too)
+async_pool_size = 100       # Open connections in total
+async_per_host_limit = 8    # Concurrent requests per host
+async_host_limits = {}      # Per-host overrides, e.g. {"annas-archive-api.p.rapidapi.com": 4}
+
+# API response cache (optional; run with --no-cache to bypass it)
+cache_path = "~/.cache/epub-book-downloader/api_cache.sqlite3"
+cache_max_entries = 5000    # Least recently used entries are evicted above this
+search_cache_ttl = 86400    # Seconds a search result stays valid
+link_cache_ttl = 21600      # Seconds a resolved download link stays valid
+
+# Local catalog of every book seen in search results or downloaded (the `library` command);
+# searches are answered from it first unless catalog_answer_searches is False (or --no-cache is given)
+catalog_path = "~/.cache/epub-book-downloader/catalog.sqlite3"
+catalog_answer_searches = True
+
+# Fan-out search for the interactive commands: title variants (as typed, normalized, "Title by Author",
+# ISBN) are searched against each source list at once ("" = all sources), up to search_fanout_max_queries
+# requests per search (1 = a single query, as before). Every extra source list multiplies the API calls.
+search_fanout_sources = ["libgenLi, libgenRs"]
+search_fanout_max_queries = 6
+# When no query finds anything, search the variants again against all sources
+search_fanout_all_sources_fallback = True
+
+# Local store of downloaded books, reused instead of downloading again
+book_store_dir = "~/.cache/epub-book-downloader/books"
+book_store_max_mb = 2048    # Least recently used books are evicted above this
+
+# Downloads (files larger than download_segment_min_mb are split into parallel ranges)
+download_segments = 4
+download_segment_min_mb = 4
+
+# Page number injection: "stream" (fast single pass) or "soup" (BeautifulSoup, original engine)
+page_injection_engine = "stream"
+injection_workers = None            # Processes for large books (None = one per CPU, 1 = off)
+parallel_injection_min_chapters = 64
+
+# Candidate selection: search results checked by sendadd/sendpages (and batch --policy epub3),
+# and the largest file sendadd considers (None = no limit)
+candidate_count = 5
+candidate_max_size_mb = 3.0
+
+# Page detection (sendpages): books without a page list are scanned for pagebreak markers until this many are found
+page_scan_marker_limit = 200
+
+# Batch mode pipeline: workers per stage (None = default; --stage-workers overrides)
+batch_stage_workers = {"search": 2, "resolve": 2, "probe": None, "fetch": None, "inject": None, "deliver": 1}
@@ -0,0 +1,248 @@
+"""
+Synthetic page numbers for EPUB files.
+
+inject_page_numbers() reads a book with ebooklib, inserts invisible page
+anchors every N words (insert_page_markers) and writes an EPUB 3 nav
+document and an NCX whose page lists point at them, next to the book's own
+table of contents (build_page_navigation, see nav_writer.py). Only the
+changed files are written back (repack_changes, see epub_repack.py). Kept apart
+from the command-line program so the library client (client.py) can use it
+without the REPL and its config.py.
+"""
+import io
+import posixpath
+import warnings
+import zipfile
+
+from bs4 import BeautifulSoup
+from ebooklib import epub
+
+from epub_inspect import find_opf_path
+from epub_repack import patch_opf, repack_epub
+from instrumentation import span
+from nav_writer import toc_nodes, write_nav, write_ncx
+from page_injector import PageIndex, inject_anchors, inject_anchors_parallel, page_id
+
+# --- HARDCODED CONSTANTS (To bypass ImportErrors) ---
+ITEM_UNKNOWN     = 0
+ITEM_IMAGE       = 1
+ITEM_STYLE       = 2
+ITEM_SCRIPT      = 3
+ITEM_NAVIGATION  = 4
+ITEM_VECTOR      = 5
+ITEM_FONT        = 6
+ITEM_VIDEO       = 7
+ITEM_AUDIO       = 8
+ITEM_DOCUMENT    = 9
+ITEM_SMIL        = 10
+
+
+def quiet(message):
+    pass
+
+
+def inject_page_numbers(input_path, output_path, words_per_page=300, engine="stream", workers=1,
+                        parallel_min_chapters=64, log=quiet):
+    """
+    Injects synthetic page numbers and forces an EPUB 3 Navigation file.
+    This 'Upgrade' strategy is required for modern Kindle Page Number support.
+
+    engine: "stream" (single-pass tokenizer, see page_injector.py) or
+    "soup" (the original BeautifulSoup pass). Books with at least
+    parallel_min_chapters chapters are scanned on `workers` processes.
+    The output is written atomically and may be input_path itself; files
+    that were not changed are copied over without recompressing them.
+    Progress messages go to log (e.g. print); nothing is printed by default.
+    Returns the number of pages added (0 for a book with too little text).
+    Errors propagate, and output_path is then untouched.
+    """
+    log(f"DEBUG: Reading EPUB: {input_path}")
+    with span("epub.read_epub"), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        book = epub.read_epub(input_path)
+
+    originals = item_contents(book)
+
+    # FORCE EPUB 3.0 (Required for Kindle to respect the Page List)
+    book.version = '3.0'
+
+    with span("inject.markers"):
+        pages, _ = insert_page_markers(book, words_per_page, engine, workers, parallel_min_chapters, log)
+    with span("inject.navigation"):
+        build_page_navigation(book, pages, log)
+
+    with span("epub.repack"):
+        copied = repack_changes(book, originals, input_path, output_path)
+    log(f"DEBUG: EPUB 3 Upgrade complete ({copied} unchanged files copied as they were).")
+    return len(pages)
+
+def insert_page_markers(book, words_per_page=300, engine="stream", workers=1, parallel_min_chapters=64,
+                        log=quiet):
+    """
+    STEP 1 of inject_page_numbers: add invisible page anchors to every text
+    document of an already-read book. Returns (pages, page_count), where
+    pages is a PageIndex and page_count the number the next page would get.
+    """
+    page_count = 1
+    pages = PageIndex()
+    word_accumulator = 0
+
+    # --- STEP 1: INSERT INVISIBLE PAGE MARKERS ---
+    # The nav document is rewritten in step 2, so it gets no markers
+    docs = [item for item in book.get_items_of_type(ITEM_DOCUMENT) if not isinstance(item, epub.EpubNav)]
+    log(f"DEBUG: Found {len(docs)} text chapters/documents.")
+
+    if engine == "stream" and workers > 1 and len(docs) >= parallel_min_chapters:
+        # Large books: scan chapters on a process pool (same output as the serial loop)
+        # A failing chapter is skipped with a warning, as in the serial loop
+        warn = lambda name, e_inner: log(f"DEBUG: Warning processing chapter {name}: {e_inner}")
+        chapters, scanned = [], []
+        for item in docs:
+            try:
+                chapters.append((item.get_name(),
+                                 item.content if isinstance(item.content, bytes) else item.content.encode('utf-8')))
+                scanned.append(item)
+            except Exception as e_inner:
+                warn(item.get_name(), e_inner)
+        contents, pages, word_accumulator, page_count = inject_anchors_parallel(
+            chapters, words_per_page, workers, on_error=warn)
+        for item, (_, original), content in zip(scanned, chapters, contents):
+            if content is not original:
+                item.set_content(content)
+    else:
+        for item in docs:
+            if engine == "stream":
+                try:
+                    raw = item.content if isinstance(item.content, bytes) else item.content.encode('utf-8')
+                    content, numbers, word_accumulator, page_count = inject_anchors(
+                        raw, words_per_page, word_accumulator, page_count)
+                    if numbers:
+                        item.set_content(content)
+                        pages.add_chapter(item.get_name(), numbers)
+                except Exception as e_inner:
+                    log(f"DEBUG: Warning processing chapter {item.get_name()}: {e_inner}")
+                continue
+
+            try:
+                with span("inject.soup_parse"):
+                    soup = BeautifulSoup(item.get_content(), 'html.parser')
+                if len(soup.get_text()) < 50: continue
+
+                paragraphs = soup.find_all(['p', 'div', 'span'])
+                modified = False
+
+                for tag in paragraphs:
+                    text = tag.get_text()
+                    word_accumulator += len(text.split())
+
+                    if word_accumulator >= words_per_page:
+                        # Kindle-safe anchor
+                        anchor = soup.new_tag("span", id=page_id(page_count))
+                        anchor.string = "" 
+                        tag.insert_before(anchor)
+                    
+                        pages.add(item.get_name(), page_count)
+                        page_count += 1
+                        word_accumulator = 0
+                        modified = True
+
+                if modified: 
+                    item.set_content(str(soup).encode('utf-8'))
+            except Exception as e_inner:
+                log(f"DEBUG: Warning processing chapter {item.get_name()}: {e_inner}")
+
+    log(f"DEBUG: Generated {len(pages)} synthetic pages.")
+
+    return pages, page_count
+
+def unused_file_name(book, file_name):
+    """file_name, or a variant of it that no item of the book uses yet."""
+    taken = {item.get_name() for item in book.get_items()}
+    stem, dot, extension = file_name.rpartition('.')
+    number = 1
+    while file_name in taken:
+        number += 1
+        file_name = f"{stem}-{number}{dot}{extension}"
+    return file_name
+
+def build_page_navigation(book, pages, log=quiet):
+    """
+    STEP 2 of inject_page_numbers: write an EPUB 3 nav document and an NCX
+    (for EPUB 2 readers), both with the book's own table of contents and a
+    page list pointing at the anchors from insert_page_markers.
+
+    They are stored as plain items: ebooklib regenerates EpubNav and EpubNcx
+    items from book.toc when writing, which would drop the page list.
+    """
+    nav_item = next((item for item in book.get_items() if isinstance(item, epub.EpubNav)), None)
+    ncx_item = next((item for item in book.get_items() if isinstance(item, epub.EpubNcx)), None)
+
+    # ebooklib reads the TOC from the NCX when there is one, and keeps its hrefs NCX-relative
+    toc = toc_nodes(book.toc, posixpath.dirname(ncx_item.get_name()) if ncx_item else "")
+    if not toc:
+        first = next((item for item in book.get_items_of_type(ITEM_DOCUMENT) if item is not nav_item), None)
+        href = pages.first_href() or (first.get_name() if first else None)
+        toc = [(book.title or "Start", href, [])] if href else []
+    language = book.language or "en"
+
+    if nav_item is None:
+        log("DEBUG: Creating new EPUB 3 Navigation file (nav.xhtml)...")
+        nav_id, nav_name = 'nav', unused_file_name(book, 'nav.xhtml')
+    else:
+        book.items.remove(nav_item)
+        nav_id, nav_name = nav_item.get_id(), nav_item.get_name()
+    content = io.BytesIO()
+    write_nav(content, toc, pages, book.title, language, posixpath.dirname(nav_name))
+    nav = epub.EpubItem(uid=nav_id, file_name=nav_name, media_type='application/xhtml+xml',
+                        content=content.getvalue())
+    # Marks it as the EPUB 3 navigation document in the manifest
+    nav.properties = ['nav']
+    book.add_item(nav)
+
+    # The spine's toc attribute is written as "ncx" unless an EpubNcx is present
+    if ncx_item is None:
+        ncx_name = unused_file_name(book, 'toc.ncx')
+    else:
+        book.items.remove(ncx_item)
+        ncx_name = ncx_item.get_name()
+    content = io.BytesIO()
+    write_ncx(content, toc, pages, book.uid, book.title, language, posixpath.dirname(ncx_name))
+    book.add_item(epub.EpubItem(uid='ncx', file_name=ncx_name, media_type='application/x-dtbncx+xml',
+                                content=content.getvalue()))
+
+def item_contents(book):
+    """Each item's current content, to tell later which items were changed (see repack_changes)."""
+    return {item: item.content for item in book.get_items()}
+
+def repack_changes(book, originals, input_path, output_path):
+    """
+    STEP 3 of inject_page_numbers: write output_path from input_path with
+    only the items whose content changed since item_contents(book) was taken
+    (chapters with markers, the nav document, the NCX) replaced, new items
+    added to the manifest and the OPF version updated. Everything else is
+    copied raw (see epub_repack.py). Returns the number of files copied.
+    """
+    with zipfile.ZipFile(input_path) as archive:
+        opf_path = find_opf_path(archive)
+        opf = archive.read(opf_path)
+        names = set(archive.namelist())
+    opf_dir = posixpath.dirname(opf_path)
+
+    replacements = {}
+    new_items = []
+    ncx_id = None
+    for item in book.get_items():
+        content = item.content
+        if content is None or originals.get(item) is content:
+            continue
+        # Manifest hrefs may climb out of the OPF directory (../Text/ch1.xhtml)
+        path = posixpath.normpath(posixpath.join(opf_dir, item.get_name()))
+        replacements[path] = content if isinstance(content, bytes) else content.encode('utf-8')
+        if path not in names:
+            properties = ' '.join(getattr(item, 'properties', ())) or None
+            new_items.append((item.get_id(), path, item.media_type, properties))
+            if item.media_type == 'application/x-dtbncx+xml':
+                ncx_id = item.get_id()
+
+    replacements[opf_path] = patch_opf(opf, opf_dir, book.version, new_items, ncx_id)
+    return repack_epub(input_path, output_path, replacements)
@@ -0,0 +1,211 @@
+"""
+Repacking an EPUB without recompressing what did not change.
+
+Page injection only changes some chapters, the nav document, the NCX and
+the OPF. repack_epub() copies every other entry of the source archive as
+its raw compressed bytes (no inflate/deflate), deflates just the replaced
+and added entries, writes the `mimetype` entry first and stored as the
+OCF spec requires, and writes to a temporary file that replaces the output
+only once it is complete. The output may be the source file itself.
+
+zipfile has no public way to copy an entry without decompressing it, so
+the archive is written here with its own small ZIP writer (no ZIP64: books
+over 4 GB are refused).
+"""
+import os
+import posixpath
+import re
+import struct
+import time
+import zipfile
+import zlib
+from urllib.parse import quote
+
+MIMETYPE = b"application/epub+zip"
+COMPRESS_LEVEL = 6
+COPY_BLOCK_SIZE = 1024 * 1024
+ZIP32_LIMIT = 0xFFFFFFFF
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+CENTRAL_HEADER = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+END_RECORD = struct.Struct('<4sHHHHLLH')
+LOCAL_SIGNATURE = b'PK\x03\x04'
+CENTRAL_SIGNATURE = b'PK\x01\x02'
+END_SIGNATURE = b'PK\x05\x06'
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION_NEEDED = 20
+VERSION_MADE_BY = 0x0314      # Unix, ZIP 2.0 features
+
+
+class RepackError(Exception):
+    """The source archive cannot be repacked (ZIP64 sizes, broken headers)."""
+
+
+def dos_fields(date_time):
+    """(time, date) header fields for a (year, month, day, hour, minute, second) tuple."""
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((max(1980, year) - 1980) << 9) | (month << 5) | day
+
+
+class _ZipWriter:
+    """Writes local entries as they come and the central directory at the end."""
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0
+        self.central = []
+
+    def _write(self, data):
+        self.f.write(data)
+        self.offset += len(data)
+
+    def entry(self, name, method, mod_time, mod_date, crc, compressed_size, size, chunks,
+              flags=0, external_attr=0, version_needed=VERSION_NEEDED):
+        """Write one entry whose data (already compressed with `method`) comes from chunks."""
+        if self.offset > ZIP32_LIMIT or compressed_size > ZIP32_LIMIT or size > ZIP32_LIMIT:
+            raise RepackError("Archive too large to repack (ZIP64 is not supported)")
+        encoded = name.encode('utf-8')
+        flags = (flags & ~FLAG_DATA_DESCRIPTOR) | (FLAG_UTF8 if not name.isascii() else 0)
+        header_offset = self.offset
+        self._write(LOCAL_HEADER.pack(LOCAL_SIGNATURE, version_needed, flags, method, mod_time, mod_date,
+                                      crc, compressed_size, size, len(encoded), 0))
+        self._write(encoded)
+        for chunk in chunks:
+            self._write(chunk)
+        self.central.append(CENTRAL_HEADER.pack(
+            CENTRAL_SIGNATURE, VERSION_MADE_BY, version_needed, flags, method, mod_time, mod_date, crc,
+            compressed_size, size, len(encoded), 0, 0, 0, 0, external_attr, header_offset) + encoded)
+
+    def new_entry(self, name, data, compress=True):
+        """Write data as a new entry, deflated (or stored when compress is False)."""
+        crc = zlib.crc32(data)
+        if compress:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+            stored = compressor.compress(data) + compressor.flush()
+            method = zipfile.ZIP_DEFLATED
+        else:
+            stored, method = data, zipfile.ZIP_STORED
+        mod_time, mod_date = dos_fields(time.localtime()[:6])
+        self.entry(name, method, mod_time, mod_date, crc, len(stored), len(data), (stored,),
+                   external_attr=0o644 << 16)
+
+    def close(self):
+        start = self.offset
+        for record in self.central:
+            self._write(record)
+        if len(self.central) > 0xFFFF or start > ZIP32_LIMIT:
+            raise RepackError("Archive too large to repack (ZIP64 is not supported)")
+        self._write(END_RECORD.pack(END_SIGNATURE, 0, 0, len(self.central), len(self.central),
+                                    self.offset - start, start, 0))
+
+
+def _raw_chunks(source, info):
+    """Yield the compressed bytes of an entry straight from the source file."""
+    source.seek(info.header_offset)
+    header = source.read(LOCAL_HEADER.size)
+    if len(header) != LOCAL_HEADER.size or header[:4] != LOCAL_SIGNATURE:
+        raise RepackError(f"Bad local header for {info.filename}")
+    fields = LOCAL_HEADER.unpack(header)
+    source.seek(info.header_offset + LOCAL_HEADER.size + fields[9] + fields[10])
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.read(min(COPY_BLOCK_SIZE, remaining))
+        if not chunk:
+            raise RepackError(f"Truncated entry {info.filename}")
+        remaining -= len(chunk)
+        yield chunk
+
+
+def repack_epub(source_path, output_path, replacements):
+    """
+    Write source_path to output_path with the entries in replacements
+    ({archive path: bytes}) replaced or, for new paths, appended. Everything
+    else is copied without recompression. Returns the number of entries
+    copied raw.
+    """
+    temp_path = output_path + ".tmp"
+    copied = 0
+    try:
+        with open(source_path, 'rb') as source, zipfile.ZipFile(source) as archive, open(temp_path, 'wb') as out:
+            writer = _ZipWriter(out)
+            writer.new_entry('mimetype', MIMETYPE, compress=False)
+            written = {'mimetype'}
+
+            for info in archive.infolist():
+                name = info.filename
+                if name in written or info.is_dir():
+                    continue
+                written.add(name)
+                if name in replacements:
+                    writer.new_entry(name, replacements[name])
+                    continue
+                mod_time, mod_date = dos_fields(info.date_time)
+                writer.entry(name, info.compress_type, mod_time, mod_date, info.CRC, info.compress_size,
+                             info.file_size, _raw_chunks(source, info), info.flag_bits, info.external_attr,
+                             max(VERSION_NEEDED, info.extract_version))
+                copied += 1
+
+            for name, data in replacements.items():
+                if name not in written:
+                    writer.new_entry(name, data)
+            writer.close()
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return copied
+
+
+# --- OPF edits ---
+# The package document is patched in place (rather than re-serialized) so
+# everything the edits do not touch stays byte-for-byte the same.
+
+def _prefix(opf, local_name):
+    """Namespace prefix ('opf:' or '') the OPF uses for an element."""
+    match = re.search(rb'</?(\w+:)?' + local_name + rb'\b', opf)
+    return match.group(1) or b'' if match else b''
+
+
+def _insert_before_close(opf, local_name, markup):
+    match = re.search(rb'</(?:\w+:)?' + local_name + rb'\s*>', opf)
+    if match is None:
+        raise RepackError(f"OPF has no {local_name.decode()} element")
+    return opf[:match.start()] + markup + opf[match.start():]
+
+
+def patch_opf(opf, opf_dir, version=None, add_items=(), spine_toc=None):
+    """
+    Apply the page-injection edits to OPF bytes. version sets the package
+    version (upgrading to 3 also adds the required dcterms:modified). add_items
+    are (id, archive path, media type, properties or None) tuples for the
+    manifest. spine_toc sets the spine's toc attribute when it has none.
+    """
+    if version is not None:
+        opf, count = re.subn(rb'(<(?:\w+:)?package\b[^>]*?\bversion\s*=\s*)(["\'])[^"\']*\2',
+                             lambda m: m.group(1) + b'"' + version.encode() + b'"', opf, count=1)
+        if not count:
+            opf = re.sub(rb'<((?:\w+:)?package)\b', lambda m: b'<' + m.group(1) + b' version="' +
+                         version.encode() + b'"', opf, count=1)
+        if version.startswith('3') and b'dcterms:modified' not in opf:
+            stamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()).encode()
+            meta = b'<' + _prefix(opf, b'metadata') + b'meta property="dcterms:modified">' + stamp
+            meta += b'</' + _prefix(opf, b'metadata') + b'meta>\n'
+            opf = _insert_before_close(opf, b'metadata', meta)
+
+    if add_items:
+        prefix = _prefix(opf, b'manifest')
+        markup = b''
+        for item_id, path, media_type, properties in add_items:
+            href = quote(posixpath.relpath(path, opf_dir) if opf_dir else path, safe="/")
+            markup += (b'<' + prefix + b'item id="' + item_id.encode() + b'" href="' + href.encode() +
+                       b'" media-type="' + media_type.encode() + b'"' +
+                       (b' properties="' + properties.encode() + b'"' if properties else b'') + b'/>\n')
+        opf = _insert_before_close(opf, b'manifest', markup)
+
+    if spine_toc and not re.search(rb'<(?:\w+:)?spine\b[^>]*\btoc\s*=', opf):
+        opf = re.sub(rb'<((?:\w+:)?spine)\b', lambda m: b'<' + m.group(1) + b' toc="' + spine_toc.encode() + b'"',
+                     opf, count=1)
+    return opf
@@ -0,0 +1,202 @@
+"""
+Shared HTTP client for the book downloader.
+
+Every request goes through one pooled requests.Session, so the TLS handshake
+to the RapidAPI host is paid once per run instead of once per call. Calls to
+rate-limited hosts wait on a token bucket that follows the RapidAPI
+X-RateLimit-* headers and Retry-After, and failed requests are retried with
+jittered exponential backoff.
+
+requests is imported when the first client is built, so commands that never
+touch the network do not pay for it.
+"""
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+# Status codes worth retrying (rate limit + transient server errors)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value):
+    """
+    Convert a Retry-After header (seconds or an HTTP date) to seconds.
+    Returns None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Each request takes one token; tokens refill at
+    `rate` per second up to `capacity`. The server can also pause the bucket
+    (Retry-After, or the quota headers reporting 0 remaining).
+    """
+
+    def __init__(self, rate=5.0, capacity=5):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Take a token if one is available and return 0, else return the seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+    def acquire(self):
+        """Block until a token is available."""
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold all requests for `seconds` (never shortens an existing pause)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def update_from_headers(self, response_headers):
+        """
+        Follow the RapidAPI quota headers: when no requests remain, wait for
+        the reset window instead of burning retries on 429s.
+        """
+        remaining = response_headers.get('x-ratelimit-requests-remaining')
+        reset = response_headers.get('x-ratelimit-requests-reset')
+        try:
+            if remaining is not None and int(remaining) <= 0 and reset is not None:
+                self.pause(float(reset))
+        except ValueError:
+            pass
+
+
+class HttpClient:
+    """
+    Pooled HTTP client with retries. Use get_client() for the shared instance.
+    """
+
+    def __init__(self, pool_size=10, timeout=60, connect_timeout=10, max_retries=4,
+                 backoff_base=0.5, backoff_max=30.0, rate=5.0, burst=5, rate_limited_hosts=()):
+        self.timeout = (connect_timeout, timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate = rate
+        self.burst = burst
+        self.rate_limited_hosts = set(rate_limited_hosts)
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def bucket_for(self, url):
+        """Return the token bucket for a rate-limited host, or None."""
+        host = urlparse(url).hostname
+        if host not in self.rate_limited_hosts:
+            return None
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method, url, **kwargs):
+        """
+        One request through the shared session. Connection errors and
+        RETRY_STATUSES are retried; the last response is returned once retries
+        run out so callers can still report the status code.
+        """
+        import requests
+
+        kwargs.setdefault('timeout', self.timeout)
+        bucket = self.bucket_for(url)
+
+        for attempt in range(self.max_retries + 1):
+            if bucket:
+                bucket.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff(attempt))
+                continue
+
+            if bucket:
+                bucket.update_from_headers(response.headers)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            delay = max(retry_after or 0, self.backoff(attempt))
+            if bucket and response.status_code == 429:
+                bucket.pause(delay)
+            response.close()
+            time.sleep(delay)
+
+    # get/head mirror requests.Session, so the client can stand in for one
+    # (RemoteZip(session=get_client()) probes with retries and rate limits)
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+
+_client = None
+_client_settings = {}
+_client_lock = threading.Lock()
+
+
+def configure_client(**settings):
+    """
+    Set the settings of the shared client (see HttpClient). It is built
+    with them on the next get_client() call.
+    """
+    global _client, _client_settings
+    with _client_lock:
+        _client = None
+        _client_settings = settings
+
+
+def get_client():
+    """Return the shared client, creating it from the configured settings if needed."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(**_client_settings)
+        return _client
+
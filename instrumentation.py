@@ -0,0 +1,200 @@
+"""
+Lightweight timing and byte counters for the hot paths.
+
+Code wraps its phases in `with span("epub.read"):` and reports transferred
+data with `count_bytes("http.download", n)`. Both are no-ops until enable()
+is called (the --profile flag), so the instrumented code costs nothing in a
+normal run. When enabled, spans are timed with time.perf_counter and
+aggregated per name (count, total, min, max), and can optionally be
+combined with cProfile and tracemalloc.
+
+At the end of a run, print_summary() shows a table, and write_json() /
+write_prometheus() export the same numbers (the latter in the node_exporter
+textfile format).
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+_enabled = False
+_lock = threading.Lock()
+_spans = {}         # name -> [count, total, min, max]
+_counters = {}      # name -> bytes
+_started_at = None
+_profiler = None
+_profile_path = None
+_trace_memory = False
+
+
+class _Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def span(name):
+    """Context manager timing one phase under `name` (nothing happens when disabled)."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def record(name, seconds):
+    """Add one timing for `name` (for phases that are not a single with-block)."""
+    if not _enabled:
+        return
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            _spans[name] = [1, seconds, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds < stats[2]:
+                stats[2] = seconds
+            if seconds > stats[3]:
+                stats[3] = seconds
+
+
+def count_bytes(name, nbytes):
+    """Add nbytes to the byte counter `name`."""
+    if not _enabled or not nbytes:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + nbytes
+
+
+def enabled():
+    return _enabled
+
+
+def enable(profile_path=None, trace_memory=False):
+    """
+    Start collecting. profile_path also runs cProfile on the calling thread
+    and saves pstats data there; trace_memory starts tracemalloc.
+    """
+    global _enabled, _started_at, _profiler, _profile_path, _trace_memory
+    _enabled = True
+    _started_at = time.perf_counter()
+    if profile_path:
+        import cProfile
+        _profile_path = profile_path
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    if trace_memory:
+        import tracemalloc
+        _trace_memory = True
+        tracemalloc.start(10)
+
+
+def snapshot():
+    """Everything collected so far as a JSON-serializable dict."""
+    with _lock:
+        spans = {name: {"count": stats[0], "total_seconds": round(stats[1], 6),
+                        "mean_seconds": round(stats[1] / stats[0], 6),
+                        "min_seconds": round(stats[2], 6), "max_seconds": round(stats[3], 6)}
+                 for name, stats in sorted(_spans.items())}
+        counters = dict(sorted(_counters.items()))
+    data = {"wall_seconds": round(time.perf_counter() - _started_at, 3) if _started_at else 0,
+            "spans": spans, "bytes": counters}
+    if _trace_memory:
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+        data["memory"] = {"current_bytes": current, "peak_bytes": peak,
+                          "top_allocations": [{"where": str(stat.traceback[0]), "bytes": stat.size}
+                                              for stat in top]}
+    return data
+
+
+def format_bytes(nbytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024 or unit == "GB":
+            return f"{nbytes:.0f} {unit}" if unit == "B" else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+
+
+def print_summary(data=None):
+    data = data or snapshot()
+    print(f"\n\033[1mProfile ({data['wall_seconds']:.1f}s wall clock):\033[0m")
+    if data["spans"]:
+        print(f"{'span':<24} {'calls':>6} {'total s':>9} {'mean ms':>9} {'max ms':>9}")
+        for name, stats in sorted(data["spans"].items(), key=lambda item: -item[1]["total_seconds"]):
+            print(f"{name:<24} {stats['count']:>6} {stats['total_seconds']:>9.3f} "
+                  f"{stats['mean_seconds'] * 1000:>9.1f} {stats['max_seconds'] * 1000:>9.1f}")
+    else:
+        print("No instrumented phases ran.")
+    for name, nbytes in data["bytes"].items():
+        print(f"{name:<24} {format_bytes(nbytes):>16}")
+    if "memory" in data:
+        memory = data["memory"]
+        print(f"Memory: {format_bytes(memory['current_bytes'])} now, {format_bytes(memory['peak_bytes'])} peak (traced)")
+        for allocation in memory["top_allocations"][:5]:
+            print(f"  {format_bytes(allocation['bytes']):>10}  {allocation['where']}")
+
+
+def write_json(path, data=None):
+    with open(path, "w") as f:
+        json.dump(data or snapshot(), f, indent=2)
+
+
+def write_prometheus(path, data=None, prefix="epub_downloader"):
+    """Write the metrics in Prometheus text format (atomically, for the textfile collector)."""
+    data = data or snapshot()
+    lines = [f"# HELP {prefix}_span_seconds_total Time spent in an instrumented phase.",
+             f"# TYPE {prefix}_span_seconds_total counter"]
+    lines += [f'{prefix}_span_seconds_total{{span="{name}"}} {stats["total_seconds"]}'
+              for name, stats in data["spans"].items()]
+    lines += [f"# HELP {prefix}_span_calls_total Times an instrumented phase ran.",
+              f"# TYPE {prefix}_span_calls_total counter"]
+    lines += [f'{prefix}_span_calls_total{{span="{name}"}} {stats["count"]}'
+              for name, stats in data["spans"].items()]
+    lines += [f"# HELP {prefix}_span_max_seconds Longest single run of an instrumented phase.",
+              f"# TYPE {prefix}_span_max_seconds gauge"]
+    lines += [f'{prefix}_span_max_seconds{{span="{name}"}} {stats["max_seconds"]}'
+              for name, stats in data["spans"].items()]
+    lines += [f"# HELP {prefix}_bytes_total Bytes transferred.",
+              f"# TYPE {prefix}_bytes_total counter"]
+    lines += [f'{prefix}_bytes_total{{counter="{name}"}} {nbytes}' for name, nbytes in data["bytes"].items()]
+    if "memory" in data:
+        lines += [f"# TYPE {prefix}_traced_memory_peak_bytes gauge",
+                  f"{prefix}_traced_memory_peak_bytes {data['memory']['peak_bytes']}"]
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_path, path)
+
+
+def finish(summary=True, json_path=None, prometheus_path=None):
+    """Stop cProfile (saving its data) and report. Safe to call when disabled."""
+    global _profiler
+    if not _enabled:
+        return
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profile_path)
+        _profiler = None
+    data = snapshot()
+    if summary:
+        print_summary(data)
+        if _profile_path:
+            print(f"cProfile data saved to {_profile_path} (python -m pstats {_profile_path})")
+    if json_path:
+        write_json(json_path, data)
+    if prometheus_path:
+        write_prometheus(prometheus_path, data)
@@ -0,0 +1,254 @@
+"""
+Email delivery of books to a Kindle address.
+
+Building an EmailMessage keeps the whole book in memory twice (the raw bytes
+and their base64 encoding). Here the MIME message is written straight onto
+the SMTP connection: the book is read from disk in chunks and base64-encoded
+line by line, so memory use does not depend on the size of the book.
+
+One authenticated connection is kept open and reused for following sends
+(batch mode, several books in one session); it is reopened when it has been
+idle for too long or the server dropped it. The Kindle attachment limit is
+checked against the file size before anything is encoded or uploaded.
+smtplib and email.utils are imported on the first send.
+"""
+import base64
+import os
+import threading
+import time
+
+# Send to Kindle accepts emails up to 50 MB
+KINDLE_MAX_ATTACHMENT_BYTES = 50 * 1024 * 1024
+
+# 57 raw bytes encode to one 76-character base64 line
+LINE_BYTES = 57
+READ_LINES = 1024
+
+
+class DeliveryError(Exception):
+    pass
+
+
+class AttachmentTooLarge(DeliveryError):
+    pass
+
+
+def encoded_size(nbytes):
+    """Size of nbytes once base64-encoded in CRLF-terminated 76-character lines."""
+    full_lines, rest = divmod(nbytes, LINE_BYTES)
+    size = full_lines * 78
+    if rest:
+        size += 4 * -(-rest // 3) + 2
+    return size
+
+
+def attachment_filename_param(filename):
+    """filename="..." for ASCII names, RFC 2231 filename*= otherwise."""
+    from email.utils import encode_rfc2231
+    try:
+        filename.encode('ascii')
+        return 'filename="{}"'.format(filename.replace('\\', '\\\\').replace('"', '\\"'))
+    except UnicodeEncodeError:
+        return "filename*={}".format(encode_rfc2231(filename, 'utf-8'))
+
+
+class StreamedMessage:
+    """
+    A multipart/mixed email with one file attachment, produced piece by
+    piece. size is the exact number of bytes that will be sent (used for
+    the SMTP SIZE extension).
+    """
+
+    def __init__(self, from_address, to_address, path, filename=None, subject=""):
+        from email.utils import formatdate, make_msgid
+
+        self.path = path
+        self.file_size = os.path.getsize(path)
+        boundary = "=_book_" + make_msgid().strip("<>").split("@")[0].replace(".", "_")
+        filename = filename or os.path.basename(path)
+
+        self.head = "\r\n".join([
+            f"From: {from_address}",
+            f"To: {to_address}",
+            f"Subject: {subject}",
+            f"Date: {formatdate(localtime=True)}",
+            f"Message-ID: {make_msgid()}",
+            "MIME-Version: 1.0",
+            f'Content-Type: multipart/mixed; boundary="{boundary}"',
+            "",
+            f"--{boundary}",
+            'Content-Type: text/plain; charset="utf-8"',
+            "Content-Transfer-Encoding: 7bit",
+            "",
+            "",
+            f"--{boundary}",
+            "Content-Type: application/octet-stream",
+            "Content-Transfer-Encoding: base64",
+            f"Content-Disposition: attachment; {attachment_filename_param(filename)}",
+            "",
+            "",
+        ]).encode('utf-8')
+        self.tail = f"--{boundary}--\r\n".encode('ascii')
+        self.size = len(self.head) + encoded_size(self.file_size) + len(self.tail)
+
+    def chunks(self):
+        """Yield the message bytes; at most READ_LINES base64 lines are held at once."""
+        yield self.head
+        with open(self.path, "rb") as f:
+            while True:
+                data = f.read(LINE_BYTES * READ_LINES)
+                if not data:
+                    break
+                lines = [base64.b64encode(data[i:i + LINE_BYTES]) for i in range(0, len(data), LINE_BYTES)]
+                yield b"\r\n".join(lines) + b"\r\n"
+        yield self.tail
+
+
+class KindleMailer:
+    """
+    Sends books over one reusable, authenticated SMTP connection. Safe to
+    share between threads (sends are serialized).
+    """
+
+    def __init__(self, host, port, username, password, from_address=None, idle_timeout=60,
+                 max_attachment_bytes=KINDLE_MAX_ATTACHMENT_BYTES, timeout=120):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.from_address = from_address or username
+        self.idle_timeout = idle_timeout
+        self.max_attachment_bytes = max_attachment_bytes
+        self.timeout = timeout
+        self.connection = None
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        import smtplib
+
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.ehlo()
+            if connection.has_extn('starttls'):
+                connection.starttls()
+                connection.ehlo()
+            if self.username:
+                connection.login(self.username, self.password)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def _get_connection(self):
+        """The open connection if it is fresh and still answers NOOP, else a new one."""
+        import smtplib
+
+        if self.connection is not None:
+            idle = time.monotonic() - self.last_used
+            alive = False
+            if idle < self.idle_timeout:
+                try:
+                    alive = self.connection.noop()[0] == 250
+                except (smtplib.SMTPException, OSError):
+                    pass
+            if not alive:
+                self._drop()
+        if self.connection is None:
+            self.connection = self._connect()
+        return self.connection
+
+    def _drop(self):
+        if self.connection is None:
+            return
+        import smtplib
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            self.connection.close()
+        self.connection = None
+
+    def check_size(self, path, filename=None):
+        """Raise AttachmentTooLarge if the book cannot be sent to a Kindle."""
+        size = os.path.getsize(path)
+        if self.max_attachment_bytes and size > self.max_attachment_bytes:
+            raise AttachmentTooLarge(
+                f"{filename or os.path.basename(path)} is {size / (1024 * 1024):.1f} MB; "
+                f"the Kindle limit is {self.max_attachment_bytes / (1024 * 1024):.0f} MB")
+        return size
+
+    def send(self, path, to_address, filename=None, subject=""):
+        """
+        Email one book. Retries once on a fresh connection if the kept one
+        turns out to be dead. Raises AttachmentTooLarge, DeliveryError or
+        smtplib exceptions on failure.
+        """
+        import smtplib
+
+        self.check_size(path, filename)
+        message = StreamedMessage(self.from_address, to_address, path, filename, subject)
+
+        with self.lock:
+            for attempt in range(2):
+                connection = self._get_connection()
+                try:
+                    self._transmit(connection, message, to_address)
+                    self.last_used = time.monotonic()
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    self.connection = None
+                    if attempt == 1:
+                        raise
+                except DeliveryError:
+                    raise
+                except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                    # Leave the connection usable for the next message
+                    try:
+                        connection.rset()
+                    except (smtplib.SMTPException, OSError):
+                        self.connection = None
+                    raise
+                except BaseException:
+                    self._drop()
+                    raise
+
+    def _transmit(self, connection, message, to_address):
+        """MAIL/RCPT/DATA with the body streamed from message.chunks()."""
+        import smtplib
+
+        options = []
+        if connection.has_extn('size'):
+            limit = connection.esmtp_features.get('size', '')
+            if limit.isdigit() and int(limit) and message.size > int(limit):
+                raise AttachmentTooLarge(
+                    f"Message is {message.size} bytes; the mail server accepts at most {limit}")
+            options.append(f"SIZE={message.size}")
+
+        code, response = connection.mail(self.from_address, options)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, response, self.from_address)
+        code, response = connection.rcpt(to_address)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({to_address: (code, response)})
+
+        connection.putcmd("data")
+        code, response = connection.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+        # No line can start with '.' (headers and base64 only), so no dot-stuffing is needed
+        for chunk in message.chunks():
+            connection.send(chunk)
+        connection.send(b".\r\n")
+        code, response = connection.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+
+    def close(self):
+        with self.lock:
+            self._drop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,156 @@
+"""
+Streaming writer for the navigation documents of page-numbered books.
+
+write_nav() emits an EPUB 3 nav document and write_ncx() an NCX, each with
+the book's own table of contents and a page list built from a PageIndex
+(page_injector.py). Both write to a binary file object piece by piece, so
+the page list of a 3,000-page book is never built up as one string.
+
+Tables of contents are passed as nodes: (title, href, children) tuples with
+hrefs relative to the OPF directory; toc_nodes() converts an ebooklib
+book.toc.
+"""
+import posixpath
+from urllib.parse import quote, unquote
+from xml.sax.saxutils import escape
+
+from page_injector import page_id
+
+
+def escape_attr(value):
+    return escape(value, {'"': "&quot;"})
+
+
+def toc_nodes(toc, base_dir=""):
+    """
+    Convert ebooklib's book.toc (Links, Sections, EpubHtml items and
+    (section, children) tuples) to nodes. base_dir is the directory the
+    hrefs are relative to, when that is not the OPF's (ebooklib keeps NCX
+    hrefs as they were written).
+    """
+    nodes = []
+    for entry in toc:
+        children = []
+        if isinstance(entry, (tuple, list)):
+            entry, children = entry[0], toc_nodes(entry[1], base_dir)
+        href = getattr(entry, 'href', None) or getattr(entry, 'file_name', None) or None
+        if href and base_dir:
+            href = posixpath.normpath(posixpath.join(base_dir, href))
+        title = getattr(entry, 'title', None) or ""
+        nodes.append((title, href, children))
+    return nodes
+
+
+def toc_depth(nodes):
+    return max((1 + toc_depth(children) for _, _, children in nodes), default=0)
+
+
+def relative_href(href, base_dir):
+    """An OPF-relative href as seen from base_dir, percent-encoded and escaped for an attribute."""
+    path, hash_mark, fragment = href.partition('#')
+    path = unquote(path)
+    if base_dir:
+        path = posixpath.relpath(path, base_dir)
+    return escape_attr(quote(path, safe="/") + hash_mark + fragment)
+
+
+def page_hrefs(pages, base_dir):
+    """Relative href of each chapter in pages.hrefs, computed once per chapter."""
+    return [relative_href(href, base_dir) for href in pages.hrefs]
+
+
+def write_nav(out, toc, pages, title="", language="en", nav_dir=""):
+    """
+    Write an EPUB 3 nav document to out: a toc nav with the nodes in toc and,
+    when pages is not empty, a hidden page-list nav. nav_dir is the nav
+    document's directory relative to the OPF.
+    """
+    language = escape_attr(language or "en")
+    out.write(b'<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n')
+    out.write(f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+              f'lang="{language}" xml:lang="{language}">\n'
+              f'<head><title>{escape(title or "Navigation")}</title></head>\n<body>\n'.encode('utf-8'))
+
+    out.write(b'<nav epub:type="toc" id="toc" role="doc-toc">\n<h1>Table of Contents</h1>\n')
+    _write_nav_list(out, toc, nav_dir)
+    out.write(b'</nav>\n')
+
+    if len(pages):
+        hrefs = page_hrefs(pages, nav_dir)
+        out.write(b'<nav epub:type="page-list" id="page-list" role="doc-pagelist" hidden="">\n<ol>\n')
+        for chapter, number in zip(pages.chapters, pages.numbers):
+            out.write(f'<li><a href="{hrefs[chapter]}#{page_id(number)}">{number}</a></li>\n'.encode('utf-8'))
+        out.write(b'</ol>\n</nav>\n')
+
+    out.write(b'</body>\n</html>\n')
+
+
+def _write_nav_list(out, nodes, nav_dir):
+    out.write(b'<ol>\n')
+    for title, href, children in nodes:
+        if href:
+            out.write(f'<li><a href="{relative_href(href, nav_dir)}">{escape(title)}</a>'.encode('utf-8'))
+        else:
+            out.write(f'<li><span>{escape(title)}</span>'.encode('utf-8'))
+        if children:
+            out.write(b'\n')
+            _write_nav_list(out, children, nav_dir)
+        out.write(b'</li>\n')
+    out.write(b'</ol>\n')
+
+
+def write_ncx(out, toc, pages, uid, title="", language="en", ncx_dir=""):
+    """
+    Write an NCX to out, for EPUB 2 readers: a navMap with the nodes in toc
+    and a pageList with the pages. ncx_dir is the NCX's directory relative
+    to the OPF.
+    """
+    language = escape_attr(language or "en")
+    max_page = pages.numbers[-1] if len(pages) else 0
+    out.write(b'<?xml version="1.0" encoding="utf-8"?>\n')
+    out.write(f'<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1" xml:lang="{language}">\n'
+              f'<head>\n<meta name="dtb:uid" content="{escape_attr(uid or "")}"/>\n'
+              f'<meta name="dtb:depth" content="{max(1, toc_depth(toc))}"/>\n'
+              f'<meta name="dtb:totalPageCount" content="{len(pages)}"/>\n'
+              f'<meta name="dtb:maxPageNumber" content="{max_page}"/>\n</head>\n'
+              f'<docTitle><text>{escape(title or "")}</text></docTitle>\n<navMap>\n'.encode('utf-8'))
+    play_order = _write_nav_points(out, toc, ncx_dir, 1)
+    out.write(b'</navMap>\n')
+
+    if len(pages):
+        hrefs = page_hrefs(pages, ncx_dir)
+        out.write(b'<pageList>\n<navLabel><text>Pages</text></navLabel>\n')
+        for chapter, number in zip(pages.chapters, pages.numbers):
+            out.write(f'<pageTarget id="pageTarget-{number}" type="normal" value="{number}" '
+                      f'playOrder="{play_order}"><navLabel><text>{number}</text></navLabel>'
+                      f'<content src="{hrefs[chapter]}#{page_id(number)}"/></pageTarget>\n'.encode('utf-8'))
+            play_order += 1
+        out.write(b'</pageList>\n')
+
+    out.write(b'</ncx>\n')
+
+
+def _first_href(nodes):
+    for _, href, children in nodes:
+        found = href or _first_href(children)
+        if found:
+            return found
+    return None
+
+
+def _write_nav_points(out, nodes, ncx_dir, play_order):
+    """Write the navPoints of nodes, numbering them from play_order. Returns the next number."""
+    for title, href, children in nodes:
+        # Entries without a target of their own point at their first child
+        href = href or _first_href(children)
+        if not href:
+            continue
+        out.write(f'<navPoint id="navPoint-{play_order}" playOrder="{play_order}">'
+                  f'<navLabel><text>{escape(title)}</text></navLabel>'
+                  f'<content src="{relative_href(href, ncx_dir)}"/>'.encode('utf-8'))
+        play_order += 1
+        if children:
+            out.write(b'\n')
+            play_order = _write_nav_points(out, children, ncx_dir, play_order)
+        out.write(b'</navPoint>\n')
+    return play_order
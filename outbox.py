@@ -0,0 +1,252 @@
+"""
+Durable outbox for Kindle deliveries.
+
+The send commands used to block on the SMTP upload, and a failed send was
+simply lost. Books to send are now moved into a spool directory and recorded
+in a SQLite job table; a background worker thread sends them, retrying
+failures with exponential backoff. Jobs survive restarts: anything still
+pending (or interrupted mid-send) is picked up again the next time the
+program starts.
+"""
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+# Delivered jobs are listed by the queue command for a week, then forgotten
+SENT_HISTORY_SECONDS = 7 * 24 * 60 * 60
+
+
+class PermanentDeliveryError(Exception):
+    """Raised by a sender for failures that retrying cannot fix."""
+
+
+class Outbox:
+    """
+    Spool directory plus job table. Safe to share between threads.
+
+    send(path, recipient, filename) is the function that delivers one job;
+    it raises on failure. Exceptions listed in `permanent_errors` fail the
+    job immediately instead of retrying.
+    """
+
+    def __init__(self, root, send, max_attempts=5, retry_base=30, retry_max=3600, permanent_errors=()):
+        self.root = root
+        self.spool_dir = os.path.join(root, "spool")
+        self.db_path = os.path.join(root, "outbox.sqlite3")
+        self.send = send
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.permanent_errors = (PermanentDeliveryError,) + tuple(permanent_errors)
+        self.lock = threading.Lock()
+        self.conn = None
+        self.wakeup = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.stopping = threading.Event()
+        self.worker = None
+
+    def _connect(self):
+        if self.conn is None:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " path TEXT NOT NULL,"
+                " filename TEXT NOT NULL,"
+                " recipient TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt_at REAL NOT NULL,"
+                " last_error TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, next_attempt_at)")
+            self.conn.commit()
+        return self.conn
+
+    def enqueue(self, path, recipient, filename=None, keep_original=False):
+        """
+        Add a delivery job. The file is moved into the spool (copied if
+        keep_original is set), so the caller can forget about it.
+        Returns the job id. Raises ValueError without a recipient.
+        """
+        if not recipient:
+            raise ValueError("A delivery needs a recipient address")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No such file: {path}")
+        job_id = uuid.uuid4().hex[:12]
+        filename = filename or os.path.basename(path)
+        with self.lock:
+            conn = self._connect()
+            spool_path = os.path.join(self.spool_dir, f"{job_id}_{filename}")
+            now = time.time()
+            # The row is committed only once the file is in the spool, so a
+            # failure on either side leaves neither a job without a file nor
+            # a spooled file without a job
+            conn.execute(
+                "INSERT INTO jobs (id, path, filename, recipient, status, attempts, next_attempt_at,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?)",
+                (job_id, spool_path, filename, recipient, PENDING, now, now, now),
+            )
+            try:
+                if keep_original:
+                    shutil.copyfile(path, spool_path)
+                else:
+                    shutil.move(path, spool_path)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                if keep_original and os.path.exists(spool_path):
+                    os.remove(spool_path)
+                elif not keep_original and os.path.exists(spool_path) and not os.path.exists(path):
+                    shutil.move(spool_path, path)
+                raise
+            self.idle.clear()
+            self.wakeup.set()
+        return job_id
+
+    def jobs(self, statuses=None):
+        """Jobs as dicts, oldest first, optionally filtered by status."""
+        with self.lock:
+            conn = self._connect()
+            query = "SELECT id, filename, recipient, status, attempts, next_attempt_at, last_error, created_at FROM jobs"
+            args = ()
+            if statuses:
+                query += " WHERE status IN ({})".format(",".join("?" * len(statuses)))
+                args = tuple(statuses)
+            rows = conn.execute(query + " ORDER BY created_at", args).fetchall()
+        keys = ("id", "filename", "recipient", "status", "attempts", "next_attempt_at", "last_error", "created_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def retry_failed(self):
+        """Put failed jobs back in the queue. Returns how many."""
+        with self.lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = ?",
+                (PENDING, time.time(), time.time(), FAILED))
+            conn.commit()
+            if cursor.rowcount:
+                self.idle.clear()
+                self.wakeup.set()
+        return cursor.rowcount
+
+    def purge_sent(self, older_than=0):
+        """Forget jobs delivered more than `older_than` seconds ago (their spool files are already gone)."""
+        with self.lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM jobs WHERE status = ? AND updated_at <= ?", (SENT, time.time() - older_than))
+            conn.commit()
+
+    def _claim(self):
+        """Mark the next due job as sending and return it, or return (None, seconds until one is due)."""
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT id, path, filename, recipient, attempts, next_attempt_at FROM jobs"
+                " WHERE status = ? ORDER BY next_attempt_at LIMIT 1", (PENDING,)).fetchone()
+            if row is None:
+                return None, None
+            now = time.time()
+            if row[5] > now:
+                return None, row[5] - now
+            conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (SENDING, now, row[0]))
+            conn.commit()
+        return dict(zip(("id", "path", "filename", "recipient", "attempts"), row)), None
+
+    def _finish(self, job, error=None):
+        now = time.time()
+        attempts = job["attempts"] + 1
+        if error is None:
+            status, next_attempt_at, message = SENT, now, None
+        elif isinstance(error, self.permanent_errors) or attempts >= self.max_attempts:
+            status, next_attempt_at, message = FAILED, now, str(error)
+        else:
+            delay = min(self.retry_max, self.retry_base * (2 ** (attempts - 1)))
+            status, next_attempt_at, message = PENDING, now + delay, str(error)
+
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?"
+                " WHERE id = ?", (status, attempts, next_attempt_at, message, now, job["id"]))
+            conn.commit()
+        job.update(status=status, attempts=attempts, next_attempt_at=next_attempt_at, last_error=message)
+        if status == SENT and os.path.exists(job["path"]):
+            os.remove(job["path"])
+        return status
+
+    def process_one(self):
+        """
+        Send the next due job, if any. Returns (job, status) or (None, seconds
+        until the next job is due / None when the queue is empty).
+        """
+        job, wait_seconds = self._claim()
+        if job is None:
+            return None, wait_seconds
+        if not os.path.exists(job["path"]):
+            return job, self._finish(job, PermanentDeliveryError("Spooled file is missing"))
+        try:
+            self.send(job["path"], job["recipient"], job["filename"])
+        except Exception as e:
+            return job, self._finish(job, e)
+        return job, self._finish(job)
+
+    def _run(self, on_result):
+        while not self.stopping.is_set():
+            job, result = self.process_one()
+            if job is not None:
+                if on_result:
+                    on_result(job, result)
+                continue
+            # Nothing due now; an enqueue that raced with the claim has set wakeup
+            with self.lock:
+                if not self.wakeup.is_set():
+                    self.idle.set()
+            self.wakeup.wait(timeout=result)
+            self.wakeup.clear()
+
+    def start(self, on_result=None):
+        """
+        Start the background worker. Jobs left 'sending' by an interrupted
+        run are queued again first. on_result(job, status) is called after
+        every attempt.
+        """
+        if self.worker is not None:
+            return
+        with self.lock:
+            conn = self._connect()
+            conn.execute("UPDATE jobs SET status = ? WHERE status = ?", (PENDING, SENDING))
+            conn.commit()
+        self.purge_sent(older_than=SENT_HISTORY_SECONDS)
+        self.idle.clear()
+        self.stopping.clear()
+        self.worker = threading.Thread(target=self._run, args=(on_result,), name="outbox-worker", daemon=True)
+        self.worker.start()
+
+    def wait_idle(self, timeout=None):
+        """
+        Block until no job is due now. Jobs waiting for a retry do not count;
+        they stay queued for later (or the next run).
+        """
+        return self.idle.wait(timeout)
+
+    def stop(self, timeout=None):
+        """Stop the worker after the current send; unsent jobs stay queued."""
+        if self.worker is None:
+            return
+        self.stopping.set()
+        self.wakeup.set()
+        self.worker.join(timeout)
+        self.worker = None
@@ -0,0 +1,281 @@
+"""
+Streaming page-marker injection.
+
+inject_page_numbers() originally parsed every chapter with BeautifulSoup,
+called get_text() on every p/div/span (so nested divs were counted more than
+once) and re-serialized the whole tree. The engine here walks each XHTML
+document once with a byte-level tokenizer, counts words on text nodes only,
+and splices the anchor spans in at byte offsets. Everything else in the
+document is left byte-for-byte as it was.
+
+Tokenizing is split from anchor placement so the expensive scan of large
+books can run on a process pool (inject_anchors_parallel). The pages found
+are collected in a PageIndex.
+"""
+import html
+import multiprocessing
+import os
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# Elements whose text counts towards pages, and before which anchors go
+BLOCK_TAGS = {b'p', b'div', b'span'}
+# Elements whose text is never counted
+SKIP_TAGS = {b'script', b'style', b'head', b'title'}
+
+# One token per match: comment, CDATA, processing instruction / doctype,
+# start/end/self-closing tag (quoted attribute values may contain '>'), or text
+TOKEN_PATTERN = re.compile(
+    rb'<!--.*?-->'
+    rb'|<!\[CDATA\[.*?\]\]>'
+    rb'|<[?!][^>]*>'
+    rb'|<(/?)([A-Za-z][\w:.-]*)((?:\s+[^\s=/>]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s>]+))?)*)\s*(/?)>'
+    rb'|[^<]+'
+    rb'|<',
+    re.S,
+)
+
+# Original engine skipped documents with fewer than 50 characters of text
+MIN_DOCUMENT_TEXT = 50
+
+
+def page_id(number):
+    """Anchor id of a synthetic page."""
+    return f"page-{number}"
+
+
+class PageIndex:
+    """
+    The synthetic pages of a book, in reading order, as two parallel arrays:
+    the index of the chapter each page is in (into hrefs) and its number.
+    A 3,000-page book costs a few KB instead of a dict per page.
+    """
+    __slots__ = ('hrefs', 'chapters', 'numbers')
+
+    def __init__(self):
+        self.hrefs = []
+        self.chapters = array('I')
+        self.numbers = array('I')
+
+    def add_chapter(self, href, numbers):
+        """Append the pages of one chapter."""
+        if not numbers:
+            return
+        self.hrefs.append(href)
+        self.chapters.extend(repeat(len(self.hrefs) - 1, len(numbers)))
+        self.numbers.extend(numbers)
+
+    def add(self, href, number):
+        """Append one page (consecutive pages of a chapter share its href entry)."""
+        if not self.hrefs or self.hrefs[-1] != href:
+            self.hrefs.append(href)
+        self.chapters.append(len(self.hrefs) - 1)
+        self.numbers.append(number)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        """Yield (href, number) per page."""
+        hrefs = self.hrefs
+        for chapter, number in zip(self.chapters, self.numbers):
+            yield hrefs[chapter], number
+
+    def first_href(self):
+        return self.hrefs[0] if self.hrefs else None
+
+
+def local_name(tag):
+    """Strip any namespace prefix and lowercase: b'html:P' -> b'p'."""
+    return tag.rsplit(b':', 1)[-1].lower()
+
+
+def count_words(text_bytes):
+    """Word count of a raw text node (entities decoded, Unicode whitespace)."""
+    return len(html.unescape(text_bytes.decode('utf-8', 'replace')).split())
+
+
+class ChapterScan:
+    """
+    Result of tokenizing one document: for every counted text node, its word
+    count, the offset of the innermost open p/div/span start tag and the
+    offset of the text node itself. Kept as plain lists so it pickles cheaply
+    back from a worker process.
+    """
+    __slots__ = ('word_counts', 'block_offsets', 'text_offsets', 'text_chars')
+
+    def __init__(self):
+        self.word_counts = []
+        self.block_offsets = []
+        self.text_offsets = []
+        self.text_chars = 0
+
+
+def scan_chapter(content):
+    """
+    Tokenize one XHTML document (the expensive part of injection).
+    Does not depend on any other chapter, so chapters can be scanned in parallel.
+    """
+    scan = ChapterScan()
+    open_blocks = []    # Byte offsets of the start tags of open p/div/span elements
+    skip_depth = 0
+
+    for match in TOKEN_PATTERN.finditer(content):
+        name = match.group(2)
+        if name is not None:
+            tag = local_name(name)
+            closing = match.group(1) == b'/'
+            self_closing = match.group(4) == b'/'
+            if closing:
+                if tag in SKIP_TAGS:
+                    skip_depth = max(0, skip_depth - 1)
+                elif tag in BLOCK_TAGS and open_blocks:
+                    open_blocks.pop()
+            elif not self_closing:
+                if tag in SKIP_TAGS:
+                    skip_depth += 1
+                elif tag in BLOCK_TAGS:
+                    open_blocks.append(match.start())
+            continue
+
+        token = match.group(0)
+        if token[:1] == b'<' or skip_depth:
+            continue
+
+        scan.text_chars += len(token.strip())
+        if open_blocks:
+            words = count_words(token)
+            if words:
+                scan.word_counts.append(words)
+                scan.block_offsets.append(open_blocks[-1])
+                scan.text_offsets.append(match.start())
+
+    return scan
+
+
+def place_anchors(scan, words_per_page, word_accumulator, page_count):
+    """
+    Decide where the anchors of one scanned chapter go, given the running
+    state at its start. Cheap (integer work only), so it runs serially.
+    Returns (splices, page_numbers, word_accumulator, page_count).
+    """
+    if scan.text_chars < MIN_DOCUMENT_TEXT:
+        # Too little text to count (cover pages, image-only documents)
+        return [], [], word_accumulator, page_count
+
+    splices = []        # (offset, anchor bytes), in increasing offset order
+    numbers = []
+    for words, block_offset, text_offset in zip(scan.word_counts, scan.block_offsets, scan.text_offsets):
+        word_accumulator += words
+        if word_accumulator >= words_per_page:
+            offset = block_offset
+            if splices and offset <= splices[-1][0]:
+                offset = text_offset
+
+            splices.append((offset, f'<span id="{page_id(page_count)}"></span>'.encode('utf-8')))
+            numbers.append(page_count)
+            page_count += 1
+            word_accumulator = 0
+
+    return splices, numbers, word_accumulator, page_count
+
+
+def apply_splices(content, splices):
+    """Insert the anchor bytes at their offsets; the rest is copied unchanged."""
+    if not splices:
+        return content
+    parts = []
+    previous = 0
+    for offset, anchor in splices:
+        parts.append(content[previous:offset])
+        parts.append(anchor)
+        previous = offset
+    parts.append(content[previous:])
+    return b''.join(parts)
+
+
+def inject_anchors(content, words_per_page=300, word_accumulator=0, page_count=1):
+    """
+    Insert `<span id="page-N"></span>` markers into one XHTML document.
+
+    Words are counted on text nodes inside p/div/span elements. Each time the
+    running count reaches words_per_page, an anchor is spliced in front of the
+    innermost open p/div/span (or in front of the text node itself if an
+    anchor already sits at or after that start tag), and the count starts
+    again.
+
+    word_accumulator and page_count carry the running state across chapters.
+    Returns (new_content, page_numbers, word_accumulator, page_count); the
+    anchor of page N has the id page_id(N).
+    """
+    splices, numbers, word_accumulator, page_count = place_anchors(
+        scan_chapter(content), words_per_page, word_accumulator, page_count)
+    return apply_splices(content, splices), numbers, word_accumulator, page_count
+
+
+def process_context():
+    """
+    Start method for the scan pool. Never fork: the caller's other threads
+    (the event loop, the outbox, the batch stages) may hold locks such as
+    stdout's, which a forked worker would inherit held. The forkserver
+    starts workers fastest where it exists (POSIX); spawn elsewhere.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def try_scan_chapter(content):
+    """scan_chapter() for the process pool: returns (scan, None), or (None, the exception) if it failed."""
+    try:
+        return scan_chapter(content), None
+    except Exception as e:
+        return None, e
+
+
+def inject_anchors_parallel(chapters, words_per_page=300, workers=None, word_accumulator=0, page_count=1,
+                            on_error=None):
+    """
+    Two-phase version of inject_anchors() over a whole book.
+
+    chapters is a list of (href, content) in spine order. Phase one scans all
+    chapters on a process pool; the only state shared between chapters (the
+    running word count and page number) is then carried through the scans
+    serially, which gives each chapter its starting state. Phase two splices
+    the anchors in. The output is byte-identical to calling inject_anchors()
+    on each chapter in order.
+
+    A chapter that fails is left unchanged and does not advance the running
+    state, like a chapter skipped by the serial loop; on_error(href,
+    exception) is called for it.
+
+    Returns (contents, page_index, word_accumulator, page_count), where
+    contents[i] is the new content of chapters[i] and page_index a PageIndex.
+    """
+    contents = [content for _, content in chapters]
+    chunksize = max(1, len(contents) // ((workers or os.cpu_count() or 1) * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) as executor:
+        scans = list(executor.map(try_scan_chapter, contents, chunksize=chunksize))
+
+    new_contents = []
+    pages = PageIndex()
+    for (href, content), (scan, error) in zip(chapters, scans):
+        try:
+            if error is not None:
+                raise error
+            splices, numbers, next_accumulator, next_count = place_anchors(
+                scan, words_per_page, word_accumulator, page_count)
+            # Splicing is a single join per chapter, cheaper than shipping the
+            # bytes to a worker again
+            new_content = apply_splices(content, splices)
+        except Exception as e:
+            if on_error is not None:
+                on_error(href, e)
+            new_contents.append(content)
+            continue
+        word_accumulator, page_count = next_accumulator, next_count
+        new_contents.append(new_content)
+        pages.add_chapter(href, numbers)
+
+    return new_contents, pages, word_accumulator, page_count
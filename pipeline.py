@@ -0,0 +1,158 @@
+"""
+Staged work pipeline with bounded queues.
+
+A Pipeline is a chain of named stages. Each stage has its own worker
+threads and a bounded input queue, so a slow stage makes the stages in front
+of it wait (backpressure) instead of piling up work in memory, and
+network, CPU and SMTP work for different items overlap. Stage functions are
+plain callables; CPU-heavy stages hand their work to a process pool from
+inside the function and wait for it, which keeps the worker thread free of
+the GIL while the process runs.
+
+Each stage records how many items it handled, how long its workers were
+busy, and the current and peak depth of its queue.
+"""
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One pipeline stage. func(item) returns the item to hand to the next
+    stage, or None when the item is finished early (it then goes straight to
+    the results). Exceptions are passed to the pipeline's on_error.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=queue_size or self.workers * 2)
+        self.lock = threading.Lock()
+        self.running = self.workers
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_depth = 0
+
+    def put(self, item):
+        self.queue.put(item)
+        depth = self.queue.qsize()
+        with self.lock:
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def record(self, seconds, failed):
+        with self.lock:
+            self.processed += 1
+            self.busy_seconds += seconds
+            if failed:
+                self.errors += 1
+
+
+class Pipeline:
+    """
+    Usage:
+        pipeline = Pipeline([Stage("fetch", fetch, workers=4), Stage("inject", inject, workers=2)])
+        pipeline.start()
+        feed items with pipeline.put(item) (blocks while the first queue is full),
+        then pipeline.close(); iterate pipeline.results() for finished items.
+
+    on_error(item, stage_name, exception) is called when a stage raises; the
+    item then counts as finished.
+    """
+
+    def __init__(self, stages, on_error=None):
+        self.stages = stages
+        self.on_error = on_error
+        self.output = queue.Queue()
+        self.threads = []
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        for index, stage in enumerate(self.stages):
+            for number in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(index,),
+                                          name=f"{stage.name}-{number}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        return self
+
+    def put(self, item):
+        self.stages[0].put(item)
+
+    def close(self):
+        """No more input; the stages finish what is queued and then stop."""
+        for _ in range(self.stages[0].workers):
+            self.stages[0].queue.put(_DONE)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is _DONE:
+                with stage.lock:
+                    stage.running -= 1
+                    last = stage.running == 0
+                if last:
+                    # Every worker of this stage is done: pass the end marker on
+                    if following is None:
+                        self.finished_at = time.monotonic()
+                        self.output.put(_DONE)
+                    else:
+                        for _ in range(following.workers):
+                            following.queue.put(_DONE)
+                return
+
+            started = time.monotonic()
+            failed = False
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                failed = True
+                result = None
+                if self.on_error:
+                    self.on_error(item, stage.name, e)
+            stage.record(time.monotonic() - started, failed)
+
+            if result is None:
+                self.output.put(item)
+            elif following is None:
+                self.output.put(result)
+            else:
+                # Blocks while the next stage is behind (backpressure)
+                following.put(result)
+
+    def results(self):
+        """Yield finished items as they complete, until the pipeline is drained."""
+        while True:
+            item = self.output.get()
+            if item is _DONE:
+                return
+            yield item
+
+    def stats(self):
+        """Per-stage counters: items, errors, busy time, utilization and queue depth."""
+        end = self.finished_at or time.monotonic()
+        elapsed = max(1e-9, end - (self.started_at or end))
+        rows = []
+        for stage in self.stages:
+            with stage.lock:
+                rows.append({
+                    "stage": stage.name,
+                    "workers": stage.workers,
+                    "processed": stage.processed,
+                    "errors": stage.errors,
+                    "busy_seconds": round(stage.busy_seconds, 3),
+                    "utilization": round(stage.busy_seconds / (stage.workers * elapsed), 3),
+                    "queue_depth": stage.queue.qsize(),
+                    "max_queue_depth": stage.max_depth,
+                    "queue_capacity": stage.queue.maxsize,
+                })
+        return rows
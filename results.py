@@ -0,0 +1,109 @@
+"""
+Columnar view of search results.
+
+The API returns a list of dicts with sizes as strings ('1.2MB', '500 KB').
+ResultSet parses the fields the selection logic needs (md5, title, author,
+extension and size in MB) once, into one column per field, so filtering by
+size or extension and sorting by size or relevance rank are plain passes
+over lists, done before any candidate is resolved or probed.
+
+A ResultSet is a column store plus an order (indices into the columns, in
+the order the rows are currently presented). filter/sort/head return new
+ResultSets sharing the same columns.
+"""
+import re
+from array import array
+from functools import lru_cache
+
+SIZE_PATTERN = re.compile(r'(\d+(?:\.\d*)?|\.\d+)\s*([KMGT]?B)?', re.IGNORECASE)
+SIZE_UNITS_MB = {'B': 1 / (1024 * 1024), 'KB': 1 / 1024, 'MB': 1.0, 'GB': 1024.0, 'TB': 1024.0 * 1024}
+
+
+@lru_cache(maxsize=4096)
+def parse_size_to_mb(size_str):
+    """
+    Convert size strings like '1.2MB', '500KB' to float MB.
+    Returns 0 if parsing fails or the unit is missing.
+    """
+    if not isinstance(size_str, str):
+        return 0
+    match = SIZE_PATTERN.search(size_str.replace(',', ''))
+    if match is None or match.group(2) is None:
+        return 0
+    return float(match.group(1)) * SIZE_UNITS_MB[match.group(2).upper()]
+
+
+class ResultSet:
+    """Search results as columns. Row i of the set is books[order[i]]."""
+
+    __slots__ = ('books', 'md5s', 'titles', 'authors', 'extensions', 'sizes_mb', 'order')
+
+    def __init__(self, books, md5s, titles, authors, extensions, sizes_mb, order):
+        self.books = books
+        self.md5s = md5s
+        self.titles = titles
+        self.authors = authors
+        self.extensions = extensions
+        self.sizes_mb = sizes_mb
+        self.order = order
+
+    @classmethod
+    def from_books(cls, books):
+        """Parse a list of API result dicts (their list position is the relevance rank)."""
+        books = list(books or [])
+        return cls(books,
+                   [book.get('md5') or "" for book in books],
+                   [book.get('title') or "" for book in books],
+                   [book.get('author') or "" for book in books],
+                   [(book.get('format') or book.get('extension') or "").lower() for book in books],
+                   array('d', (parse_size_to_mb(book.get('size') or "") for book in books)),
+                   array('I', range(len(books))))
+
+    def _with_order(self, order):
+        return ResultSet(self.books, self.md5s, self.titles, self.authors, self.extensions, self.sizes_mb,
+                         array('I', order))
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        """Yield the API dicts, in the set's order."""
+        books = self.books
+        return (books[index] for index in self.order)
+
+    def __getitem__(self, position):
+        return self.books[self.order[position]]
+
+    def filter(self, max_size_mb=None, ext=None, known_size=False):
+        """
+        Keep the rows up to max_size_mb (unparseable sizes count as 0, as
+        they always have) and with extension ext. known_size drops rows
+        whose size could not be parsed.
+        """
+        sizes, extensions = self.sizes_mb, self.extensions
+        order = self.order
+        if max_size_mb:
+            order = [index for index in order if sizes[index] <= max_size_mb]
+        if known_size:
+            order = [index for index in order if sizes[index] > 0]
+        if ext:
+            ext = ext.lower()
+            order = [index for index in order if extensions[index] == ext]
+        return self._with_order(order)
+
+    def sort_by_size(self, descending=False):
+        """Smallest first (largest with descending); unparseable sizes go last. Ties keep their rank."""
+        sizes = self.sizes_mb
+        unknown = float('-inf') if descending else float('inf')
+        return self._with_order(sorted(self.order, key=lambda index: sizes[index] or unknown, reverse=descending))
+
+    def sort_by_rank(self):
+        """Back to the API's relevance order."""
+        return self._with_order(sorted(self.order))
+
+    def head(self, count):
+        return self._with_order(self.order[:count])
+
+    def rank_of(self, position):
+        """Relevance rank (0 = the API's top result) of the row at position."""
+        return self.order[position]
@@ -0,0 +1,122 @@
+"""
+Fan-out search: one title, several API queries.
+
+A single /search call with one spelling, one extension and one source list
+often comes back empty (a subtitle, punctuation, "Title by Author" typed as
+one string, an ISBN with hyphens). query_variants() derives the spellings
+worth trying and fanout_params() combines them with the extensions and
+sources to query. BookClient.search_fanout runs those queries concurrently
+and merges what they return into a MergedResults: one entry per md5, ranked
+by reciprocal rank fusion over the queries that found it.
+"""
+import re
+import unicodedata
+
+# Reciprocal rank fusion: a book scores 1 / (RANK_FUSION_K + rank) per query
+# that returned it, so books found by several queries rise above books
+# ranked high by only one
+RANK_FUSION_K = 60
+
+ISBN_PATTERN = re.compile(r'\b(?:97[89][-\s]?)?(?:\d[-\s]?){9}[\dXx]\b')
+BY_PATTERN = re.compile(r'\s+by\s+', re.IGNORECASE)
+
+
+def normalize_title(text):
+    """Lowercase, accents and punctuation removed, subtitle ('Title: Subtitle') dropped."""
+    text = unicodedata.normalize('NFKD', text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    title, colon, _ = text.partition(':')
+    if colon and len(title.strip()) >= 3:
+        text = title
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def find_isbn(text):
+    """The first ISBN-10/13 in text, without hyphens or spaces, or None."""
+    match = ISBN_PATTERN.search(text)
+    return re.sub(r'[-\s]', "", match.group(0)).upper() if match else None
+
+
+def query_variants(text, author=None):
+    """
+    The search strings to try for what the user typed, best first: the text
+    as typed, the ISBN in it, the normalized title and the title with the
+    author appended ("Title by Author" is split, or author is given).
+    Variants that only differ in case or spacing are dropped.
+    """
+    text = " ".join(text.split())
+    variants = [text]
+    isbn = find_isbn(text)
+    if isbn:
+        variants.append(isbn)
+    else:
+        parts = BY_PATTERN.split(text, maxsplit=1)
+        title = normalize_title(parts[0])
+        author = author or (parts[1] if len(parts) == 2 else None)
+        variants.append(title)
+        if author:
+            variants.append(f"{title} {normalize_title(author)}")
+
+    unique = []
+    for variant in variants:
+        if variant and variant.lower() not in (seen.lower() for seen in unique):
+            unique.append(variant)
+    return unique
+
+
+def fanout_params(text, exts=("epub",), sources=(), sort="mostRelevant", author=None, max_queries=None):
+    """
+    API parameter sets for a fan-out search, most promising first: every
+    variant with the first source, then the other sources. An empty source
+    ("" or None) searches all sources. max_queries caps the list.
+    """
+    params = []
+    for source in sources or (None,):
+        for variant in query_variants(text, author):
+            for ext in exts:
+                query = {"q": variant, "ext": ext, "sort": sort}
+                if source:
+                    query["source"] = source
+                params.append(query)
+    return params[:max_queries] if max_queries else params
+
+
+class MergedResults:
+    """
+    Books from several queries, one per md5 (case-insensitive), in the order
+    of their combined rank. Books are kept as the first query returned them.
+    """
+
+    def __init__(self, k=RANK_FUSION_K):
+        self.k = k
+        self.books = {}     # md5 -> book, in first-seen order
+        self.scores = {}
+        self.hits = {}      # md5 -> number of queries that returned it
+        self.queries = 0
+
+    def __len__(self):
+        return len(self.books)
+
+    def add(self, books):
+        """Merge one query's Book records (in its rank order). Returns the books not seen before."""
+        new = []
+        counted = set()
+        for rank, book in enumerate(books, 1):
+            key = (book.md5 or "").lower()
+            if not key or key in counted:
+                continue
+            counted.add(key)
+            if key not in self.books:
+                self.books[key] = book
+                self.scores[key] = 0.0
+                self.hits[key] = 0
+                new.append(book)
+            self.scores[key] += 1.0 / (self.k + rank)
+            self.hits[key] += 1
+        self.queries += 1
+        return new
+
+    def ranked(self):
+        """The books, best combined rank first (ties keep the order they were found in)."""
+        scores = self.scores
+        return [self.books[key] for key in sorted(self.books, key=lambda key: -scores[key])]
@@ -0,0 +1,283 @@
+"""
+Resumable, segmented downloader.
+
+When the file host answers range requests, large files are split into
+byte-range segments that are fetched in parallel and written straight into a
+preallocated `<dest>.part` file with os.pwrite. Progress is recorded in a
+`<dest>.manifest.json` sidecar, so an interrupted download resumes where each
+segment stopped instead of starting again from zero. The read chunk size of
+each segment adapts to its measured throughput. Segments are asyncio tasks
+on the shared connection pool of async_http, so many downloads can run at
+once without a thread per segment.
+
+Hosts without range support get a plain single-stream download.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+from async_http import get_async_client, retry_errors, run_sync
+
+MIN_CHUNK = 16 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+INITIAL_CHUNK = 64 * 1024
+TARGET_CHUNK_SECONDS = 0.25     # Aim for one chunk every quarter second
+MANIFEST_SAVE_INTERVAL = 1.0    # Seconds between manifest writes
+SEGMENT_RETRIES = 3
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadCancelled(DownloadError):
+    pass
+
+
+class AdaptiveChunker:
+    """
+    Picks the next read size from the last one's throughput: fast chunks grow
+    the size (fewer Python-level iterations), slow ones shrink it (finer
+    progress and smaller loss on a dropped connection).
+    """
+
+    def __init__(self, size=INITIAL_CHUNK):
+        self.size = size
+
+    def update(self, nbytes, seconds):
+        if nbytes < self.size:
+            return
+        if seconds < TARGET_CHUNK_SECONDS / 2:
+            self.size = min(MAX_CHUNK, self.size * 2)
+        elif seconds > TARGET_CHUNK_SECONDS * 2:
+            self.size = max(MIN_CHUNK, self.size // 2)
+
+
+async def probe_remote_async(url, headers=None, client=None):
+    """
+    Ask for the first byte to learn the size and whether ranges work.
+    Returns (total_size or None, supports_ranges, validator).
+    """
+    request_headers = dict(headers or {})
+    request_headers['Range'] = 'bytes=0-0'
+    async with (client or get_async_client()).stream(url, headers=request_headers) as r:
+        validator = r.headers.get('ETag') or r.headers.get('Last-Modified')
+        content_range = r.headers.get('Content-Range', '')
+        if r.status == 206 and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            if total.isdigit():
+                # Drain the one byte so the connection goes back to the pool
+                await r.read()
+                return int(total), True, validator
+        r.raise_for_status()
+        length = r.headers.get('content-length')
+        return (int(length) if length and length.isdigit() else None), False, validator
+
+
+def plan_segments(total_size, segments, min_segment_size):
+    """Split [0, total_size) into at most `segments` ranges of at least min_segment_size."""
+    count = max(1, min(segments, total_size // max(1, min_segment_size)))
+    step = -(-total_size // count)
+    return [{'start': start, 'end': min(start + step, total_size) - 1, 'done': 0}
+            for start in range(0, total_size, step)]
+
+
+_seek_lock = threading.Lock()
+
+
+def pwrite(fd, data, offset):
+    """os.pwrite where available, seek+write otherwise (Windows)."""
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+
+class Manifest:
+    """Sidecar file recording the segment plan and how much of each is done."""
+
+    def __init__(self, path, total_size, validator, segments):
+        self.path = path
+        self.total_size = total_size
+        self.validator = validator
+        self.segments = segments
+        self.lock = threading.Lock()
+        self.last_saved = 0.0
+
+    @classmethod
+    def load(cls, path, total_size, validator):
+        """Return the saved manifest if it describes the same file, else None."""
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('total_size') != total_size:
+            return None
+        if validator and data.get('validator') and data['validator'] != validator:
+            return None
+        return cls(path, total_size, validator, data['segments'])
+
+    def downloaded(self):
+        return sum(segment['done'] for segment in self.segments)
+
+    def advance(self, segment, nbytes):
+        with self.lock:
+            segment['done'] += nbytes
+        if time.monotonic() - self.last_saved >= MANIFEST_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            data = {'total_size': self.total_size, 'validator': self.validator, 'segments': self.segments}
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+            self.last_saved = time.monotonic()
+
+
+async def read_chunk(stream, size):
+    """Read `size` bytes from an aiohttp stream, fewer only at the end of the body."""
+    try:
+        return await stream.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+
+
+async def _fetch_segment(client, url, headers, fd, segment, manifest, progress, cancel_event):
+    """Download the rest of one segment, retrying from where it stopped."""
+    chunker = AdaptiveChunker()
+
+    for attempt in range(SEGMENT_RETRIES + 1):
+        start = segment['start'] + segment['done']
+        if start > segment['end']:
+            return
+        request_headers = dict(headers or {})
+        request_headers['Range'] = f"bytes={start}-{segment['end']}"
+        request_headers['Accept-Encoding'] = 'identity'
+        try:
+            async with client.stream(url, headers=request_headers) as r:
+                if r.status != 206:
+                    raise DownloadError(f"Range request returned status {r.status}")
+                offset = start
+                while offset <= segment['end']:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise DownloadCancelled("download cancelled")
+                    began = time.monotonic()
+                    chunk = await read_chunk(r.content, min(chunker.size, segment['end'] + 1 - offset))
+                    if not chunk:
+                        raise DownloadError("Connection closed before the segment was complete")
+                    pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    chunker.update(len(chunk), time.monotonic() - began)
+                    manifest.advance(segment, len(chunk))
+                    if progress:
+                        progress(manifest.downloaded(), manifest.total_size)
+            return
+        except DownloadCancelled:
+            raise
+        except Exception:
+            if attempt == SEGMENT_RETRIES:
+                raise
+            await asyncio.sleep(client.backoff(attempt))
+
+
+async def _download_single_stream(client, url, headers, part_path, progress, cancel_event, total_size):
+    """Plain download for hosts without range support (cannot resume)."""
+    chunker = AdaptiveChunker()
+    downloaded = 0
+    async with client.stream(url, headers=headers) as r:
+        r.raise_for_status()
+        with open(part_path, "wb") as f:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise DownloadCancelled("download cancelled")
+                began = time.monotonic()
+                try:
+                    chunk = await read_chunk(r.content, chunker.size)
+                except retry_errors() as e:
+                    raise DownloadError(f"Connection lost after {downloaded} bytes: {e}") from e
+                if not chunk:
+                    break
+                f.write(chunk)
+                downloaded += len(chunk)
+                chunker.update(len(chunk), time.monotonic() - began)
+                if progress:
+                    progress(downloaded, total_size or 0)
+        # content-length counts encoded bytes, so only compare plain bodies
+        if total_size and downloaded != total_size and not r.headers.get('Content-Encoding'):
+            raise DownloadError(f"Expected {total_size} bytes, received {downloaded}")
+
+
+async def download_file_async(url, dest_path, headers=None, segments=4, min_segment_size=4 * 1024 * 1024,
+                              progress=None, cancel_event=None, client=None):
+    """
+    Download url to dest_path, resuming an earlier interrupted attempt when a
+    matching manifest exists. Files smaller than min_segment_size use a single
+    (still resumable) range stream. Segments run as concurrent tasks on the
+    async connection pool (client, an AsyncHttpClient; the shared one by
+    default).
+
+    progress(downloaded_bytes, total_bytes) is called as data arrives.
+    Raises DownloadError/DownloadCancelled on failure; after a failure the
+    .part and manifest files are kept so the next call can resume.
+    """
+    part_path = dest_path + ".part"
+    manifest_path = dest_path + ".manifest.json"
+
+    client = client or get_async_client()
+    total_size, supports_ranges, validator = await probe_remote_async(url, headers, client)
+
+    if not supports_ranges or not total_size:
+        try:
+            await _download_single_stream(client, url, headers, part_path, progress, cancel_event, total_size)
+        except BaseException:
+            if os.path.exists(part_path): os.remove(part_path)
+            raise
+        os.replace(part_path, dest_path)
+        return dest_path
+
+    manifest = None
+    if os.path.exists(part_path) and os.path.getsize(part_path) == total_size:
+        manifest = Manifest.load(manifest_path, total_size, validator)
+    if manifest is None:
+        manifest = Manifest(manifest_path, total_size, validator,
+                            plan_segments(total_size, segments, min_segment_size))
+        # Preallocate so every segment can write at its own offset
+        with open(part_path, "wb") as f:
+            f.truncate(total_size)
+        manifest.save()
+
+    fd = os.open(part_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        pending = [segment for segment in manifest.segments
+                   if segment['start'] + segment['done'] <= segment['end']]
+        results = await asyncio.gather(
+            *(_fetch_segment(client, url, headers, fd, segment, manifest, progress, cancel_event) for segment in pending),
+            return_exceptions=True)
+    finally:
+        os.close(fd)
+        manifest.save()
+
+    for error in results:
+        if isinstance(error, BaseException):
+            raise error
+
+    os.replace(part_path, dest_path)
+    os.remove(manifest_path)
+    return dest_path
+
+
+def download_file(url, dest_path, headers=None, segments=4, min_segment_size=4 * 1024 * 1024,
+                  progress=None, cancel_event=None, client=None):
+    """Blocking wrapper around download_file_async (runs on the shared event loop)."""
+    return run_sync(download_file_async(url, dest_path, headers, segments, min_segment_size,
+                                        progress, cancel_event, client))